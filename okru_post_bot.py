@@ -5,80 +5,865 @@ import logging
 import sys
 import threading
 import asyncio
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import collections
+import contextlib
+import contextvars
+import functools
+import hmac
+import itertools
+import math
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium.common.exceptions import TimeoutException, WebDriverException
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
-from flask import Flask, request, jsonify
 import json
+import multiprocessing
+import multiprocessing.connection
+
+BOOT_STARTED = time.monotonic()
+
+# Тяжёлые библиотеки грузятся при первой необходимости, чтобы /health поднимался сразу:
+# Selenium и undetected_chromedriver - при первом запуске Chrome, Telegram - при сборке Application
+uc = By = Keys = None
+Bot = InlineKeyboardButton = InlineKeyboardMarkup = Update = None
+BadRequest = RetryAfter = TelegramError = None
+Application = CommandHandler = CallbackQueryHandler = MessageHandler = filters = None
+_imports_lock = threading.Lock()
+
+def load_selenium():
+    global uc, By, Keys
+    with _imports_lock:
+        if uc is not None:
+            return
+        started = time.monotonic()
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+        import undetected_chromedriver as uc
+        logger.info(f"📦 Selenium загружен за {time.monotonic() - started:.2f} сек")
+
+def load_telegram():
+    global Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update, BadRequest, RetryAfter, TelegramError
+    global Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+    with _imports_lock:
+        if Bot is not None:
+            return
+        started = time.monotonic()
+        from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+        from telegram.error import BadRequest, RetryAfter, TelegramError
+        from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+        from telegram import Bot
+        logger.info(f"📦 python-telegram-bot загружен за {time.monotonic() - started:.2f} сек")
 
 # Настройки из ENV
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_USER_ID = os.getenv("TELEGRAM_USER_ID")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Например: https://your-app.onrender.com/webhook
 USE_WEBHOOK = os.getenv("USE_WEBHOOK", "false").lower() == "true"
+WEBHOOK_SERVER = os.getenv("WEBHOOK_SERVER", "asgi").lower()  # asgi - общий цикл с Application, flask - старый режим
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "16"))  # Сколько апдейтов обрабатывается одновременно
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+OK_BASE_URL = os.getenv("OK_BASE_URL", "https://ok.ru").rstrip("/")  # Для бенчмарков - адрес локальной подмены
+DRIVER_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", "1"))  # Сколько Chrome держать прогретыми
+DRIVER_POOL_WARM_URL = os.getenv("DRIVER_POOL_WARM_URL", f"{OK_BASE_URL}/")
+DRIVER_POOL_CHECK_INTERVAL = int(os.getenv("DRIVER_POOL_CHECK_INTERVAL", "30"))  # Секунды между проверками
+CHROMEDRIVER_CACHE_DIR = os.path.expanduser(
+    os.getenv("CHROMEDRIVER_CACHE_DIR", "~/.cache/okru-bot/chromedriver")
+)  # Пропатченные chromedriver по версиям Chrome; пусто - скачивать при каждом запуске, как раньше
+CHROME_BIN = os.getenv("CHROME_BIN", "")  # Путь к Chrome; по умолчанию ищет undetected_chromedriver
+PAGE_LOAD_STRATEGY = os.getenv("PAGE_LOAD_STRATEGY", "eager")  # normal | eager | none
+NETWORK_BLOCK_TYPES = os.getenv("NETWORK_BLOCK_TYPES", "image,media,font")  # Типы ресурсов, которые не грузим
+NETWORK_DENY = os.getenv("NETWORK_DENY", "")  # Доп. шаблоны блокировки через запятую: *counter.example*
+NETWORK_ALLOW = os.getenv("NETWORK_ALLOW", "")  # Исключения (синтаксис URLPattern): https://*.okcdn.ru/*
+NETWORK_STATS = os.getenv("NETWORK_STATS", "true").lower() == "true"  # Логировать вес и время страниц
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR", "sessions")  # Куки, localStorage и профили Chrome
+SESSION_STORE_USER_DATA = os.getenv("SESSION_STORE_USER_DATA", "false").lower() == "true"
+POST_PARALLELISM = int(os.getenv("POST_PARALLELISM", "1"))  # Сколько вкладок постят одновременно
+CAMPAIGN_DB = os.getenv("CAMPAIGN_DB", "campaigns.db")  # SQLite с кампаниями и статусом по группам
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # Попыток на одну группу
+CAMPAIGN_AUTO_RESUME = os.getenv("CAMPAIGN_AUTO_RESUME", "true").lower() == "true"
+POST_RATE_PER_HOUR = float(os.getenv("POST_RATE_PER_HOUR", "0"))  # Целевой темп постов на аккаунт, 0 - без темпа (только паузы после ограничений)
+POST_BURST = int(os.getenv("POST_BURST", "3"))  # Сколько постов можно отправить подряд без паузы
+POST_JITTER = float(os.getenv("POST_JITTER", "0.3"))  # Случайная добавка к паузе, доля интервала
+THROTTLE_BACKOFF = float(os.getenv("THROTTLE_BACKOFF", "120"))  # Первая пауза после ограничения OK.ru, сек
+THROTTLE_MAX_BACKOFF = float(os.getenv("THROTTLE_MAX_BACKOFF", "3600"))
+DRIVER_MAX_POSTS = int(os.getenv("DRIVER_MAX_POSTS", "150"))  # После стольких постов Chrome перезапускается, 0 - никогда
+DRIVER_MAX_RSS_MB = int(os.getenv("DRIVER_MAX_RSS_MB", "1500"))  # Порог памяти дерева процессов Chrome, 0 - без порога
+REAPER_INTERVAL = int(os.getenv("REAPER_INTERVAL", "60"))  # Секунды между поисками осиротевших Chrome
+TELEGRAM_MIN_INTERVAL = float(os.getenv("TELEGRAM_MIN_INTERVAL", "1.0"))  # Пауза между запросами в один чат
+TELEGRAM_BATCH_WINDOW = float(os.getenv("TELEGRAM_BATCH_WINDOW", "0.5"))  # Окно склейки статусов
+SMS_CODE_TIMEOUT = int(os.getenv("SMS_CODE_TIMEOUT", "120"))  # Секунды ожидания команд из Telegram
+GROUPS_TIMEOUT = int(os.getenv("GROUPS_TIMEOUT", "1800"))
+POST_INFO_TIMEOUT = int(os.getenv("POST_INFO_TIMEOUT", "1800"))
+GROUP_FILE_MAX_MB = float(os.getenv("GROUP_FILE_MAX_MB", "20"))  # Больше Telegram боту не отдаёт
+# Таймауты ожидания страницы по шагам (секунды) - ожидание заканчивается, как только страница готова
+LOGIN_SUBMIT_TIMEOUT = float(os.getenv("LOGIN_SUBMIT_TIMEOUT", "15"))
+CONFIRM_IDENTITY_TIMEOUT = float(os.getenv("CONFIRM_IDENTITY_TIMEOUT", "3"))
+SMS_FORM_TIMEOUT = float(os.getenv("SMS_FORM_TIMEOUT", "10"))
+PREVIEW_TIMEOUT = float(os.getenv("PREVIEW_TIMEOUT", "10"))
+POST_SUBMIT_TIMEOUT = float(os.getenv("POST_SUBMIT_TIMEOUT", "5"))
+TEXT_INPUT_MODE = os.getenv("TEXT_INPUT_MODE", "insert").lower()  # insert - текст поста одной вставкой, keys - посимвольно
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # NDJSON со спанами; пусто - трассировка выключена
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR", "")  # Профиль каждой кампании в формате folded stacks
+SESSION_MODE = os.getenv("SESSION_MODE", "loop").lower()  # loop - общий цикл, process - процесс на профиль, distributed - узлы
+WORKER_MAX_RESTARTS = int(os.getenv("WORKER_MAX_RESTARTS", "3"))  # Перезапусков упавшего процесса профиля подряд
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "120"))  # Молчащий дольше процесс считается зависшим
+WORKER_CPU_AFFINITY = os.getenv("WORKER_CPU_AFFINITY", "true").lower() == "true"  # Раскладывать процессы по ядрам
+DISPATCHER_URL = os.getenv("DISPATCHER_URL", "").rstrip("/")  # Задан - процесс работает узлом постинга этого диспетчера
+NODE_ID = os.getenv("NODE_ID") or socket.gethostname()  # Имя узла; по нему профили возвращаются на тот же узел
+NODE_TOKEN = os.getenv("NODE_TOKEN", "")  # Общий секрет диспетчера и узлов (заголовок X-Node-Token)
+NODE_CAPACITY = int(os.getenv("NODE_CAPACITY", "4"))  # Сколько профилей узел ведёт одновременно
+NODE_TIMEOUT = float(os.getenv("NODE_TIMEOUT", "30"))  # Молчащий дольше узел считается потерянным, профили переезжают
 
-# Проверка переменной окружения
-if not TELEGRAM_TOKEN:
+# Проверка переменной окружения (узлу постинга Telegram не нужен - с ним говорит диспетчер)
+if not TELEGRAM_TOKEN and not DISPATCHER_URL:
     raise RuntimeError("Не задана обязательная переменная окружения: TELEGRAM_BOT_TOKEN")
 
-if not TELEGRAM_USER_ID:
+if not TELEGRAM_USER_ID and not DISPATCHER_URL:
     raise RuntimeError("Не задана обязательная переменная окружения: TELEGRAM_USER_ID")
 
+if (SESSION_MODE == "distributed" or DISPATCHER_URL) and not NODE_TOKEN:
+    raise RuntimeError("Не задана обязательная переменная окружения: NODE_TOKEN")
+
 # Логирование
 logging.basicConfig(format="%(asctime)s | %(levelname)s | %(message)s", level=logging.INFO)
 logger = logging.getLogger("okru_bot")
 
-# Глобальные переменные для сессии и ожидания команд
-current_session = None
-current_profile = None
-waiting_for_sms = False
-waiting_for_groups = False
-waiting_for_post = False
-sms_code_received = None
-groups_received = None
-post_info_received = None
+# Реестр активных сессий: profile_id -> OKSession
+sessions = {}
+sessions_lock = threading.Lock()
+active_profile = None  # Профиль, чья панель управления открыта последней
 bot_running = True
 
-# Flask app
-app = Flask(__name__)
+# Flask app (создаётся в create_flask_app, только в режимах polling и flask)
+app = None
 
-# Telegram приложение (глобальная переменная)
+# Telegram приложение (глобальная переменная, собирается в build_application)
 application = None
+application_loop = None  # Цикл событий Application в режиме WEBHOOK_SERVER=flask
+bot_ready = threading.Event()  # Application собрано, хранилище кампаний восстановлено
 
-# Функция для отправки сообщений в Telegram
-async def send_telegram_message(text):
-    try:
-        bot = Bot(token=TELEGRAM_TOKEN)
-        await bot.send_message(chat_id=TELEGRAM_USER_ID, text=text)
-    except Exception as e:
-        logger.error(f"Ошибка отправки сообщения в Telegram: {e}")
+# Метрики в текстовом формате Prometheus, отдаются на /metrics
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class Counter:
+    kind = "counter"
 
-@app.route('/')
-def health_check():
-    return jsonify({"status": "ok", "message": "Bot is running"})
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._reported = {}  # значения на момент прошлого delta()
+        self._lock = threading.Lock()
 
-@app.route('/health')
-def health():
-    return jsonify({"status": "healthy"})
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
 
-@app.route('/webhook', methods=['POST'])
-async def webhook():
-    """Обработчик webhook от Telegram"""
-    if request.content_type == 'application/json':
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+    def delta(self):
+        """Прирост с прошлого вызова: [[значения меток, прирост], ...]"""
+        with self._lock:
+            changes = [
+                [list(key), value - self._reported.get(key, 0)]
+                for key, value in self._values.items() if value != self._reported.get(key, 0)
+            ]
+            self._reported = dict(self._values)
+        return changes
+
+    def merge(self, changes):
+        with self._lock:
+            for key, amount in changes:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge:
+    """Значение считается в момент запроса /metrics"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.func = func  # без меток возвращает число, с метками - пары (значения меток, число)
+
+    def samples(self):
         try:
-            update_data = request.get_json()
-            update = Update.de_json(update_data, application.bot)
-            await application.process_update(update)
-            return jsonify({"status": "ok"})
+            value = self.func()
         except Exception as e:
-            logger.error(f"Ошибка обработки webhook: {e}")
-            return jsonify({"status": "error", "message": str(e)}), 500
-    return jsonify({"status": "error", "message": "Invalid content type"}), 400
+            logger.debug(f"Метрика {self.name} недоступна: {e}")
+            return []
+        if self.labels:
+            return [(self.name, tuple(key), (), v) for key, v in value]
+        return [(self.name, (), (), value)]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [счётчики по корзинам, сумма, количество]
+        self._reported = {}  # копия _series на момент прошлого delta()
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return HistogramTimer(self, labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    result.append((f"{self.name}_bucket", key, (("le", f"{bound:g}"),), bucket_count))
+                result.append((f"{self.name}_bucket", key, (("le", "+Inf"),), count))
+                result.append((f"{self.name}_sum", key, (), round(total, 6)))
+                result.append((f"{self.name}_count", key, (), count))
+        return result
+
+    def delta(self):
+        """Прирост с прошлого вызова: [[значения меток, корзины, сумма, количество], ...]"""
+        with self._lock:
+            changes = []
+            for key, (counts, total, count) in self._series.items():
+                old_counts, old_total, old_count = self._reported.get(key, ([0] * len(counts), 0.0, 0))
+                if count != old_count:
+                    changes.append([list(key), [c - o for c, o in zip(counts, old_counts)], total - old_total, count - old_count])
+            self._reported = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        return changes
+
+    def merge(self, changes):
+        with self._lock:
+            for key, counts, total, count in changes:
+                if len(counts) != len(self.buckets):
+                    raise ValueError(f"{self.name}: другой набор корзин")
+                series = self._series.setdefault(tuple(key), [[0] * len(self.buckets), 0.0, 0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+
+class HistogramTimer:
+    """with metric.time(step=...): - замеряет длительность блока"""
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+        return False
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def delta(self):
+        """Прирост счётчиков и гистограмм с прошлого вызова - процессы профилей и узлы пересылают его
+        в процесс с /metrics"""
+        changes = {}
+        for metric in self._metrics:
+            if hasattr(metric, 'delta'):
+                entries = metric.delta()
+                if entries:
+                    changes[metric.name] = entries
+        return changes
+
+    def merge(self, changes):
+        by_name = {metric.name: metric for metric in self._metrics if hasattr(metric, 'merge')}
+        for name, entries in changes.items():
+            if name in by_name:
+                by_name[name].merge(entries)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{format_labels(metric.labels, key, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+def combine_metric_deltas(first, second):
+    """Два прироста metrics.delta() в один (непереданный прирост узла копится до следующей попытки)"""
+    return {name: first.get(name, []) + second.get(name, []) for name in set(first) | set(second)}
+
+def count_chrome_processes():
+    """Процессы Chrome/chromedriver в контейнере (по /proc)"""
+    return sum(1 for info in snapshot_processes().values() if is_chrome_process(info))
+
+metrics = MetricsRegistry()
+METRIC_INIT_DRIVER = metrics.register(Histogram(
+    "okbot_init_driver_seconds", "Время получения драйвера сессией", ["source"]))
+METRIC_CHROME_LAUNCH = metrics.register(Histogram(
+    "okbot_chrome_launch_seconds", "Время запуска Chrome с учётом повторов"))
+METRIC_AUTH_PHASE = metrics.register(Histogram(
+    "okbot_auth_phase_seconds", "Длительность шагов authenticate()", ["phase"]))
+METRIC_PREVIEW_WAIT = metrics.register(Histogram(
+    "okbot_preview_wait_seconds", "Ожидание карточки превью видео", ["result"]))
+METRIC_TEXT_INPUT = metrics.register(Histogram(
+    "okbot_text_input_seconds", "Ввод текста поста в поле", ["method"]))
+METRIC_POST = metrics.register(Histogram(
+    "okbot_post_seconds", "Публикация в одну группу", ["status"]))
+METRIC_TELEGRAM_SEND = metrics.register(Histogram(
+    "okbot_telegram_send_seconds", "Вызовы Telegram Bot API из очереди сообщений", ["method"]))
+METRIC_POSTS = metrics.register(Counter(
+    "okbot_posts_total", "Результаты постинга в группы", ["result"]))
+METRIC_SMS_CHALLENGES = metrics.register(Counter(
+    "okbot_sms_challenges_total", "Запросы SMS-верификации при входе", ["result"]))
+METRIC_DRIVER_RETRIES = metrics.register(Counter(
+    "okbot_driver_init_retries_total", "Повторные попытки запуска Chrome"))
+METRIC_WEBDRIVER_COMMANDS = metrics.register(Counter(
+    "okbot_webdriver_commands_total", "Команды WebDriver - каждая отдельный запрос к chromedriver", ["command"]))
+metrics.register(Gauge(
+    "okbot_live_sessions", "Активные сессии профилей", lambda: len(sessions)))
+metrics.register(Gauge(
+    "okbot_chrome_processes", "Процессы Chrome и chromedriver", count_chrome_processes))
+metrics.register(Gauge(
+    "okbot_session_rss_bytes", "Память дерева процессов Chrome каждой сессии",
+    lambda: [((str(row['profile']),), row['rss_bytes']) for row in supervisor.session_report()], ["profile"]))
+metrics.register(Gauge(
+    "okbot_post_rate_per_hour", "Темп постинга аккаунта: цель, текущий лимит и фактический",
+    lambda: [((account, kind), stats[f"{kind}_per_hour"])
+             for account, stats in ((a, p.stats()) for a, p in list(pacers.items()))
+             for kind in ("target", "current", "achieved")], ["account", "kind"]))
+METRIC_DRIVER_RECYCLES = metrics.register(Counter(
+    "okbot_driver_recycles_total", "Плановые перезапуски Chrome сессий", ["reason"]))
+METRIC_REAPED = metrics.register(Counter(
+    "okbot_reaped_processes_total", "Убитые осиротевшие процессы Chrome и собранные зомби", ["kind"]))
+METRIC_WORKER_RESTARTS = metrics.register(Counter(
+    "okbot_worker_failures_total", "Падения и зависания процессов профилей (SESSION_MODE=process)", ["reason"]))
+METRIC_NODE_EVENTS = metrics.register(Counter(
+    "okbot_node_events_total", "Потерянные узлы постинга и переезды профилей (SESSION_MODE=distributed)", ["event"]))
+
+# Трассировка: вложенные спаны через contextvars, экспорт в NDJSON и профили кампаний для flame graph
+class Span:
+    __slots__ = ('name', 'span_id', 'parent', 'trace_id', 'path', 'attrs', 'start', 'started', 'duration',
+                 'child_seconds', 'error')
+
+    def __init__(self, name, span_id, parent, attrs):
+        self.name = name
+        self.span_id = span_id
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else span_id
+        self.path = (parent.path if parent else ()) + (name,)
+        self.attrs = attrs
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.child_seconds = 0.0
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent else None,
+            'trace_id': self.trace_id,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'thread': threading.current_thread().name,
+            'attrs': self.attrs,
+            'error': self.error,
+        }
+
+class Tracer:
+    def __init__(self, path=None):
+        self.path = path or None
+        self._file = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._current = contextvars.ContextVar('okbot_span', default=None)
+        self._profile = contextvars.ContextVar('okbot_profile', default=None)
+
+    @property
+    def enabled(self):
+        return self.path is not None or self._profile.get() is not None
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """with tracer.span('шаг', group=...): - спан вкладывается в текущий (в т.ч. через await)"""
+        if not self.enabled:
+            yield None
+            return
+        span = Span(name, next(self._ids), self._current.get(), attrs)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            self._current.reset(token)
+            self._finish(span)
+
+    def _finish(self, span):
+        span.duration = time.perf_counter() - span.started
+        if span.parent:
+            span.parent.child_seconds += span.duration
+        profile = self._profile.get()
+        if profile is not None:
+            # Собственное время спана; у параллельных вкладок дети перекрываются, поэтому не меньше нуля
+            profile[";".join(span.path)] += max(0.0, span.duration - span.child_seconds)
+        if self.path:
+            line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line + "\n")
+
+    @contextlib.contextmanager
+    def profile(self, path):
+        """Собирает время спанов внутри блока и пишет его в path (folded stacks, микросекунды)"""
+        if not path:
+            yield None
+            return
+        folded = collections.Counter()
+        token = self._profile.set(folded)
+        try:
+            yield folded
+        finally:
+            self._profile.reset(token)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, seconds in sorted(folded.items()):
+                    f.write(f"{stack} {int(seconds * 1_000_000)}\n")
+            logger.info(f"🔥 Профиль сохранён: {path}")
+
+tracer = Tracer(TRACE_FILE)
+
+def traced(name, arg_names=()):
+    """Оборачивает корутину-метод OKSession в спан; arg_names - атрибуты из позиционных аргументов"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            if not tracer.enabled:
+                return await func(self, *args, **kwargs)
+            attrs = dict(zip(arg_names, args))
+            with tracer.span(name, profile=self.person_name, **attrs):
+                return await func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def webdriver_span_attrs(params):
+    attrs = {}
+    if not params:
+        return attrs
+    if 'using' in params:
+        attrs['selector'] = f"{params['using']}={params.get('value')}"
+    if 'url' in params:
+        attrs['url'] = params['url']
+    if 'script' in params:
+        attrs['script'] = params['script'].strip()[:80]
+    if 'cmd' in params:
+        attrs['cdp'] = params['cmd']
+    return attrs
+
+def trace_webdriver(driver):
+    """Каждая команда WebDriver (в т.ч. от WebElement) считается в метрике и становится спаном webdriver.<команда>"""
+    execute = driver.execute
+
+    def traced_execute(driver_command, params=None):
+        METRIC_WEBDRIVER_COMMANDS.inc(command=driver_command)
+        if not tracer.enabled:
+            return execute(driver_command, params)
+        with tracer.span(f"webdriver.{driver_command}", **webdriver_span_attrs(params)):
+            return execute(driver_command, params)
+
+    driver.execute = traced_execute
+    return driver
+
+# Очередь исходящих сообщений: один общий клиент, склейка статусов и редактирование прогресса
+class TelegramOutbox:
+    MAX_LENGTH = 4096
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, token, chat_id, min_interval=1.0, batch_window=0.5):
+        self.token = token
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        self._lines = []  # (заголовок, текст)
+        self._progress = []  # [key, текст, последнее ли обновление], ещё не отправленные
+        self._progress_ids = {}  # key -> message_id сообщения прогресса
+        self._loop = None
+        self._wakeup = None
+        self._idle = threading.Event()
+        self._idle.set()
+        self._ready = threading.Event()
+        self._thread = None
+        self._last_call = 0.0
+        self.sent = 0
+        self.edited = 0
+        self.retries = 0
+
+    def start(self):
+        with self._lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run_loop, name="telegram-outbox", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        self._loop.run_until_complete(self._worker())
+
+    def _notify(self):
+        self._idle.clear()
+        self.start()
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def send(self, text, header=None):
+        """Ставит строку статуса в очередь; соседние строки склеиваются в одно сообщение"""
+        with self._lock:
+            self._lines.append((header, text))
+        self._notify()
+
+    def progress(self, key, text, final=False):
+        """Обновляет сообщение прогресса на месте; промежуточные значения пропускаются.
+        После final следующий прогресс с тем же ключом начнётся новым сообщением."""
+        with self._lock:
+            pending = [entry for entry in self._progress if entry[0] == key]
+            if pending and not pending[-1][2]:
+                pending[-1][1:] = [text, final]
+            else:
+                self._progress.append([key, text, final])
+        self._notify()
+
+    def flush(self, timeout=5):
+        return self._idle.wait(timeout)
+
+    async def _worker(self):
+        load_telegram()
+        bot = Bot(token=self.token, base_url=TELEGRAM_API_BASE_URL)
+        await bot.initialize()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await asyncio.sleep(self.batch_window)
+            with self._lock:
+                lines, self._lines = self._lines, []
+                progress, self._progress = self._progress, []
+            try:
+                for chunk in self._compose(lines):
+                    await self._call(bot.send_message, chat_id=self.chat_id, text=chunk)
+                    self.sent += 1
+                for key, text, final in progress:
+                    await self._update_progress(bot, key, text)
+                    if final:
+                        self._progress_ids.pop(key, None)
+            except Exception as e:
+                logger.error(f"Ошибка отправки сообщения в Telegram: {e}")
+            with self._lock:
+                if not self._lines and not self._progress:
+                    self._idle.set()
+
+    def _compose(self, lines):
+        blocks = []
+        for header, text in lines:
+            if blocks and header and blocks[-1][0] == header:
+                blocks[-1][1].append(text)
+            else:
+                blocks.append((header, [text]))
+        parts = [("\n".join([header] + texts) if header else "\n".join(texts)) for header, texts in blocks]
+        
+        chunks, current = [], ""
+        for part in parts:
+            while len(part) > self.MAX_LENGTH:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(part[:self.MAX_LENGTH])
+                part = part[self.MAX_LENGTH:]
+            if current and len(current) + 2 + len(part) > self.MAX_LENGTH:
+                chunks.append(current)
+                current = part
+            else:
+                current = f"{current}\n\n{part}" if current else part
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def _update_progress(self, bot, key, text):
+        message_id = self._progress_ids.get(key)
+        if message_id:
+            try:
+                await self._call(bot.edit_message_text, chat_id=self.chat_id, message_id=message_id, text=text)
+                self.edited += 1
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return
+                logger.warning(f"Не удалось отредактировать прогресс, отправляю заново: {e}")
+        message = await self._call(bot.send_message, chat_id=self.chat_id, text=text)
+        self._progress_ids[key] = message.message_id
+        self.sent += 1
+
+    async def _call(self, method, **kwargs):
+        """Вызов Bot API с соблюдением лимитов чата и повторами"""
+        delay = 1.0
+        for attempt in range(self.MAX_ATTEMPTS):
+            wait = self._last_call + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_call = time.monotonic()
+            try:
+                with METRIC_TELEGRAM_SEND.time(method=method.__name__):
+                    return await method(**kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning(f"⏳ Telegram просит подождать {retry_after} сек")
+                self.retries += 1
+                await asyncio.sleep(retry_after)
+            except BadRequest:
+                raise
+            except TelegramError as e:
+                if attempt == self.MAX_ATTEMPTS - 1:
+                    raise
+                logger.warning(f"Сбой Telegram API ({e}), повтор через {delay:g} сек")
+                self.retries += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+        raise TelegramError("Превышено число попыток отправки")
+
+outbox = TelegramOutbox(TELEGRAM_TOKEN, TELEGRAM_USER_ID, TELEGRAM_MIN_INTERVAL, TELEGRAM_BATCH_WINDOW)
+
+# Функция для отправки сообщений в Telegram
+async def send_telegram_message(text, header=None):
+    outbox.send(text, header)
+
+def posting_health():
+    """Состояние постинга этого процесса; процессы профилей и узлы пересылают его вместе с приростом метрик"""
+    return {
+        "pages": page_stats.summary(),
+        "selectors": selector_memory.stats(),
+        "pacing": {account: pacer.stats() for account, pacer in list(pacers.items())},
+    }
+
+def health_payload():
+    pacing = {account: pacer.stats() for account, pacer in list(pacers.items())}
+    for remote in workers.posting_health() + dispatcher.posting_health():
+        pacing.update(remote.get("pacing", {}))
+    return {
+        "status": "healthy",
+        "bot": "ready" if bot_ready.is_set() else "starting",
+        "driver_pool": driver_pool.stats(),
+        "pages": page_stats.summary(),
+        "selectors": selector_memory.stats(),
+        "resources": supervisor.stats(),
+        "pacing": pacing,
+        "session_loop": session_loop.stats(),
+        "workers": workers.stats() if SESSION_MODE == "process" else None,
+        "nodes": dispatcher.stats() if SESSION_MODE == "distributed" else None,
+    }
+
+def create_flask_app():
+    from flask import Flask, request, jsonify
+    flask_app = Flask(__name__)
+
+    @flask_app.route('/')
+    def health_check():
+        return jsonify({"status": "ok", "message": "Bot is running"})
+
+    @flask_app.route('/health')
+    def health():
+        return jsonify(health_payload())
+
+    @flask_app.route('/metrics')
+    def metrics_endpoint():
+        return metrics.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+    @flask_app.route('/nodes/<action>', methods=['POST'])
+    def nodes_endpoint(action):
+        """API узлов постинга (SESSION_MODE=distributed)"""
+        status, body = node_api(action, request.get_json(silent=True) or {}, request.headers.get('X-Node-Token'))
+        return jsonify(body), status
+
+    @flask_app.route('/webhook', methods=['POST'])
+    def webhook():
+        """Обработчик webhook от Telegram: апдейт уходит в очередь Application в его цикле событий"""
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return jsonify({"status": "error", "message": "Forbidden"}), 403
+        loop = application_loop
+        if not bot_ready.is_set() or loop is None:
+            return jsonify({"status": "error", "message": "Bot is starting"}), 503
+        if request.content_type == 'application/json':
+            try:
+                update = Update.de_json(request.get_json(), application.bot)
+                asyncio.run_coroutine_threadsafe(application.update_queue.put(update), loop).result(timeout=10)
+                return jsonify({"status": "ok"})
+            except Exception as e:
+                logger.error(f"Ошибка обработки webhook: {e}")
+                return jsonify({"status": "error", "message": str(e)}), 500
+        return jsonify({"status": "error", "message": "Invalid content type"}), 400
+
+    return flask_app
+
+def start_flask_thread(port):
+    """Flask в фоне: /health отвечает, пока бот ещё инициализируется"""
+    global app
+    app = create_flask_app()
+    thread = threading.Thread(target=app.run, kwargs={'host': '0.0.0.0', 'port': port, 'debug': False}, daemon=True)
+    thread.start()
+    logger.info(f"🌐 Flask сервер запущен на порту {port} за {time.monotonic() - BOOT_STARTED:.2f} сек после старта")
+    return thread
+
+# ASGI-приложение для webhook: апдейт кладётся в очередь Application, Telegram получает ответ сразу
+def create_asgi_app():
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, PlainTextResponse
+    from starlette.routing import Route
+
+    async def asgi_health_check(request):
+        return JSONResponse({"status": "ok", "message": "Bot is running"})
+
+    async def asgi_health(request):
+        return JSONResponse(health_payload())
+
+    async def asgi_metrics(request):
+        return PlainTextResponse(metrics.render(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    # Long-poll узлов держит поток до NODE_TIMEOUT/3 - у них свой пул, чтобы не занимать общий
+    node_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="node-api")
+
+    async def asgi_nodes(request):
+        """API узлов постинга (SESSION_MODE=distributed)"""
+        try:
+            payload = await request.json()
+        except ValueError:
+            payload = {}
+        status, body = await asyncio.get_running_loop().run_in_executor(node_executor, functools.partial(
+            node_api, request.path_params["action"], payload, request.headers.get("X-Node-Token")))
+        return JSONResponse(body, status_code=status)
+
+    async def asgi_webhook(request):
+        """Обработчик webhook от Telegram"""
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return JSONResponse({"status": "error", "message": "Forbidden"}, status_code=403)
+        if not bot_ready.is_set():
+            return JSONResponse({"status": "error", "message": "Bot is starting"}, status_code=503)
+        try:
+            update_data = await request.json()
+        except ValueError:
+            return JSONResponse({"status": "error", "message": "Invalid JSON"}, status_code=400)
+        await application.update_queue.put(Update.de_json(update_data, application.bot))
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(routes=[
+        Route("/", asgi_health_check),
+        Route("/health", asgi_health),
+        Route("/metrics", asgi_metrics),
+        Route("/webhook", asgi_webhook, methods=["POST"]),
+        Route("/nodes/{action}", asgi_nodes, methods=["POST"]),
+    ])
+
+def run_flask_webhook(port):
+    """Flask принимает апдейты в своих потоках, Application работает в долгоживущем цикле главного потока"""
+    global application_loop
+    flask_thread = start_flask_thread(port)
+    initialize_bot(mark_ready=False)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def start():
+        await application.initialize()
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL}/webhook",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL}/webhook")
+        await application.start()
+
+    async def watch_flask():
+        while flask_thread.is_alive():
+            await asyncio.sleep(1)
+
+    loop.run_until_complete(start())
+    application_loop = loop
+    bot_ready.set()
+    logger.info("🚀 Бот принимает апдейты через Flask webhook")
+    try:
+        loop.run_until_complete(watch_flask())
+    finally:
+        application_loop = None
+        loop.run_until_complete(application.stop())
+        loop.run_until_complete(application.shutdown())
+
+async def run_asgi_webhook(port):
+    """Uvicorn и Application работают в одном долгоживущем цикле событий.
+    Сервер стартует первым: /health доступен, пока бот инициализируется в фоне."""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(
+        app=create_asgi_app(),
+        host="0.0.0.0",
+        port=port,
+        log_level="warning",
+    ))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started and not serve_task.done():
+        await asyncio.sleep(0.02)
+    if serve_task.done():
+        return await serve_task
+    logger.info(f"🌐 ASGI сервер запущен на порту {port} за {time.monotonic() - BOOT_STARTED:.2f} сек после старта")
+    
+    await asyncio.to_thread(initialize_bot)
+    async with application:
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL}/webhook",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL}/webhook")
+        await application.start()
+        logger.info("🚀 Бот принимает апдейты через ASGI webhook")
+        try:
+            await serve_task
+        finally:
+            await application.stop()
 
 # Функция для получения всех профилей из переменных окружения
 def get_profiles():
@@ -114,174 +899,1679 @@ def get_profiles():
     
     return profiles
 
+# Сборка опций Chrome
+def build_chrome_options(user_data_dir=None):
+    opts = uc.ChromeOptions()
+    if user_data_dir:
+        opts.add_argument(f'--user-data-dir={os.path.abspath(user_data_dir)}')
+    opts.add_argument('--headless=new')
+    opts.add_argument('--no-sandbox')
+    opts.add_argument('--disable-dev-shm-usage')
+    opts.add_argument('--disable-gpu')
+    opts.add_argument('--window-size=1920,1080')
+    opts.add_argument('--disable-web-security')
+    opts.add_argument('--allow-running-insecure-content')
+    opts.add_argument('--disable-extensions')
+    opts.add_argument('--disable-plugins')
+    opts.add_argument('--disable-default-apps')
+    opts.add_argument('--disable-background-timer-throttling')
+    opts.add_argument('--disable-backgrounding-occluded-windows')
+    opts.add_argument('--disable-renderer-backgrounding')
+    opts.add_argument('--disable-features=TranslateUI')
+    opts.add_argument('--disable-ipc-flooding-protection')
+    if blocks_images_by_type():
+        # Картинки отключаются в Blink по типу ответа - и с CDN без расширения в адресе (getImage?photoId=...)
+        opts.add_argument('--blink-settings=imagesEnabled=false')
+    # Не ждём событие load - дальше всё равно ждём нужные элементы
+    opts.page_load_strategy = PAGE_LOAD_STRATEGY
+    return opts
+
+# Блокировка лишних ресурсов через DevTools Protocol.
+# Network.setBlockedURLs понимает только шаблоны адресов, поэтому тип угадывается по расширению:
+# шрифты и медиа с адресов без расширения он пропустит. Fetch.enable с resourceType требует отвечать
+# на каждый Fetch.requestPaused, а execute_cdp_cmd событий не получает. Картинки, самые тяжёлые
+# из них, отключаются по типу флагом Chrome (blocks_images_by_type), расширения - дополнительно
+NETWORK_TYPE_PATTERNS = {
+    'image': ('jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'bmp', 'ico'),
+    'media': ('mp4', 'webm', 'm3u8', 'm4s', 'mp3', 'ogg'),
+    'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+}
+NETWORK_DEFAULT_DENY = (
+    "*top-fwz1.mail.ru*",
+    "*ad.mail.ru*",
+    "*mc.yandex.ru*",
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*counter.yadro.ru*",
+)
+
+def split_env_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def blocks_images_by_type():
+    """Флаг Chrome отключает все картинки - исключения NETWORK_ALLOW на него не действуют"""
+    return 'image' in (t.lower() for t in split_env_list(NETWORK_BLOCK_TYPES)) and not split_env_list(NETWORK_ALLOW)
+
+def network_deny_patterns():
+    patterns = list(NETWORK_DEFAULT_DENY) + split_env_list(NETWORK_DENY)
+    for resource_type in split_env_list(NETWORK_BLOCK_TYPES):
+        for ext in NETWORK_TYPE_PATTERNS.get(resource_type.lower(), ()):
+            patterns += [f"*.{ext}", f"*.{ext}?*"]
+    return patterns
+
+def apply_network_policy(driver):
+    """Правила действуют на текущую вкладку - вызывать и для новых вкладок"""
+    deny = network_deny_patterns()
+    allow = split_env_list(NETWORK_ALLOW)
+    if not deny:
+        return
+    driver.execute_cdp_cmd("Network.enable", {})
+    params = {"urls": deny}
+    if allow:
+        # urlPatterns проверяются раньше urls, поэтому исключения сильнее запретов
+        params["urlPatterns"] = [{"urlPattern": pattern, "block": False} for pattern in allow]
+    try:
+        driver.execute_cdp_cmd("Network.setBlockedURLs", params)
+    except WebDriverException as e:
+        logger.warning(f"Chrome не поддерживает исключения NETWORK_ALLOW ({e}), применяю только запреты")
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": deny})
+
+# Вес страницы и время, сэкономленное стратегией загрузки
+PAGE_STATS_JS = """
+const nav = performance.getEntriesByType('navigation')[0];
+const resources = performance.getEntriesByType('resource');
+let bytes = nav ? nav.transferSize : 0;
+for (const r of resources) bytes += r.transferSize || 0;
+return {
+    bytes: bytes,
+    requests: resources.length + 1,
+    dcl_ms: nav ? Math.round(nav.domContentLoadedEventEnd) : null,
+    load_ms: nav && nav.loadEventEnd ? Math.round(nav.loadEventEnd) : null,
+    blocked_images: Array.from(document.images).filter(i => i.complete && i.naturalWidth === 0).length,
+};
+"""
+
+class PageStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = collections.defaultdict(lambda: collections.Counter())
+
+    def record(self, driver, page_type):
+        """Снимает метрики текущей страницы и возвращает их"""
+        stats = driver.execute_script(PAGE_STATS_JS)
+        # С eager драйвер отдаёт управление на DOMContentLoaded, а не на load
+        if stats['dcl_ms'] is not None:
+            end = stats['load_ms'] or driver.execute_script("return Math.round(performance.now());")
+            stats['saved_ms'] = max(0, end - stats['dcl_ms']) if PAGE_LOAD_STRATEGY != 'normal' else 0
+        else:
+            stats['saved_ms'] = 0
+        with self._lock:
+            totals = self.pages[page_type]
+            totals['pages'] += 1
+            totals['bytes'] += stats['bytes'] or 0
+            totals['saved_ms'] += stats['saved_ms']
+            totals['blocked_images'] += stats['blocked_images'] or 0
+        logger.info(
+            f"📊 {page_type}: {(stats['bytes'] or 0) // 1024} КБ, {stats['requests']} запросов, "
+            f"DOMContentLoaded {stats['dcl_ms']} мс, сэкономлено {stats['saved_ms']} мс, "
+            f"заблокировано картинок: {stats['blocked_images']}"
+        )
+        return stats
+
+    def summary(self):
+        with self._lock:
+            return {
+                page_type: {
+                    'pages': totals['pages'],
+                    'avg_kb': round(totals['bytes'] / totals['pages'] / 1024, 1),
+                    'avg_saved_ms': round(totals['saved_ms'] / totals['pages']),
+                    'blocked_images': totals['blocked_images'],
+                }
+                for page_type, totals in self.pages.items() if totals['pages']
+            }
+
+page_stats = PageStats()
+
+# Кэш пропатченного chromedriver: <CHROMEDRIVER_CACHE_DIR>/<major-версия Chrome>/chromedriver.
+# Наполняется при сборке образа (tools/prepare_chromedriver.py), в рантайме только читается.
+_chrome_major = None
+_chromedriver_lock = threading.Lock()
+
+def chrome_major_version():
+    """Основная версия установленного Chrome (один раз за процесс)"""
+    global _chrome_major
+    if _chrome_major is None:
+        load_selenium()
+        binary = CHROME_BIN or uc.find_chrome_executable()
+        if not binary:
+            raise RuntimeError("Chrome не найден")
+        output = subprocess.run([binary, "--version"], capture_output=True, text=True, timeout=15).stdout
+        match = re.search(r"(\d+)\.\d+\.\d+", output)
+        if not match:
+            raise RuntimeError(f"Не удалось определить версию Chrome: {output.strip()!r}")
+        _chrome_major = int(match.group(1))
+    return _chrome_major
+
+def cached_chromedriver_path(major):
+    return os.path.join(CHROMEDRIVER_CACHE_DIR, str(major), "chromedriver")
+
+def ensure_patched_chromedriver(major=None):
+    """Возвращает путь к пропатченному chromedriver под установленный Chrome, при промахе - скачивает"""
+    load_selenium()
+    major = major or chrome_major_version()
+    path = cached_chromedriver_path(major)
+    with _chromedriver_lock:
+        if uc.Patcher(executable_path=path, version_main=major).is_binary_patched(path):
+            return path
+        
+        logger.warning(f"⬇️ В кэше нет chromedriver {major}, скачиваю и патчу")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Скачиваем в свой временный каталог (общий каталог Patcher может занять параллельный запуск)
+        # и атомарно переносим готовый файл в кэш
+        tmp_dir = tempfile.mkdtemp(prefix=".download-", dir=os.path.dirname(path))
+        try:
+            downloader = uc.Patcher(version_main=major)
+            downloader.executable_path = os.path.join(tmp_dir, "chromedriver")
+            downloader.zip_path = os.path.join(tmp_dir, "unpacked")
+            downloader.auto()
+            os.replace(downloader.executable_path, path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"📦 chromedriver {major} сохранён в кэш: {path}")
+    return path
+
+def chrome_strategies(user_data_dir=None):
+    """Способы запуска Chrome: (название, функция). Первый - основной, остальные - запасные"""
+    strategies = []
+    if CHROMEDRIVER_CACHE_DIR:
+        def cached(use_subprocess=True):
+            major = chrome_major_version()
+            return uc.Chrome(
+                options=build_chrome_options(user_data_dir),
+                driver_executable_path=ensure_patched_chromedriver(major),
+                version_main=major,
+                use_subprocess=use_subprocess,
+            )
+        strategies.append(("кэш chromedriver", cached))
+        strategies.append(("кэш chromedriver без subprocess", lambda: cached(use_subprocess=False)))
+    # Автоматическое управление версиями - undetected_chromedriver скачивает и патчит драйвер сам
+    strategies.append(("автоопределение версии", lambda: uc.Chrome(options=build_chrome_options(user_data_dir), version_main=None)))
+    if not CHROMEDRIVER_CACHE_DIR:
+        strategies.append(("без subprocess", lambda: uc.Chrome(options=build_chrome_options(user_data_dir), use_subprocess=False)))
+    return strategies
+
+def discard_launched(future):
+    """Проигравший в гонке драйвер закрывается, как только запустится"""
+    if future.exception() is None:
+        supervisor.quit_driver(future.result())
+
+def race_strategies(strategies):
+    """Запасные способы стартуют одновременно; побеждает первый запустившийся драйвер"""
+    executor = ThreadPoolExecutor(max_workers=len(strategies), thread_name_prefix="chrome-launch")
+    futures = {executor.submit(factory): name for name, factory in strategies}
+    executor.shutdown(wait=False)
+    last_error = None
+    for future in as_completed(futures):
+        try:
+            driver = future.result()
+        except Exception as e:
+            logger.warning(f"Способ запуска Chrome «{futures[future]}» не сработал: {e}")
+            last_error = e
+            continue
+        for other in futures:
+            if other is not future:
+                other.add_done_callback(discard_launched)
+        return driver, futures[future]
+    raise last_error
+
+def try_strategies_in_order(strategies):
+    last_error = None
+    for name, factory in strategies:
+        try:
+            return factory(), name
+        except Exception as e:
+            logger.warning(f"Способ запуска Chrome «{name}» не сработал: {e}")
+            last_error = e
+    raise last_error
+
+# Запуск Chrome драйвера: основной способ, затем запасные параллельно
+def launch_chrome(user_data_dir=None):
+    load_selenium()
+    started = time.monotonic()
+    (primary_name, primary), *fallbacks = chrome_strategies(user_data_dir)
+    
+    try:
+        logger.info(f"Запуск Chrome драйвера ({primary_name})")
+        driver, name = primary(), primary_name
+    except Exception as e:
+        if not fallbacks:
+            logger.error(f"Не удалось запустить Chrome: {e}")
+            raise
+        logger.warning(f"Основной способ запуска Chrome не сработал: {e}")
+        METRIC_DRIVER_RETRIES.inc(len(fallbacks))
+        # Два Chrome на одном профиле не уживутся - с user_data_dir запасные способы идут по очереди
+        run_fallbacks = try_strategies_in_order if user_data_dir else race_strategies
+        try:
+            driver, name = run_fallbacks(fallbacks)
+        except Exception:
+            logger.error("Все способы инициализации Chrome драйвера провалились")
+            raise
+    
+    trace_webdriver(driver)
+    supervisor.track(driver)
+    apply_network_policy(driver)
+    METRIC_CHROME_LAUNCH.observe(time.monotonic() - started)
+    logger.info(f"Chrome драйвер успешно инициализирован ({name}) за {time.monotonic() - started:.1f} сек")
+    return driver
+
+# Процессы Chrome по /proc: память дерева драйвера, осиротевшие браузеры и зомби
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def snapshot_processes():
+    """pid -> {'name', 'state', 'ppid', 'rss'} для всех видимых процессов"""
+    processes = {}
+    try:
+        pids = [int(pid) for pid in os.listdir('/proc') if pid.isdigit()]
+    except OSError:
+        return processes
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                data = f.read()
+        except OSError:
+            continue
+        # Имя в скобках может содержать пробелы - поля считаем от последней скобки
+        rparen = data.rindex(')')
+        fields = data[rparen + 2:].split()
+        processes[pid] = {
+            'name': data[data.index('(') + 1:rparen],
+            'state': fields[0],
+            'ppid': int(fields[1]),
+            'rss': int(fields[21]) * PAGE_SIZE,
+        }
+    return processes
+
+def is_chrome_process(info):
+    return 'chrom' in info['name'].lower()
+
+def process_tree(roots, processes):
+    """Корни и все их потомки, которые ещё живы"""
+    children = collections.defaultdict(list)
+    for pid, info in processes.items():
+        children[info['ppid']].append(pid)
+    tree, stack = set(), [pid for pid in roots if pid in processes]
+    while stack:
+        pid = stack.pop()
+        if pid not in tree:
+            tree.add(pid)
+            stack.extend(children[pid])
+    return tree
+
+def driver_root_pids(driver):
+    """chromedriver и браузер: undetected_chromedriver запускает браузер отдельным процессом"""
+    pids = []
+    service = getattr(driver, 'service', None)
+    process = getattr(service, 'process', None)
+    if process is not None and process.pid:
+        pids.append(process.pid)
+    if getattr(driver, 'browser_pid', None):
+        pids.append(driver.browser_pid)
+    return pids
+
+def kill_processes(pids):
+    killed = 0
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+            killed += 1
+        except (ProcessLookupError, PermissionError):
+            pass
+    return killed
+
+def reap_zombies(processes):
+    """Забирает статус завершившихся дочерних процессов (в контейнере бот часто PID 1)"""
+    reaped = 0
+    me = os.getpid()
+    for pid, info in processes.items():
+        if info['state'] == 'Z' and info['ppid'] == me:
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    reaped += 1
+            except ChildProcessError:
+                pass
+    return reaped
+
+class ResourceSupervisor:
+    """Следит за деревьями процессов драйверов: память сессий, добивание после quit(), сироты"""
+    def __init__(self, interval=60, max_posts=0, max_rss_mb=0):
+        self.interval = interval
+        self.max_posts = max_posts
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self._tracked = {}  # id(driver) -> корневые pid
+        self._launched = set()  # корневые pid всех драйверов этого процесса, пока они живы
+        self._suspects = set()  # сироты с прошлого прохода: убиваем, если всё ещё ничьи
+        self.delegated = set()  # pid процессов профилей: за своими Chrome они следят сами
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.orphans_killed = 0
+        self.zombies_reaped = 0
+
+    def start(self):
+        if self.interval <= 0 or self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="resource-supervisor", daemon=True)
+        self._thread.start()
+
+    def track(self, driver):
+        roots = driver_root_pids(driver)
+        with self._lock:
+            self._tracked[id(driver)] = roots
+            self._launched.update(roots)
+
+    def driver_tree(self, driver, processes=None):
+        processes = processes if processes is not None else snapshot_processes()
+        with self._lock:
+            roots = self._tracked.get(id(driver)) or driver_root_pids(driver)
+        return process_tree(roots, processes)
+
+    def driver_rss(self, driver, processes=None):
+        processes = processes if processes is not None else snapshot_processes()
+        return sum(processes[pid]['rss'] for pid in self.driver_tree(driver, processes))
+
+    def quit_driver(self, driver):
+        """quit() с гарантией: всё, что осталось от дерева процессов, убивается"""
+        tree = self.driver_tree(driver)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии драйвера: {e}")
+        finally:
+            with self._lock:
+                self._tracked.pop(id(driver), None)
+        alive = [pid for pid in tree if os.path.exists(f'/proc/{pid}')]
+        if alive:
+            killed = kill_processes(alive)
+            METRIC_REAPED.inc(killed, kind='after_quit')
+            logger.warning(f"🧹 После quit() остались процессы Chrome, добиты: {killed}")
+
+    def recycle_reason(self, driver, posts):
+        """Причина перезапустить драйвер сессии или None"""
+        if self.max_posts and posts >= self.max_posts:
+            return 'posts'
+        if self.max_rss and self.driver_rss(driver) > self.max_rss:
+            return 'rss'
+        return None
+
+    def session_report(self):
+        processes = snapshot_processes()
+        with sessions_lock:
+            items = list(sessions.items())
+        report = []
+        for profile_id, session in items:
+            driver = session.driver
+            if isinstance(session, RemoteSession):
+                tree = process_tree([session.pid], processes) if session.pid else set()
+            else:
+                tree = self.driver_tree(driver, processes) if driver else set()
+            report.append({
+                'profile': profile_id,
+                'person': session.person_name,
+                'processes': len(tree),
+                'rss_bytes': sum(processes[pid]['rss'] for pid in tree),
+                'posts_since_launch': session.driver_posts,
+            })
+        return report
+
+    def stats(self):
+        report = self.session_report()
+        return {
+            'sessions': [dict(row, rss_mb=round(row['rss_bytes'] / 1048576, 1)) for row in report],
+            'orphans_killed': self.orphans_killed,
+            'zombies_reaped': self.zombies_reaped,
+        }
+
+    def reap(self):
+        """Один проход: собрать зомби и убить Chrome этого процесса, не принадлежащий ни одному драйверу.
+        Чужие браузеры не трогаем: в режимах process и distributed у каждого процесса свой supervisor,
+        а без subprocess undetected_chromedriver запускает браузер отвязанным (ppid 1)"""
+        processes = snapshot_processes()
+        reaped = reap_zombies(processes)
+        if reaped:
+            self.zombies_reaped += reaped
+            METRIC_REAPED.inc(reaped, kind='zombie')
+        
+        with self._lock:
+            roots = [pid for pids in self._tracked.values() for pid in pids] + list(self.delegated)
+            self._launched &= processes.keys()  # pid завершившихся забываем, пока их не заняли другие
+            launched = list(self._launched)
+        owned = process_tree(roots, processes)
+        # Свои потомки и то, что запускали свои драйверы, даже если его переподвесили на init
+        mine = process_tree([os.getpid()] + launched, processes)
+        orphans = set()
+        for pid in mine - owned:
+            info = processes[pid]
+            if info['state'] != 'Z' and is_chrome_process(info):
+                orphans.add(pid)
+        
+        # Только что запущенный драйвер ещё может быть не зарегистрирован - ждём один проход
+        confirmed, self._suspects = orphans & self._suspects, orphans - self._suspects
+        if confirmed:
+            killed = kill_processes(process_tree(confirmed, processes) - owned)
+            self.orphans_killed += killed
+            METRIC_REAPED.inc(killed, kind='orphan')
+            logger.warning(f"🧹 Убиты осиротевшие процессы Chrome: {killed}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Ошибка проверки процессов Chrome: {e}")
+
+    def shutdown(self):
+        self._stop.set()
+
+supervisor = ResourceSupervisor(REAPER_INTERVAL, DRIVER_MAX_POSTS, DRIVER_MAX_RSS_MB)
+
+# Пул заранее запущенных Chrome драйверов
+class DriverPool:
+    def __init__(self, size, warm_url=None, check_interval=30, acquire_wait=15):
+        self.size = size
+        self.warm_url = warm_url
+        self.check_interval = check_interval
+        self.acquire_wait = acquire_wait
+        self._idle = []
+        self._starting = 0
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.recycled = 0
+        self.startup_times = collections.deque(maxlen=50)
+
+    def start(self):
+        """Запускает фоновое поддержание пула (повторный вызов ничего не делает)"""
+        with self._cond:
+            if self.size <= 0 or self._thread:
+                return
+            self._thread = threading.Thread(target=self._maintain, name="driver-pool", daemon=True)
+        self._thread.start()
+        logger.info(f"🏊 Пул драйверов запущен, размер: {self.size}")
+
+    def _spawn(self):
+        started = time.monotonic()
+        driver = launch_chrome()
+        if self.warm_url:
+            try:
+                driver.get(self.warm_url)
+            except WebDriverException as e:
+                logger.warning(f"Не удалось прогреть драйвер на {self.warm_url}: {e}")
+        self.startup_times.append(time.monotonic() - started)
+        return driver
+
+    def _healthy(self, driver):
+        try:
+            driver.execute_script("return 1")
+            return bool(driver.window_handles)
+        except Exception:
+            return False
+
+    def _discard(self, driver):
+        with self._cond:
+            self.recycled += 1
+        supervisor.quit_driver(driver)
+
+    def _check_idle(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        alive = []
+        for driver in idle:
+            if self._healthy(driver):
+                alive.append(driver)
+            else:
+                logger.warning("🩺 Драйвер в пуле не отвечает, заменяю")
+                self._discard(driver)
+        with self._cond:
+            self._idle.extend(alive)
+            self._cond.notify_all()
+
+    def _maintain(self):
+        while not self._stop.is_set():
+            self._check_idle()
+            while not self._stop.is_set():
+                with self._cond:
+                    if len(self._idle) + self._starting >= self.size:
+                        break
+                    self._starting += 1
+                try:
+                    driver = self._spawn()
+                except Exception as e:
+                    with self._cond:
+                        self._starting -= 1
+                        self.failures += 1
+                        self._cond.notify_all()
+                    logger.error(f"Не удалось запустить драйвер для пула: {e}")
+                    break
+                with self._cond:
+                    self._starting -= 1
+                    self._idle.append(driver)
+                    self._cond.notify_all()
+                logger.info(f"🔥 Драйвер прогрет, в пуле: {len(self._idle)}")
+            self._wakeup.wait(self.check_interval)
+            self._wakeup.clear()
+
+    def acquire(self):
+        """Выдаёт готовый драйвер из пула или запускает новый"""
+        deadline = time.monotonic() + self.acquire_wait
+        while True:
+            with self._cond:
+                # Если драйвер уже запускается - ждём его, а не стартуем второй
+                while not self._idle and self._starting and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                driver = self._idle.pop() if self._idle else None
+            if driver is None:
+                break
+            if self._healthy(driver):
+                with self._cond:
+                    self.hits += 1
+                self._wakeup.set()
+                return driver
+            self._discard(driver)
+        
+        with self._cond:
+            self.misses += 1
+        self._wakeup.set()
+        started = time.monotonic()
+        driver = launch_chrome()
+        self.startup_times.append(time.monotonic() - started)
+        return driver
+
+    def release(self, driver, wait=False):
+        """Драйвер с чужими куками не переиспользуем - закрываем и пополняем пул.
+        wait=True - дождаться закрытия (например, чтобы освободить профиль Chrome)"""
+        if wait:
+            self._discard(driver)
+        else:
+            threading.Thread(target=self._discard, args=(driver,), daemon=True).start()
+        self._wakeup.set()
+
+    def stats(self):
+        with self._cond:
+            times = list(self.startup_times)
+            requests_total = self.hits + self.misses
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'starting': self._starting,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests_total, 3) if requests_total else None,
+                'failures': self.failures,
+                'recycled': self.recycled,
+                'startup_avg': round(sum(times) / len(times), 2) if times else None,
+                'startup_last': round(times[-1], 2) if times else None,
+            }
+
+    def shutdown(self):
+        self._stop.set()
+        self._wakeup.set()
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for driver in idle:
+            self._discard(driver)
+
+driver_pool = DriverPool(
+    DRIVER_POOL_SIZE,
+    warm_url=DRIVER_POOL_WARM_URL or None,
+    check_interval=DRIVER_POOL_CHECK_INTERVAL,
+)
+
+# Селекторы страницы постинга
+POST_BOX_SELECTOR = "div[contenteditable='true']"
+PREVIEW_CARD_SELECTORS = (
+    "div.vid-card.vid-card__xl",
+    "div.mediaPreview",
+    "div.mediaFlex",
+    "div.preview_thumb",
+)
+SUBMIT_BUTTON_SELECTOR = "button.js-pf-submit-btn[data-action='submit']"
+
+# Селекторы входа
+CONFIRM_IDENTITY_VARIANTS = (
+    "//input[@value='Yes, confirm']",
+    "//button[contains(text(),'Yes, confirm')]",
+    "//button[contains(text(),'Да, это я')]",
+)
+CONFIRM_IDENTITY_XPATH = " | ".join(CONFIRM_IDENTITY_VARIANTS)
+GET_CODE_XPATH = "//input[@type='submit' and @value='Get code']"
+SMS_CODE_INPUT_XPATH = "//input[@id='smsCode' or contains(@name,'smsCode')]"
+SMS_NEXT_XPATH = "//input[@type='submit' and @value='Next']"
+
+# Наборы элементов для probe_page по типам страниц
+LOGIN_PROBES = {
+    'email': "input[name='st.email']",
+    'password': "input[name='st.password']",
+    'submit': "input[type='submit']",
+}
+SMS_PROBES = {'get_code': GET_CODE_XPATH, 'sms_code': SMS_CODE_INPUT_XPATH, 'next': SMS_NEXT_XPATH}
+POST_PROBES = {'box': POST_BOX_SELECTOR, 'preview': PREVIEW_CARD_SELECTORS, 'submit': SUBMIT_BUTTON_SELECTOR}
+
+# Ждёт в браузере первое сработавшее условие через MutationObserver.
+# Условия: css / xpath (элемент есть), absent (элемента нет), text (текст на странице),
+# data_l (значение body[data-l]), fresh (загрузился новый документ после mark_page)
+WAIT_FOR_ANY_JS = """
+const probes = arguments[0], timeoutMs = arguments[1], done = arguments[arguments.length - 1];
+function hit(p) {
+    const body = document.body;
+    if (p.css) return !!document.querySelector(p.css);
+    if (p.xpath) return !!document.evaluate(p.xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (p.absent) return !document.querySelector(p.absent);
+    if (p.text) return !!body && body.innerText.toLowerCase().includes(p.text);
+    if (p.data_l) return !!body && (body.getAttribute('data-l') || '').includes(p.data_l);
+    if (p.fresh) return !window.__okbotLeaving && document.readyState !== 'loading';
+    return false;
+}
+function check() {
+    for (const p of probes) { if (hit(p)) return p.name; }
+    return null;
+}
+const first = check();
+if (first) { done(first); return; }
+let scheduled = false, timer = null;
+const observer = new MutationObserver(() => {
+    if (scheduled) return;
+    scheduled = true;
+    setTimeout(() => { scheduled = false; const r = check(); if (r) finish(r); }, 25);
+});
+function finish(result) { observer.disconnect(); clearTimeout(timer); done(result); }
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+document.addEventListener('readystatechange', () => { const r = check(); if (r) finish(r); });
+timer = setTimeout(() => finish(null), timeoutMs);
+"""
+
+# Снимок страницы за один execute_script: элементы по именам (из нескольких вариантов селектора -
+# первый найденный, видимый и не disabled предпочтительнее), состояние документа и признаки ограничений.
+# Ограничением считаются только капча и предупреждения, которых не было в снимке baseline (перед нажатием):
+# текст "попробуйте позже" где-то в ленте или чужой блок с captcha в классе не должны останавливать постинг
+PAGE_PROBE_JS = """
+const probes = arguments[0], markers = arguments[1], captcha = arguments[2], baseline = arguments[3];
+const body = document.body;
+function all(selector) {
+    if (selector.startsWith('/') || selector.startsWith('(')) {
+        const result = document.evaluate(selector, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        return Array.from({length: result.snapshotLength}, (_, i) => result.snapshotItem(i));
+    }
+    return Array.from(document.querySelectorAll(selector));
+}
+const usable = el => el.getClientRects().length > 0 && !el.disabled;
+const state = {
+    url: location.href,
+    ready: document.readyState,
+    leaving: !!window.__okbotLeaving,
+    data_l: body ? body.getAttribute('data-l') || '' : '',
+    found: {},
+};
+for (const [name, variants] of Object.entries(probes)) {
+    for (const selector of variants) {
+        const elements = all(selector);
+        if (!elements.length) continue;
+        const el = elements.find(usable) || elements[0];
+        const text = typeof el.value === 'string' ? el.value : el.innerText || '';
+        state.found[name] = {selector: selector, element: el, usable: usable(el), text: text.trim().slice(0, 200)};
+        break;
+    }
+}
+if (markers) {
+    const text = body ? body.innerText.toLowerCase() : '';
+    const notices = {captcha: document.querySelectorAll(captcha).length, markers: markers.filter(m => text.includes(m))};
+    if (baseline) window.__okbotNotices = notices;
+    const before = window.__okbotNotices || {captcha: 0, markers: []};
+    state.throttle = notices.captcha > before.captcha ? 'captcha'
+        : notices.markers.some(m => !before.markers.includes(m)) ? 'throttled' : null;
+}
+return state;
+"""
+
+def selector_variants(selectors):
+    return (selectors,) if isinstance(selectors, str) else tuple(selectors)
+
+class SelectorMemory:
+    """Какой вариант селектора сработал на странице данного типа - в следующий раз он проверяется первым"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._winners = {}  # (тип страницы, имя) -> селектор
+        self.switches = 0
+
+    def ordered(self, page_type, name, variants):
+        winner = self._winners.get((page_type, name))
+        if winner not in variants:
+            return list(variants)
+        return [winner] + [v for v in variants if v != winner]
+
+    def remember(self, page_type, name, selector):
+        with self._lock:
+            previous = self._winners.get((page_type, name))
+            if previous == selector:
+                return
+            self._winners[(page_type, name)] = selector
+            if previous is not None:
+                self.switches += 1
+        if previous is not None:
+            logger.info(f"🔁 {page_type}/{name}: вместо {previous} срабатывает {selector}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'winners': {f"{page_type}/{name}": selector for (page_type, name), selector in self._winners.items()},
+                'switches': self.switches,
+            }
+
+selector_memory = SelectorMemory()
+
+class PageState:
+    """Результат probe_page"""
+    def __init__(self, raw):
+        self.url = raw['url']
+        self.ready = raw['ready']
+        self.leaving = raw['leaving']
+        self.data_l = raw['data_l']
+        self.found = raw['found']
+        self.throttle = raw.get('throttle')
+
+    @property
+    def fresh(self):
+        """Новый документ (не помеченный mark_page) и уже не в состоянии loading"""
+        return not self.leaving and self.ready != 'loading'
+
+    @property
+    def logged_in(self):
+        return 'userMain' in self.data_l and 'anonymMain' not in self.data_l
+
+    def element(self, name):
+        hit = self.found.get(name)
+        return hit['element'] if hit else None
+
+    def usable(self, name):
+        """Элемент, если он видим и не disabled"""
+        hit = self.found.get(name)
+        return hit['element'] if hit and hit['usable'] else None
+
+    def text(self, name):
+        hit = self.found.get(name)
+        return hit['text'] if hit else ''
+
+def probe_page(driver, page_type, probes, throttle=False, baseline=False):
+    """Все элементы probes ({имя: селектор или кортеж вариантов}) и состояние страницы одним запросом к драйверу.
+    Селектор, начинающийся с '/' или '(', - XPath, остальные - CSS.
+    baseline=True запоминает текущие капчи и предупреждения - throttle потом сообщает только о новых."""
+    ordered = {
+        name: selector_memory.ordered(page_type, name, selector_variants(selectors))
+        for name, selectors in probes.items()
+    }
+    markers = list(THROTTLE_MARKERS) if throttle or baseline else None
+    state = PageState(driver.execute_script(PAGE_PROBE_JS, ordered, markers, CAPTCHA_SELECTOR, baseline))
+    for name, hit in state.found.items():
+        selector_memory.remember(page_type, name, hit['selector'])
+    return state
+
+# Фокус в поле и каретка в конец: вставка идёт туда, где стоит каретка
+FOCUS_END_JS = """
+const el = arguments[0];
+el.focus();
+const range = document.createRange();
+range.selectNodeContents(el);
+range.collapse(false);
+const selection = window.getSelection();
+selection.removeAllRanges();
+selection.addRange(range);
+"""
+# Запасной путь без CDP: execCommand вставляет текст с теми же beforeinput/input, что и ввод с клавиатуры
+INSERT_TEXT_JS = FOCUS_END_JS + "return document.execCommand('insertText', false, arguments[1]);"
+
+def insert_text(driver, element, text):
+    """Дописывает текст в поле ввода одной операцией; возвращает способ: cdp, script или keys.
+    send_keys отправляет каждый символ отдельным событием клавиатуры и не умеет символы вне BMP (эмодзи)."""
+    started = time.monotonic()
+    method = 'keys'
+    if TEXT_INPUT_MODE == 'insert':
+        try:
+            driver.execute_script(FOCUS_END_JS, element)
+            driver.execute_cdp_cmd("Input.insertText", {"text": text})
+            method = 'cdp'
+        except (AttributeError, WebDriverException) as e:
+            # Не Chromium или DevTools недоступны
+            logger.debug(f"Input.insertText недоступен ({e}), вставляю через execCommand")
+            if driver.execute_script(INSERT_TEXT_JS, element, text):
+                method = 'script'
+    if method == 'keys':
+        element.send_keys(text)
+    METRIC_TEXT_INPUT.observe(time.monotonic() - started, method=method)
+    return method
+
+# Ожидание было отменено (сессию закрыли)
+class HandoffCancelled(Exception):
+    pass
+
+# Передача SMS-кодов, групп и постов из Telegram в цикл сессии без опроса
+class Handoff:
+    def __init__(self, on_change=None):
+        self._lock = threading.Lock()
+        self._waiters = {}  # kind -> (loop, future)
+        self.on_change = on_change  # (kind, ждёт ли) - для зеркала в процессе Telegram
+
+    def _changed(self, kind):
+        if self.on_change:
+            self.on_change(kind, self.waiting_for(kind))
+
+    def waiting_for(self, kind):
+        with self._lock:
+            waiter = self._waiters.get(kind)
+            return waiter is not None and not waiter[1].done()
+
+    async def wait(self, kind, timeout=None):
+        """Ждёт значение нужного типа; asyncio.TimeoutError по таймауту"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            previous = self._waiters.get(kind)
+            self._waiters[kind] = (loop, future)
+        if previous:
+            self._resolve(previous, exception=HandoffCancelled(f"Ожидание {kind} перезапущено"))
+        self._changed(kind)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            with self._lock:
+                if self._waiters.get(kind, (None, None))[1] is future:
+                    del self._waiters[kind]
+            self._changed(kind)
+
+    def deliver(self, kind, value):
+        """Передаёт значение ожидающей сессии; False если никто не ждёт"""
+        with self._lock:
+            waiter = self._waiters.pop(kind, None)
+        if waiter is None or waiter[1].done():
+            return False
+        return self._resolve(waiter, value=value)
+
+    def cancel_all(self):
+        with self._lock:
+            waiters = list(self._waiters.values())
+            self._waiters.clear()
+        for waiter in waiters:
+            self._resolve(waiter, exception=HandoffCancelled("Сессия закрыта"))
+
+    @staticmethod
+    def _resolve(waiter, value=None, exception=None):
+        loop, future = waiter
+
+        def apply():
+            if future.done():
+                return
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(value)
+
+        try:
+            loop.call_soon_threadsafe(apply)
+            return True
+        except RuntimeError:
+            # Цикл сессии уже закрыт
+            return False
+
+# Хранилище авторизованных сессий на диске (по одному каталогу на профиль)
+class SessionStore:
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def profile_dir(self, email):
+        slug = re.sub(r"[^\w.-]", "_", email.lower())
+        path = os.path.join(self.base_dir, slug)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        return path
+
+    def user_data_dir(self, email):
+        return os.path.join(self.profile_dir(email), "chrome-profile")
+
+    def _state_path(self, email):
+        return os.path.join(self.profile_dir(email), "state.json")
+
+    def load(self, email):
+        try:
+            with open(self._state_path(email), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать сохранённую сессию {email}: {e}")
+            return None
+
+    def save(self, email, cookies, local_storage):
+        path = self._state_path(email)
+        tmp_path = path + ".tmp"
+        state = {
+            'cookies': cookies,
+            'local_storage': local_storage,
+            'saved_at': time.time(),
+        }
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def clear(self, email):
+        try:
+            os.remove(self._state_path(email))
+        except FileNotFoundError:
+            pass
+
+session_store = SessionStore(SESSION_STORE_DIR)
+
+# Постоянное хранилище кампаний: каждая пара (группа, пост) - отдельная задача со статусом.
+# Статусы задач: pending -> running -> submitting -> done; ошибка возвращает в pending,
+# пока не кончатся попытки (failed). submitting после падения бота становится unknown -
+# пост мог уйти, поэтому автоматически не повторяем.
+class CampaignStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS campaigns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account TEXT NOT NULL,
+            profile_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'active',
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            campaign_id INTEGER NOT NULL REFERENCES campaigns(id),
+            position INTEGER NOT NULL,
+            video_url TEXT NOT NULL,
+            text TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            campaign_id INTEGER NOT NULL REFERENCES campaigns(id),
+            post_id INTEGER NOT NULL REFERENCES posts(id),
+            group_url TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            finished_at REAL,
+            UNIQUE (campaign_id, post_id, group_url)
+        );
+        CREATE INDEX IF NOT EXISTS jobs_campaign_state ON jobs (campaign_id, state);
+        CREATE TABLE IF NOT EXISTS group_lists (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS group_list_items (
+            list_id INTEGER NOT NULL REFERENCES group_lists(id),
+            position INTEGER NOT NULL,
+            group_url TEXT NOT NULL,
+            PRIMARY KEY (list_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS account_nodes (
+            account TEXT PRIMARY KEY,
+            node_id TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._db = None  # Открывается при первом обращении: импорт модуля не создаёт файл базы
+
+    @property
+    def _conn(self):
+        if self._db is None:
+            with self._open_lock:
+                if self._db is None:
+                    self._db = self._open()
+        return self._db
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        self._migrate(conn)
+        return conn
+
+    def _migrate(self, conn):
+        """Колонки, добавленные после первой версии схемы"""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if 'not_before' not in columns:
+            # Время (unix), раньше которого задачу не запускать - отложена из-за ограничений OK.ru
+            conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def recover(self):
+        """После перезапуска: незавершённые задачи без отправки - снова в очередь"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = 'pending', updated_at = ? WHERE state = 'running'", (now,))
+            unknown = self._conn.execute(
+                "UPDATE jobs SET state = 'unknown', last_error = 'бот перезапущен во время отправки', updated_at = ? "
+                "WHERE state = 'submitting'", (now,)
+            ).rowcount
+        if unknown:
+            logger.warning(f"⚠️ {unknown} постов могли уйти перед падением - помечены как unknown")
+
+    def release_account(self, account):
+        """Узел с сессией аккаунта потерян: его задачи - как после перезапуска (см. recover).
+        Возвращает, сколько постов могли уйти"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'pending', updated_at = ? WHERE state = 'running' "
+                "AND campaign_id IN (SELECT id FROM campaigns WHERE account = ?)", (now, account)
+            )
+            return self._conn.execute(
+                "UPDATE jobs SET state = 'unknown', last_error = 'узел потерян во время отправки', updated_at = ? "
+                "WHERE state = 'submitting' AND campaign_id IN (SELECT id FROM campaigns WHERE account = ?)", (now, account)
+            ).rowcount
+
+    def account_node(self, account):
+        """Узел, на котором аккаунт входил последним (там лежат его куки)"""
+        rows = self._execute("SELECT node_id FROM account_nodes WHERE account = ?", (account,))
+        return rows[0]['node_id'] if rows else None
+
+    def set_account_node(self, account, node_id):
+        self._execute(
+            "INSERT INTO account_nodes (account, node_id, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(account) DO UPDATE SET node_id = excluded.node_id, updated_at = excluded.updated_at",
+            (account, node_id, time.time())
+        )
+
+    def create_campaign(self, account, profile_id, posts, groups):
+        now = time.time()
+        with self._lock, self._conn:
+            campaign_id = self._conn.execute(
+                "INSERT INTO campaigns (account, profile_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (account, profile_id, now, now)
+            ).lastrowid
+            for post_position, (video_url, text) in enumerate(posts):
+                post_id = self._conn.execute(
+                    "INSERT INTO posts (campaign_id, position, video_url, text) VALUES (?, ?, ?, ?)",
+                    (campaign_id, post_position, video_url, text)
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO jobs (campaign_id, post_id, group_url, position, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(campaign_id, post_id, group_url, position, now, now) for position, group_url in enumerate(groups)]
+                )
+        return campaign_id
+
+    def active_campaign(self, account):
+        rows = self._execute(
+            "SELECT id FROM campaigns WHERE account = ? AND status = 'active' ORDER BY id LIMIT 1", (account,)
+        )
+        return rows[0]['id'] if rows else None
+
+    def active_accounts(self):
+        return [row['account'] for row in self._execute("SELECT DISTINCT account FROM campaigns WHERE status = 'active'")]
+
+    def pending_jobs(self, campaign_id):
+        rows = self._execute(
+            "SELECT jobs.id, jobs.group_url, jobs.attempts, jobs.not_before, posts.video_url, posts.text, "
+            "posts.position AS post_position "
+            "FROM jobs JOIN posts ON posts.id = jobs.post_id "
+            "WHERE jobs.campaign_id = ? AND jobs.state = 'pending' ORDER BY jobs.not_before, jobs.position, posts.position",
+            (campaign_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def _set_state(self, job_id, state, error=None, attempt=False, finished=False):
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET state = ?, last_error = COALESCE(?, last_error), attempts = attempts + ?, "
+            "updated_at = ?, finished_at = CASE WHEN ? THEN ? ELSE finished_at END WHERE id = ?",
+            (state, error, 1 if attempt else 0, now, finished, now, job_id)
+        )
+
+    def start_job(self, job_id):
+        self._set_state(job_id, 'running', attempt=True)
+
+    def mark_submitting(self, job_id):
+        self._set_state(job_id, 'submitting')
+
+    def finish_job(self, job_id):
+        self._set_state(job_id, 'done', finished=True)
+
+    def mark_unknown(self, job_id, error):
+        self._set_state(job_id, 'unknown', error=error[:500], finished=True)
+
+    def fail_job(self, job_id, error, max_attempts):
+        """Ошибка попытки: задача возвращается в очередь, пока есть попытки"""
+        attempts = self._execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,))[0]['attempts']
+        if attempts < max_attempts:
+            self._set_state(job_id, 'pending', error=error[:500])
+            return True
+        self._set_state(job_id, 'failed', error=error[:500], finished=True)
+        return False
+
+    def defer_job(self, job_id, not_before, error, refund_attempt=True):
+        """Ограничение со стороны OK.ru: задача ждёт в очереди до not_before, попытка не сгорает"""
+        self._execute(
+            "UPDATE jobs SET state = 'pending', not_before = ?, last_error = ?, "
+            "attempts = MAX(0, attempts - ?), updated_at = ? WHERE id = ?",
+            (not_before, error[:500], 1 if refund_attempt else 0, time.time(), job_id)
+        )
+
+    def counts(self, campaign_id):
+        rows = self._execute("SELECT state, COUNT(*) AS n FROM jobs WHERE campaign_id = ? GROUP BY state", (campaign_id,))
+        return {row['state']: row['n'] for row in rows}
+
+    def problem_jobs(self, campaign_id):
+        rows = self._execute(
+            "SELECT jobs.group_url, jobs.state, jobs.last_error, posts.position AS post_position "
+            "FROM jobs JOIN posts ON posts.id = jobs.post_id "
+            "WHERE jobs.campaign_id = ? AND jobs.state IN ('failed', 'unknown') "
+            "ORDER BY jobs.position, posts.position", (campaign_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def post_count(self, campaign_id):
+        return self._execute("SELECT COUNT(*) AS n FROM posts WHERE campaign_id = ?", (campaign_id,))[0]['n']
+
+    def campaign_groups(self, campaign_id):
+        rows = self._execute(
+            "SELECT group_url FROM jobs WHERE campaign_id = ? GROUP BY group_url ORDER BY MIN(position)", (campaign_id,)
+        )
+        return [row['group_url'] for row in rows]
+
+    def finish_campaign(self, campaign_id, status='done'):
+        self._execute("UPDATE campaigns SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), campaign_id))
+
+    def save_group_list(self, name, groups):
+        """Сохраняет (или заменяет) именованный список групп"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO group_lists (name, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET updated_at = excluded.updated_at",
+                (name.lower(), time.time())
+            )
+            list_id = self._conn.execute("SELECT id FROM group_lists WHERE name = ?", (name.lower(),)).fetchone()['id']
+            self._conn.execute("DELETE FROM group_list_items WHERE list_id = ?", (list_id,))
+            self._conn.executemany(
+                "INSERT INTO group_list_items (list_id, position, group_url) VALUES (?, ?, ?)",
+                ((list_id, position, group_url) for position, group_url in enumerate(groups))
+            )
+
+    def group_list(self, name):
+        """Группы списка по имени; None - такого списка нет"""
+        rows = self._execute(
+            "SELECT group_lists.id, group_list_items.group_url FROM group_lists "
+            "LEFT JOIN group_list_items ON group_list_items.list_id = group_lists.id "
+            "WHERE group_lists.name = ? ORDER BY group_list_items.position", (name.lower(),)
+        )
+        if not rows:
+            return None
+        return [row['group_url'] for row in rows if row['group_url']]
+
+    def group_lists(self):
+        rows = self._execute(
+            "SELECT group_lists.name, COUNT(group_list_items.group_url) AS n FROM group_lists "
+            "LEFT JOIN group_list_items ON group_list_items.list_id = group_lists.id "
+            "GROUP BY group_lists.id ORDER BY group_lists.name"
+        )
+        return [(row['name'], row['n']) for row in rows]
+
+campaign_store = CampaignStore(CAMPAIGN_DB)
+
+# Признаки того, что OK.ru ограничил частоту постинга или показал капчу
+CAPTCHA_SELECTOR = "iframe[src*='captcha'], img[src*='captcha'], [id*='captcha'], [class*='captcha']"
+THROTTLE_MARKERS = ('too often', 'слишком часто', 'try again later', 'попробуйте позже', 'превышен лимит')
+
+class PostThrottled(Exception):
+    """OK.ru не принял пост из-за частоты (kind='throttled') или потребовал капчу (kind='captcha')"""
+    def __init__(self, kind, message=None):
+        super().__init__(message or kind)
+        self.kind = kind
+
+class SubmitUnconfirmed(Exception):
+    """Кнопка нажата, но ни закрытия формы, ни отказа OK.ru не дождались - пост мог уйти"""
+
+# Темп постинга на аккаунт: token bucket с джиттером, при ограничениях - AIMD
+# (скорость делится пополам и пауза растёт вдвое, после успехов скорость плавно возвращается к цели)
+class PostPacer:
+    WINDOW = 3600  # Окно для подсчёта фактического темпа, сек
+
+    def __init__(self, per_hour, burst=3, jitter=0.3, backoff=120, max_backoff=3600):
+        self.target = per_hour / 3600
+        self.rate = self.target
+        self.burst = max(1, burst)
+        self.jitter = jitter
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+        self.tokens = float(self.burst)
+        self.blocked_until = 0.0
+        self.throttles = 0
+        self.captchas = 0
+        self._updated = time.monotonic()
+        self._posted = collections.deque()
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, not_before=0.0):
+        """Ждёт разрешения на следующий пост (и времени, до которого задача отложена)"""
+        delay = (not_before or 0) - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.target <= 0:
+            # Без целевого темпа остаётся только пауза после ограничения
+            wait = self.blocked_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    interval = 1 / self.rate
+                    break
+                if wait <= 0:
+                    wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+        if self.jitter:
+            # Посты не должны уходить ровным метрономом
+            await asyncio.sleep(random.uniform(0, self.jitter * interval))
+
+    def success(self):
+        with self._lock:
+            now = time.monotonic()
+            self._posted.append(now)
+            self.rate = min(self.target, self.rate + self.target / 10)
+            self.backoff = self.base_backoff
+
+    def throttled(self, kind):
+        """Возвращает unix-время, раньше которого повторять не стоит"""
+        with self._lock:
+            now = time.monotonic()
+            if kind == 'captcha':
+                self.captchas += 1
+            else:
+                self.throttles += 1
+            self.rate = max(self.target / 20, self.rate / 2)
+            self.tokens = 0.0
+            pause = self.backoff
+            self.blocked_until = now + pause
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            return time.time() + pause
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            while self._posted and self._posted[0] < now - self.WINDOW:
+                self._posted.popleft()
+            window = min(self.WINDOW, max(now - self._started, 60))
+            return {
+                'target_per_hour': round(self.target * 3600, 1),
+                'current_per_hour': round(self.rate * 3600, 1),
+                'achieved_per_hour': round(len(self._posted) / window * 3600, 1),
+                'throttles': self.throttles,
+                'captchas': self.captchas,
+                'blocked_for': max(0, round(self.blocked_until - now)),
+            }
+
+pacers = {}  # аккаунт -> PostPacer
+pacers_lock = threading.Lock()
+
+def get_pacer(account):
+    with pacers_lock:
+        if account not in pacers:
+            pacers[account] = PostPacer(POST_RATE_PER_HOUR, POST_BURST, POST_JITTER, THROTTLE_BACKOFF, THROTTLE_MAX_BACKOFF)
+        return pacers[account]
+
+# WebDriver не потокобезопасен, а его вызовы блокируют: команды сессии идут по очереди в её потоке
+class AsyncDriver:
+    def __init__(self, name):
+        self.driver = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"driver-{name}")
+
+    async def run(self, fn, *args, **kwargs):
+        """Выполняет fn в потоке драйвера; цикл событий в это время свободен"""
+        loop = asyncio.get_running_loop()
+        # Контекст копируется, чтобы команды драйвера попадали в текущий спан трассировки
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def get(self, url):
+        return await self.run(self.driver.get, url)
+
+    async def current_url(self):
+        return await self.run(lambda: self.driver.current_url)
+
+    async def find_element(self, by, value):
+        return await self.run(self.driver.find_element, by, value)
+
+    async def execute_script(self, script, *args):
+        return await self.run(self.driver.execute_script, script, *args)
+
+    async def click(self, element):
+        return await self.run(element.click)
+
+    async def clear(self, element):
+        return await self.run(element.clear)
+
+    async def send_keys(self, element, *keys):
+        return await self.run(element.send_keys, *keys)
+
+    async def insert_text(self, element, text):
+        return await self.run(insert_text, self.driver, element, text)
+
+    def call(self, fn, *args):
+        """Синхронный вызов из другого потока (не из потока драйвера): ждёт своей очереди"""
+        return self._executor.submit(fn, *args).result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
 # Класс для работы с OK.ru
 class OKSession:
-    def __init__(self, email, password, person_name):
+    def __init__(self, email, password, person_name, profile_id=None):
         self.email = email
         self.password = password
         self.person_name = person_name
-        self.driver = None
-        self.wait = None
+        self.profile_id = profile_id
+        # Все команды драйвера - через browser, чтобы не блокировать общий цикл сессий
+        self.browser = AsyncDriver(profile_id or email)
         self.authenticated = False
+        # Ожидание команд из Telegram - у каждой сессии своё
+        self.handoff = Handoff()
+        # Вкладки для параллельного постинга
+        self.tab_lock = None
+        self.current_tab = None
+        # Постов через текущий Chrome - для планового перезапуска
+        self.driver_posts = 0
+        # Темп постинга общий для всех сессий аккаунта
+        self.pacer = get_pacer(email)
+
+    @property
+    def driver(self):
+        return self.browser.driver
+
+    @driver.setter
+    def driver(self, driver):
+        self.browser.driver = driver
         
     async def send_status(self, message):
         """Отправляет статус авторизации в Telegram"""
-        status_message = f"👤 {self.person_name}\n{message}"
-        await send_telegram_message(status_message)
+        await send_telegram_message(message, header=f"👤 {self.person_name}")
+
+    async def send_progress(self, done, total):
+        """Прогресс кампании - одно сообщение, которое редактируется на месте"""
+        outbox.progress(
+            f"progress:{self.profile_id}",
+            f"👤 {self.person_name}\n📤 {done}/{total} групп обработано",
+            final=done >= total
+        )
         
     def init_driver(self):
-        """Инициализация драйвера с несколькими попытками"""
-        max_attempts = 3
+        """Получение прогретого драйвера из пула"""
+        if SESSION_STORE_USER_DATA:
+            # Профиль Chrome задаётся при запуске - прогретый драйвер тут не подойдёт
+            with METRIC_INIT_DRIVER.time(source='dedicated'):
+                self.driver = launch_chrome(user_data_dir=session_store.user_data_dir(self.email))
+            self.driver_posts = 0
+            logger.info("Chrome драйвер запущен с сохранённым профилем")
+            return True
+        with METRIC_INIT_DRIVER.time(source='pool'):
+            self.driver = driver_pool.acquire()
+        self.driver_posts = 0
+        logger.info(f"Chrome драйвер получен из пула: {driver_pool.stats()}")
+        return True
         
-        for attempt in range(max_attempts):
+    def is_logged_in(self):
+        return self.probe('home', {}).logged_in
+
+    def probe(self, page_type, probes, throttle=False, baseline=False):
+        return probe_page(self.driver, page_type, probes, throttle, baseline)
+
+    def wait_for_probe(self, page_type, probes, ready, timeout=20, interval=0.2, **options):
+        """Опрашивает страницу (один запрос на опрос), пока ready(снимок) не истинно; None по таймауту.
+        options (throttle, baseline) передаются в probe"""
+        deadline = time.monotonic() + timeout
+        while True:
             try:
-                logger.info(f"Попытка {attempt + 1} инициализации Chrome драйвера")
-                
-                opts = uc.ChromeOptions()
-                opts.add_argument('--headless=new')
-                opts.add_argument('--no-sandbox')
-                opts.add_argument('--disable-dev-shm-usage')
-                opts.add_argument('--disable-gpu')
-                opts.add_argument('--window-size=1920,1080')
-                opts.add_argument('--disable-web-security')
-                opts.add_argument('--allow-running-insecure-content')
-                opts.add_argument('--disable-extensions')
-                opts.add_argument('--disable-plugins')
-                opts.add_argument('--disable-images')
-                opts.add_argument('--disable-javascript')
-                opts.add_argument('--disable-default-apps')
-                opts.add_argument('--disable-background-timer-throttling')
-                opts.add_argument('--disable-backgrounding-occluded-windows')
-                opts.add_argument('--disable-renderer-backgrounding')
-                opts.add_argument('--disable-features=TranslateUI')
-                opts.add_argument('--disable-ipc-flooding-protection')
-                
-                # Попробуем разные способы инициализации
-                if attempt == 0:
-                    # Первая попытка - автоматическое управление версиями
-                    self.driver = uc.Chrome(options=opts, version_main=None)
-                elif attempt == 1:
-                    # Вторая попытка - использовать установленный Chrome
-                    self.driver = uc.Chrome(options=opts, use_subprocess=False)
-                else:
-                    # Третья попытка - принудительное скачивание совместимой версии
-                    self.driver = uc.Chrome(options=opts, driver_executable_path=None)
-                
-                self.wait = WebDriverWait(self.driver, 20)
-                logger.info("Chrome драйвер успешно инициализирован")
-                return True
-                
+                state = self.probe(page_type, probes, **options)
+                if ready(state):
+                    return state
+            except WebDriverException:
+                pass  # Документ сменился между запросами
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+
+    def restore_session(self):
+        """Восстанавливает сохранённые куки и localStorage, проверяет что сессия жива"""
+        if self.is_logged_in():
+            logger.info("Профиль Chrome уже авторизован")
+            return True
+        
+        saved = session_store.load(self.email)
+        if not saved:
+            return False
+        
+        for cookie in saved.get('cookies', []):
+            try:
+                self.driver.add_cookie(cookie)
             except WebDriverException as e:
-                logger.warning(f"Попытка {attempt + 1} неудачна: {str(e)}")
-                if attempt == max_attempts - 1:
-                    logger.error("Все попытки инициализации Chrome драйвера провалились")
-                    raise e
-                time.sleep(2)
-            except Exception as e:
-                logger.error(f"Неожиданная ошибка при инициализации драйвера: {e}")
-                if attempt == max_attempts - 1:
-                    raise e
-                time.sleep(2)
+                logger.warning(f"Кука {cookie.get('name')} не восстановлена: {e}")
+        self.driver.execute_script(
+            "for (const [k, v] of Object.entries(arguments[0])) window.localStorage.setItem(k, v);",
+            saved.get('local_storage', {})
+        )
+        self.driver.get(f"{OK_BASE_URL}/")
         
-        return False
+        if self.is_logged_in():
+            logger.info(f"♻️ Сессия {self.person_name} восстановлена")
+            return True
         
+        # Сессия протухла - чистим и идём на полный вход
+        logger.info(f"Сохранённая сессия {self.person_name} недействительна")
+        session_store.clear(self.email)
+        self.driver.delete_all_cookies()
+        self.driver.execute_script("window.localStorage.clear();")
+        self.driver.get(f"{OK_BASE_URL}/")
+        return False
+
+    def save_session(self):
+        try:
+            cookies = self.driver.get_cookies()
+            local_storage = self.driver.execute_script("return Object.assign({}, window.localStorage);")
+            session_store.save(self.email, cookies, local_storage)
+            logger.info(f"💾 Сессия {self.person_name} сохранена")
+        except Exception as e:
+            logger.error(f"Ошибка сохранения сессии: {e}")
+
+    def wait_for_any(self, probes, timeout):
+        """Возвращает имя первого выполненного условия или None по таймауту"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                self.driver.set_script_timeout(remaining + 5)
+                return self.driver.execute_async_script(WAIT_FOR_ANY_JS, probes, int(remaining * 1000))
+            except WebDriverException:
+                # Документ сменился во время ожидания - проверяем уже новую страницу
+                time.sleep(0.05)
+
+    def record_page_stats(self, page_type):
+        if not NETWORK_STATS:
+            return
+        try:
+            page_stats.record(self.driver, page_type)
+        except WebDriverException as e:
+            logger.debug(f"Метрики страницы недоступны: {e}")
+
+    def mark_page(self):
+        """Помечает текущий документ, чтобы отличить его от следующего после перехода"""
+        self.driver.execute_script("window.__okbotLeaving = true;")
+
+    def wait_for_navigation(self, timeout):
+        return self.wait_for_any([{'name': 'loaded', 'fresh': True}], timeout) is not None
+
+    @traced('try_confirm_identity')
     async def try_confirm_identity(self):
         try:
-            btn = self.wait.until(EC.element_to_be_clickable((By.XPATH,
-                "//input[@value='Yes, confirm']"
-                " | //button[contains(text(),'Yes, confirm')]"
-                " | //button[contains(text(),'Да, это я')]"
-            )))
-            btn.click()
+            # Ждём, что появится раньше: кнопка подтверждения или следующий шаг входа
+            state = await self.browser.run(self.wait_for_any, [
+                {'name': 'confirm', 'xpath': CONFIRM_IDENTITY_XPATH},
+                {'name': 'logged_in', 'data_l': 'userMain'},
+                {'name': 'get_code', 'xpath': GET_CODE_XPATH},
+                {'name': 'sms_code', 'xpath': SMS_CODE_INPUT_XPATH},
+            ], CONFIRM_IDENTITY_TIMEOUT)
+            if state != 'confirm':
+                await self.send_status("ℹ️ Подтверждение не требуется")
+                return
+            state = await self.browser.run(self.wait_for_probe, 'confirm', {'confirm': CONFIRM_IDENTITY_VARIANTS},
+                                           lambda s: s.usable('confirm'))
+            if state is None:
+                raise TimeoutException("Кнопка подтверждения не стала доступной")
+            btn = state.usable('confirm')
+            await self.browser.run(self.mark_page)
+            await self.browser.click(btn)
             await self.send_status("✅ Личность подтверждена")
-            time.sleep(1)
+            await self.browser.run(self.wait_for_navigation, LOGIN_SUBMIT_TIMEOUT)
         except:
             await self.send_status("ℹ️ Подтверждение не требуется")
 
-    def wait_for_sms_code(self, timeout=120):
-        global waiting_for_sms, sms_code_received
-        waiting_for_sms = True
-        sms_code_received = None
-        
-        logger.info("Ожидаю SMS-код")
-        deadline = time.time() + timeout
-        
-        while time.time() < deadline:
-            if sms_code_received is not None:
-                code = sms_code_received
-                sms_code_received = None
-                waiting_for_sms = False
-                logger.info("SMS-код получен")
-                return code
-            time.sleep(1)
-        
-        waiting_for_sms = False
-        logger.error("Не получили SMS-код")
-        raise TimeoutException("SMS-код не получен")
+    async def wait_for_sms_code(self, timeout=SMS_CODE_TIMEOUT):
+        logger.info(f"Ожидаю SMS-код для {self.person_name}")
+        try:
+            code = await self.handoff.wait('sms', timeout)
+        except asyncio.TimeoutError:
+            logger.error("Не получили SMS-код")
+            raise TimeoutException("SMS-код не получен")
+        logger.info("SMS-код получен")
+        return code
 
+    @traced('try_sms_verification')
     async def try_sms_verification(self):
         try:
             await self.send_status("🔍 Проверяю статус...")
-            data_l = self.driver.find_element(By.TAG_NAME,'body').get_attribute('data-l') or ''
-            if 'userMain' in data_l and 'anonymMain' not in data_l:
+            state = await self.browser.run(self.probe, 'sms', SMS_PROBES)
+            if state.logged_in:
                 await self.send_status("✅ Уже авторизован!")
                 return True
                 
             await self.send_status("📱 Нужна SMS-верификация")
-            btn = self.wait.until(EC.element_to_be_clickable((By.XPATH,
-                "//input[@type='submit' and @value='Get code']"
-            )))
-            btn.click()
-            time.sleep(1)
+            if not state.usable('get_code'):
+                state = await self.browser.run(self.wait_for_probe, 'sms', SMS_PROBES, lambda s: s.usable('get_code'))
+                if state is None:
+                    raise TimeoutException("Кнопка Get code не появилась")
+            await self.browser.click(state.usable('get_code'))
             
-            body_text = self.driver.find_element(By.TAG_NAME,'body').text.lower()
-            if 'too often' in body_text:
+            state = await self.browser.run(self.wait_for_any, [
+                {'name': 'too_often', 'text': 'too often'},
+                {'name': 'sms_code', 'xpath': SMS_CODE_INPUT_XPATH},
+            ], SMS_FORM_TIMEOUT)
+            if state == 'too_often':
+                METRIC_SMS_CHALLENGES.inc(result='too_often')
                 await self.send_status("⏰ Слишком часто! Попробуйте позже")
                 return False
                 
             await self.send_status("⌛ Жду SMS-код...")
-            inp = self.wait.until(EC.presence_of_element_located((By.XPATH,
-                "//input[@id='smsCode' or contains(@name,'smsCode')]"
-            )))
+            state = await self.browser.run(self.wait_for_probe, 'sms', SMS_PROBES, lambda s: s.element('sms_code'))
+            if state is None:
+                raise TimeoutException("Поле SMS-кода не появилось")
             
-            code = self.wait_for_sms_code()
+            code = await self.wait_for_sms_code()
             
             await self.send_status("🔢 Ввожу код...")
-            inp.clear()
-            inp.send_keys(code)
-            next_btn = self.driver.find_element(By.XPATH,
-                "//input[@type='submit' and @value='Next']"
-            )
-            next_btn.click()
+            inp = state.element('sms_code')
+            await self.browser.clear(inp)
+            await self.browser.send_keys(inp, code)
+            next_btn = state.element('next') or await self.browser.find_element(By.XPATH, SMS_NEXT_XPATH)
+            await self.browser.run(self.mark_page)
+            await self.browser.click(next_btn)
+            await self.browser.run(self.wait_for_navigation, LOGIN_SUBMIT_TIMEOUT)
             
+            METRIC_SMS_CHALLENGES.inc(result='confirmed')
             await self.send_status("✅ SMS подтвержден!")
             return True
         except Exception as e:
+            METRIC_SMS_CHALLENGES.inc(result='failed')
             await self.send_status(f"❌ Ошибка SMS: {str(e)[:50]}...")
             return False
 
+    @traced('authenticate')
     async def authenticate(self):
+        started = time.monotonic()
         try:
             await self.send_status("🚀 Начинаю авторизацию...")
             
             # Инициализация драйвера с обработкой ошибок
-            if not self.init_driver():
+            with METRIC_AUTH_PHASE.time(phase='init_driver'):
+                driver_ready = await self.browser.run(self.init_driver)
+            if not driver_ready:
                 await self.send_status("❌ Не удалось инициализировать браузер")
                 return False
             
             await self.send_status("🌐 Открываю OK.ru...")
-            self.driver.get("https://ok.ru/")
+            with METRIC_AUTH_PHASE.time(phase='open'):
+                # Прогретый драйвер уже стоит на странице входа
+                if not (await self.browser.current_url()).startswith(OK_BASE_URL):
+                    await self.browser.get(f"{OK_BASE_URL}/")
+            
+            with METRIC_AUTH_PHASE.time(phase='restore'):
+                restored = await self.browser.run(self.restore_session)
+            if restored:
+                self.authenticated = True
+                METRIC_AUTH_PHASE.observe(time.monotonic() - started, phase='total_restored')
+                await self.send_status("♻️ Сессия восстановлена, вход без пароля и SMS")
+                return True
             
             await self.send_status("📝 Ввожу данные...")
-            self.wait.until(EC.presence_of_element_located((By.NAME,'st.email'))).send_keys(self.email)
-            self.driver.find_element(By.NAME,'st.password').send_keys(self.password)
-            self.driver.find_element(By.CSS_SELECTOR, "input[type='submit']").click()
-            time.sleep(2)
+            with METRIC_AUTH_PHASE.time(phase='credentials'):
+                # Поля и кнопка формы входа - одним запросом к драйверу
+                form = await self.browser.run(self.wait_for_probe, 'login', LOGIN_PROBES,
+                                              lambda s: all(s.element(name) for name in LOGIN_PROBES))
+                if form is None:
+                    raise TimeoutException("Форма входа не появилась")
+                await self.browser.send_keys(form.element('email'), self.email)
+                await self.browser.run(self.record_page_stats, 'login')
+                await self.browser.send_keys(form.element('password'), self.password)
+                await self.browser.run(self.mark_page)
+                await self.browser.click(form.element('submit'))
+                if not await self.browser.run(self.wait_for_navigation, LOGIN_SUBMIT_TIMEOUT):
+                    logger.warning("Страница после входа не загрузилась вовремя")
             
-            await self.try_confirm_identity()
+            with METRIC_AUTH_PHASE.time(phase='confirm_identity'):
+                await self.try_confirm_identity()
             
-            if await self.try_sms_verification():
+            with METRIC_AUTH_PHASE.time(phase='sms'):
+                verified = await self.try_sms_verification()
+            if verified:
+                METRIC_AUTH_PHASE.observe(time.monotonic() - started, phase='total_login')
                 self.authenticated = True
+                await self.browser.run(self.save_session)
                 await self.send_status("🎉 Авторизация успешна!")
                 return True
             else:
@@ -299,189 +2589,1601 @@ class OKSession:
             await self.send_status(f"💥 Ошибка: {str(e)[:50]}...")
             return False
 
-    def wait_for_groups(self):
-        global waiting_for_groups, groups_received
-        waiting_for_groups = True
-        groups_received = None
-        
-        logger.info("Жду команду #группы")
-        while groups_received is None:
-            time.sleep(1)
-        
-        groups = groups_received
-        groups_received = None
-        waiting_for_groups = False
+    async def wait_for_groups(self, timeout=GROUPS_TIMEOUT):
+        logger.info(f"Жду команду #группы для {self.person_name}")
+        groups = await self.handoff.wait('groups', timeout)
         logger.info("Список групп получен")
         return groups
 
-    def wait_for_post_info(self):
-        global waiting_for_post, post_info_received
-        waiting_for_post = True
-        post_info_received = None
-        
-        logger.info("Жду команду #пост")
-        while post_info_received is None:
-            time.sleep(1)
-        
-        post_info = post_info_received
-        post_info_received = None
-        waiting_for_post = False
-        logger.info("Инфо для поста получено")
-        return post_info
+    async def wait_for_post_info(self, timeout=POST_INFO_TIMEOUT):
+        """Список (ссылка, текст) - в одном сообщении может быть несколько #пост"""
+        logger.info(f"Жду команду #пост для {self.person_name}")
+        posts = await self.handoff.wait('post', timeout)
+        logger.info(f"Инфо для постов получено: {len(posts)}")
+        return posts
 
-    async def post_to_group(self, group_url, video_url, text):
+    async def wait_for_next_command(self, timeout=POST_INFO_TIMEOUT):
+        """Между кампаниями: ('post', посты) в те же группы или ('groups', новый список)"""
+        logger.info(f"Жду следующую команду #пост или #группы для {self.person_name}")
+        waits = {asyncio.ensure_future(self.handoff.wait(kind, timeout)): kind for kind in ('post', 'groups')}
+        done, pending = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            if task.exception() is None:
+                break
+        return waits[task], task.result()
+
+    @traced('post_to_group', ('group',))
+    async def post_to_group(self, group_url, video_url, text, on_submit=None):
+        """on_submit вызывается прямо перед отправкой - после него повтор может дать дубль"""
         post_url = group_url.rstrip('/') + '/post'
-        logger.info("🚀 Открываю страницу постинга")
-        self.driver.get(post_url)
-        
-        # Ждем загрузки поля для ввода
-        box = self.wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR,
-            "div[contenteditable='true']"
-        )))
-        box.click()
-        box.clear()
-        
-        # 1) Вставляем ссылку и пробел для загрузки превью
-        box.send_keys(video_url)
-        box.send_keys(Keys.SPACE)  # Критически важно для загрузки превью!
+        browser = self.browser
+        box = await browser.run(self.reusable_post_box, post_url)
+        if box is not None:
+            logger.info("♻️ Страница постинга уже открыта, пишу следующий пост")
+        else:
+            logger.info("🚀 Открываю страницу постинга")
+            await browser.get(post_url)
+            
+            # Ждем загрузки поля для ввода
+            state = await browser.run(self.wait_for_probe, 'post', POST_PROBES, lambda s: s.usable('box'))
+            if state is None:
+                raise TimeoutException(f"Поле ввода не появилось на {group_url}")
+            box = state.usable('box')
+        await browser.click(box)
+        await browser.clear(box)
+        
+        # 1) Вставляем ссылку и пробел для загрузки превью (одной командой драйвера)
+        await browser.send_keys(box, video_url, Keys.SPACE)  # Пробел критически важен для загрузки превью!
         logger.info("✍️ Ссылка вставлена и пробел отправлен")
         
-        # 2) Ждём появление карточки превью с несколькими селекторами
+        # 2) Ждём появление карточки превью; сработавший прошлый раз селектор проверяется первым
         logger.info("⏳ Жду видео-карточку...")
-        attached = False
-        for _ in range(10):  # 10 секунд ожидания
-            # Проверяем различные типы карточек превью
-            if self.driver.find_elements(By.CSS_SELECTOR, "div.vid-card.vid-card__xl"):
-                attached = True
-                break
-            if self.driver.find_elements(By.CSS_SELECTOR, "div.mediaPreview, div.mediaFlex, div.preview_thumb"):
-                attached = True
-                break
-            time.sleep(1)
+        preview_started = time.monotonic()
+        selectors = selector_memory.ordered('post', 'preview', PREVIEW_CARD_SELECTORS)
+        matched = await browser.run(self.wait_for_any,
+            [{'name': selector, 'css': selector} for selector in selectors],
+            PREVIEW_TIMEOUT
+        )
+        attached = matched is not None
+        if attached:
+            selector_memory.remember('post', 'preview', matched)
+        METRIC_PREVIEW_WAIT.observe(time.monotonic() - preview_started, result='attached' if attached else 'timeout')
         
         if attached:
             logger.info("✅ Видео-карта появилась")
         else:
-            logger.warning(f"⚠️ Не дождался карточки видео за 10 сек на {group_url}")
+            logger.warning(f"⚠️ Не дождался карточки видео за {PREVIEW_TIMEOUT:g} сек на {group_url}")
         
-        # 3) Вставляем текст одной строкой (не построчно!)
-        box.send_keys(" " + text)  # Пробел + весь текст сразу
+        # 3) Вставляем текст одной операцией: ссылка уже набрана клавишами, превью от вставки не зависит
+        await browser.insert_text(box, " " + text)  # Пробел + весь текст сразу
         logger.info("✍️ Текст вставлен")
         
-        # 4) Публикуем
-        btn = self.wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR,
-            "button.js-pf-submit-btn[data-action='submit']"
-        )))
-        btn.click()
+        # 4) Публикуем; снимок предупреждений перед нажатием - после него считаются только новые
+        state = await browser.run(self.wait_for_probe, 'post', POST_PROBES, lambda s: s.usable('submit'), baseline=True)
+        if state is None:
+            raise TimeoutException(f"Кнопка публикации не появилась на {group_url}")
+        btn = state.usable('submit')
+        await browser.run(self.record_page_stats, 'post')
+        if on_submit:
+            on_submit()
+        await browser.click(btn)
+        # Форма постинга закрывается после отправки; при ограничении OK.ru показывает капчу или предупреждение
+        outcome = await browser.run(self.wait_for_submit_outcome, POST_SUBMIT_TIMEOUT)
+        self.check_submit_outcome(outcome, group_url)
         logger.info("✅ Пост опубликован")
-        await self.send_status("📝 Пост опубликован в группе")
-        time.sleep(1)
-    
-    async def start_posting_workflow(self):
+
+    def preview_attached(self):
+        return self.probe('post', {'preview': PREVIEW_CARD_SELECTORS}).element('preview') is not None
+
+    def find_fresh_post_box(self):
+        """Поле ввода новой страницы (старый документ помечен перед переходом)"""
+        state = self.probe('post', {'box': POST_BOX_SELECTOR})
+        return state.usable('box') if state.fresh else None
+
+    def reusable_post_box(self, post_url):
+        """Пустое поле ввода на уже открытой странице этой группы - следующий пост без перезагрузки"""
+        state = self.probe('post', POST_PROBES)
+        if state.url.rstrip('/') != post_url.rstrip('/') or not state.fresh:
+            return None
+        box = state.usable('box')
+        if box is None or state.text('box') or state.element('preview'):
+            return None
+        return box
+
+    def find_submit_button(self):
+        """Кнопка публикации; заодно снимок предупреждений на странице до нажатия"""
+        return self.probe('post', {'submit': SUBMIT_BUTTON_SELECTOR}, baseline=True).usable('submit')
+
+    def submit_outcome(self):
+        """После нажатия: 'submitted' (кнопки больше нет), 'captcha' / 'throttled' (новое предупреждение,
+        а кнопка на месте - пост не принят) или None, пока неясно"""
+        try:
+            state = self.probe('post', {'submit': SUBMIT_BUTTON_SELECTOR}, throttle=True)
+        except WebDriverException:
+            return None  # Документ сменился между запросами
+        if state.element('submit') is None:
+            return 'submitted'
+        return state.throttle
+
+    def wait_for_submit_outcome(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            outcome = self.submit_outcome()
+            if outcome or time.monotonic() >= deadline:
+                return outcome
+            time.sleep(0.2)
+
+    @staticmethod
+    def check_submit_outcome(outcome, group_url):
+        if outcome in ('captcha', 'throttled'):
+            raise PostThrottled(outcome, f"OK.ru ограничил постинг в {group_url} ({outcome})")
+        if outcome != 'submitted':
+            raise SubmitUnconfirmed(f"OK.ru не подтвердил публикацию в {group_url} за {POST_SUBMIT_TIMEOUT:g} сек")
+
+    async def in_tab(self, handle, fn, *args):
+        """Выполняет действие с драйвером в своей вкладке (команды драйвера идут по очереди)"""
+        async with self.tab_lock:
+            if self.current_tab != handle:
+                await self.browser.run(self.driver.switch_to.window, handle)
+                self.current_tab = handle
+            return await self.browser.run(fn, *args)
+
+    async def poll_in_tab(self, handle, check, timeout, interval=0.25):
+        """Опрашивает условие во вкладке, отпуская драйвер другим вкладкам между проверками"""
+        deadline = time.monotonic() + timeout
+        while True:
+            result = await self.in_tab(handle, check)
+            if result:
+                return result
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(interval)
+
+    @traced('post_in_tab', ('tab', 'group'))
+    async def post_in_tab(self, handle, group_url, video_url, text, on_submit=None):
+        post_url = group_url.rstrip('/') + '/post'
+        box = await self.in_tab(handle, self.reusable_post_box, post_url)
+        if box is None:
+            logger.info(f"🚀 Открываю страницу постинга во вкладке: {post_url}")
+            # Переход без ожидания загрузки - пока грузится, драйвер работает с другими вкладками
+            await self.in_tab(handle, self.driver.execute_script,
+                "window.__okbotLeaving = true; window.location.href = arguments[0];", post_url)
+            
+            box = await self.poll_in_tab(handle, self.find_fresh_post_box, timeout=20)
+            if box is None:
+                raise TimeoutException(f"Поле ввода не появилось на {group_url}")
+        
+        def type_link():
+            box.click()
+            box.clear()
+            box.send_keys(video_url)
+            box.send_keys(Keys.SPACE)  # Критически важно для загрузки превью!
+        await self.in_tab(handle, type_link)
+        
+        preview_started = time.monotonic()
+        attached = bool(await self.poll_in_tab(handle, self.preview_attached, timeout=PREVIEW_TIMEOUT))
+        METRIC_PREVIEW_WAIT.observe(time.monotonic() - preview_started, result='attached' if attached else 'timeout')
+        if not attached:
+            logger.warning(f"⚠️ Не дождался карточки видео за {PREVIEW_TIMEOUT:g} сек на {group_url}")
+        
+        await self.in_tab(handle, insert_text, self.driver, box, " " + text)
+        btn = await self.poll_in_tab(handle, self.find_submit_button, timeout=20)
+        if btn is None:
+            raise TimeoutException(f"Кнопка публикации не появилась на {group_url}")
+        await self.in_tab(handle, self.record_page_stats, 'post')
+        if on_submit:
+            on_submit()
+        await self.in_tab(handle, btn.click)
+        outcome = await self.poll_in_tab(handle, self.submit_outcome, timeout=POST_SUBMIT_TIMEOUT)
+        self.check_submit_outcome(outcome, group_url)
+        logger.info(f"✅ Пост опубликован в {group_url}")
+        return attached
+
+    async def run_job(self, job, handle=None):
+        """Одна задача кампании: пост в группу с записью статуса в хранилище"""
+        submitted = False
+
+        def on_submit():
+            nonlocal submitted
+            submitted = True
+            campaign_store.mark_submitting(job['id'])
+
+        with tracer.span('pace_wait', profile=self.person_name):
+            await self.pacer.acquire(job.get('not_before'))
+        campaign_store.start_job(job['id'])
+        started = time.monotonic()
+        result = {'group': job['group_url'], 'seconds': 0}
+        with tracer.span('job', profile=self.person_name, group=job['group_url']) as span:
+            try:
+                if handle is not None:
+                    attached = await self.post_in_tab(handle, job['group_url'], job['video_url'], job['text'], on_submit)
+                    result.update(status='ok', preview=attached)
+                else:
+                    await self.post_to_group(job['group_url'], job['video_url'], job['text'], on_submit)
+                    result.update(status='ok')
+                campaign_store.finish_job(job['id'])
+                self.pacer.success()
+                METRIC_POSTS.inc(result='succeeded')
+            except PostThrottled as e:
+                # Пост не принят - группа откладывается, темп аккаунта снижается
+                resume_at = self.pacer.throttled(e.kind)
+                logger.warning(f"🐢 {e}, повтор не раньше чем через {resume_at - time.time():.0f} сек")
+                result.update(status=e.kind, error=str(e)[:200])
+                METRIC_POSTS.inc(result=e.kind)
+                if e.kind == 'captcha' and job['attempts'] + 1 >= JOB_MAX_ATTEMPTS:
+                    campaign_store.fail_job(job['id'], str(e), JOB_MAX_ATTEMPTS)
+                else:
+                    campaign_store.defer_job(job['id'], resume_at, str(e), refund_attempt=e.kind != 'captcha')
+                icon = "🧩 OK.ru показал капчу" if e.kind == 'captcha' else "🐢 OK.ru ограничил частоту постинга"
+                await self.send_status(f"{icon}, пауза {resume_at - time.time():.0f} сек, темп снижен")
+            except Exception as e:
+                logger.error(f"Ошибка постинга в {job['group_url']}: {e}")
+                result.update(status='error', error=str(e)[:200])
+                if submitted:
+                    # Кнопка уже нажата - повтор может задублировать пост
+                    campaign_store.mark_unknown(job['id'], str(e))
+                    METRIC_POSTS.inc(result='unknown')
+                else:
+                    result['retry'] = campaign_store.fail_job(job['id'], str(e), JOB_MAX_ATTEMPTS)
+                    METRIC_POSTS.inc(result='failed')
+            self.driver_posts += 1
+            if span:
+                span.set(status=result['status'])
+        elapsed = time.monotonic() - started
+        METRIC_POST.observe(elapsed, status=result['status'])
+        result['seconds'] = round(elapsed, 2)
+        return result
+
+    def posts_before_recycle(self, default):
+        if not supervisor.max_posts:
+            return default
+        return max(1, supervisor.max_posts - self.driver_posts)
+
+    async def maybe_recycle_driver(self):
+        reason = await asyncio.to_thread(supervisor.recycle_reason, self.driver, self.driver_posts) if self.driver else None
+        if reason:
+            await self.recycle_driver(reason)
+
+    async def recycle_driver(self, reason):
+        """Перезапускает Chrome, сохраняя вход: куки и localStorage переносятся в новый драйвер"""
+        logger.info(f"♻️ Перезапускаю Chrome для {self.person_name} (причина: {reason}, постов: {self.driver_posts})")
+        METRIC_DRIVER_RECYCLES.inc(reason=reason)
+        with tracer.span('recycle_driver', profile=self.person_name, reason=reason):
+            await self.browser.run(self.save_session)
+            await self.browser.run(driver_pool.release, self.driver, SESSION_STORE_USER_DATA)
+            self.driver = None
+            await self.browser.run(self.init_driver)
+            if not (await self.browser.current_url()).startswith(OK_BASE_URL):
+                await self.browser.get(f"{OK_BASE_URL}/")
+            if await self.browser.run(self.restore_session):
+                return
+            await self.send_status("⚠️ После перезапуска Chrome сессия не восстановилась, вхожу заново")
+            await self.browser.run(driver_pool.release, self.driver)
+            self.driver = None
+            self.authenticated = False
+            if not await self.authenticate():
+                raise RuntimeError("Не удалось войти после перезапуска Chrome")
+
+    async def run_jobs_parallel(self, jobs, parallelism, on_done):
+        """Постинг в несколько вкладок одного драйвера с ограничением параллельности.
+        
+        Все посты одной группы идут подряд в одной вкладке: пока она ждёт превью
+        или отправку, остальные вкладки работают со своими группами.
+        """
+        lanes = {}
+        for job in jobs:
+            lanes.setdefault(job['group_url'], []).append(job)
+        parallelism = max(1, min(parallelism, len(lanes)))
+        self.tab_lock = asyncio.Lock()
+        main_tab = await self.browser.run(lambda: self.driver.current_window_handle)
+        self.current_tab = main_tab
+        
+        tabs = asyncio.Queue()
+        tabs.put_nowait(main_tab)
+        for _ in range(parallelism - 1):
+            self.current_tab = await self.browser.run(self.open_tab)
+            tabs.put_nowait(self.current_tab)
+        
+        async def worker(lane):
+            handle = await tabs.get()
+            results = []
+            try:
+                for job in lane:
+                    result = await self.run_job(job, handle)
+                    await on_done(result)
+                    results.append(result)
+            finally:
+                tabs.put_nowait(handle)
+            return results
+        
         try:
+            lane_results = await asyncio.gather(*(worker(lane) for lane in lanes.values()))
+            return [result for results in lane_results for result in results]
+        finally:
+            await self.browser.run(self.close_tabs, main_tab)
+            self.current_tab = main_tab
+
+    def open_tab(self):
+        self.driver.switch_to.new_window('tab')
+        apply_network_policy(self.driver)
+        return self.driver.current_window_handle
+
+    def close_tabs(self, main_tab):
+        """Закрывает дополнительные вкладки, остаётся в основной"""
+        for handle in self.driver.window_handles:
+            if handle != main_tab:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+        self.driver.switch_to.window(main_tab)
+
+    async def run_campaign(self, campaign_id):
+        """Выполняет все оставшиеся задачи кампании; упавшие группы повторяются по одной"""
+        profile_path = TRACE_PROFILE_DIR and os.path.join(TRACE_PROFILE_DIR, f"campaign-{campaign_id}.folded")
+        with tracer.profile(profile_path), tracer.span('campaign', profile=self.person_name, campaign=campaign_id):
+            await self._run_campaign(campaign_id)
+
+    async def _run_campaign(self, campaign_id):
+        counts = campaign_store.counts(campaign_id)
+        total = sum(counts.values())
+        
+        async def on_done(result):
+            await self.send_progress(campaign_store.counts(campaign_id).get('done', 0), total)
+        
+        jobs = campaign_store.pending_jobs(campaign_id)
+        while jobs:
+            if POST_PARALLELISM > 1 and len(jobs) > 1:
+                # Chrome перезапускается только между пачками вкладок
+                await self.maybe_recycle_driver()
+                await self.run_jobs_parallel(jobs[:self.posts_before_recycle(len(jobs))], POST_PARALLELISM, on_done)
+            else:
+                for job in jobs:
+                    await self.maybe_recycle_driver()
+                    await on_done(await self.run_job(job))
+            jobs = campaign_store.pending_jobs(campaign_id)
+        
+        counts = campaign_store.counts(campaign_id)
+        campaign_store.finish_campaign(campaign_id)
+        summary = f"📊 Кампания #{campaign_id}: успешно {counts.get('done', 0)}/{total}"
+        pace = self.pacer.stats()
+        summary += (
+            f"\n⏱ Темп: {pace['achieved_per_hour']:g}/ч при цели {pace['target_per_hour']:g}/ч"
+            f", ограничений: {pace['throttles']}, капч: {pace['captchas']}"
+        )
+        multi_post = campaign_store.post_count(campaign_id) > 1
+        for job in campaign_store.problem_jobs(campaign_id)[:20]:
+            icon = "❓" if job['state'] == 'unknown' else "❌"
+            post = f"пост {job['post_position'] + 1}, " if multi_post else ""
+            summary += f"\n{icon} {post}{job['group_url']}: {(job['last_error'] or '')[:50]}"
+        await self.send_status(summary)
+    
+    async def next_campaign(self, groups):
+        """Создаёт кампанию из команд Telegram; groups - группы прошлой кампании или None"""
+        posts = None
+        if groups is None:
             await self.send_status("⏳ Жду команду #группы...")
-            groups = self.wait_for_groups()
+            groups = await self.wait_for_groups()
+        else:
+            await self.send_status(f"⏳ Жду следующий #пост в те же {len(groups)} групп или новый #группы...")
+            kind, value = await self.wait_for_next_command()
+            if kind == 'groups':
+                groups = value
+            else:
+                posts = value
+        if posts is None:
             await self.send_status("⏳ Жду команду #пост...")
-            video_url, post_text = self.wait_for_post_info()
+            posts = await self.wait_for_post_info()
+        campaign_id = campaign_store.create_campaign(self.email, self.profile_id, posts, groups)
+        if len(posts) > 1:
+            await self.send_status(f"🚀 Начинаю постинг: постов {len(posts)} × групп {len(groups)} = {len(posts) * len(groups)} публикаций...")
+        else:
             await self.send_status(f"🚀 Начинаю постинг в {len(groups)} групп...")
-            for i, g in enumerate(groups, 1):
-                await self.post_to_group(g, video_url, post_text)
-                await self.send_status(f"✅ {i}/{len(groups)} групп обработано")
-            await self.send_status("🎉 Все задачи выполнены!")
+        return campaign_id, groups
+
+    async def start_posting_workflow(self):
+        """Кампания за кампанией в одной сессии: после завершения ждёт новые посты без повторного входа"""
+        groups = None
+        try:
+            while True:
+                campaign_id = campaign_store.active_campaign(self.email)
+                if campaign_id:
+                    counts = campaign_store.counts(campaign_id)
+                    await self.send_status(
+                        f"♻️ Продолжаю кампанию #{campaign_id}: готово {counts.get('done', 0)}/{sum(counts.values())}"
+                    )
+                    groups = campaign_store.campaign_groups(campaign_id)
+                else:
+                    campaign_id, groups = await self.next_campaign(groups)
+                await self.run_campaign(campaign_id)
+                await self.send_status("🎉 Все задачи выполнены!")
+        except asyncio.TimeoutError:
+            await self.send_status("⌛ Команда не получена вовремя, сессия завершается")
+        except HandoffCancelled:
+            logger.info(f"Ожидание команд для {self.person_name} отменено")
         except Exception as e:
             await self.send_status(f"❌ Ошибка: {str(e)[:50]}...")
             
-    def close(self):
+    def release_driver(self):
+        """Сохраняет вход и возвращает драйвер - только в потоке драйвера"""
         if self.driver:
-            try:
-                self.driver.quit()
-                logger.info("Сессия закрыта")
-            except Exception as e:
-                logger.error(f"Ошибка при закрытии драйвера: {e}")
+            if self.authenticated:
+                self.save_session()
+            driver_pool.release(self.driver)
+            self.driver = None
+            logger.info("Сессия закрыта")
 
-# Функция для запуска авторизации в отдельном потоке
-def start_auth_thread(profile_data, profile_id):
-    global current_session, current_profile, bot_running
-    
-    async def auth_process():
-        global current_session, current_profile
-        logger.info(f"🔄 Создаю сессию для {profile_data['person']}")
-        session = OKSession(profile_data['email'], profile_data['password'], profile_data['person'])
-        
-        logger.info(f"🚀 Запускаю процесс авторизации для {profile_data['person']}")
+    async def aclose(self):
+        self.handoff.cancel_all()
+        try:
+            await self.browser.run(self.release_driver)
+        except RuntimeError:
+            return  # Поток драйвера уже остановлен - сессию закрыли раньше
+        self.browser.shutdown()
+
+    def close(self):
+        """Закрытие из любого потока: команды драйвера ставятся в очередь его потока, а не идут параллельно"""
+        self.handoff.cancel_all()
+        try:
+            self.browser.call(self.release_driver)
+        except RuntimeError:
+            return
+        self.browser.shutdown()
+
+# Общий цикл событий всех сессий: корутины сессий чередуются, Selenium работает в потоках AsyncDriver
+class SessionLoop:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="session-loop", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._ready.set()
+        self._loop.run_forever()
+
+    def submit(self, coro):
+        """Запускает корутину в цикле сессий; возвращает concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def stats(self):
+        if not self._loop:
+            return {'running': False, 'tasks': 0}
+        return {'running': self._loop.is_running(), 'tasks': len(asyncio.all_tasks(self._loop))}
+
+session_loop = SessionLoop()
+
+def create_session(profile_data, profile_id):
+    logger.info(f"🔄 Создаю сессию для {profile_data['person']}")
+    session = OKSession(profile_data['email'], profile_data['password'], profile_data['person'], profile_id)
+    # Регистрируем сразу, чтобы SMS-код дошёл до этой сессии ещё во время входа
+    with sessions_lock:
+        sessions[profile_id] = session
+    return session
+
+async def run_session(session):
+    """Авторизация и рабочий процесс профиля; по завершении сессия снимается с учёта и закрывается"""
+    try:
+        logger.info(f"🚀 Запускаю процесс авторизации для {session.person_name}")
         if await session.authenticate():
-            current_session = session
-            current_profile = profile_id
-            logger.info(f"🎯 Сессия активна для {profile_data['person']}. Готов к получению команд!")
+            logger.info(f"🎯 Сессия активна для {session.person_name}. Готов к получению команд!")
             # После успешной авторизации запускаем рабочий процесс
-            logger.info(f"▶️ Запускаю рабочий процесс для {profile_data['person']}")
+            logger.info(f"▶️ Запускаю рабочий процесс для {session.person_name}")
             await session.start_posting_workflow()
         else:
-            logger.error(f"🚫 АВТОРИЗАЦИЯ ПРОВАЛЕНА для {profile_data['person']}")
+            logger.error(f"🚫 АВТОРИЗАЦИЯ ПРОВАЛЕНА для {session.person_name}")
+    finally:
+        with sessions_lock:
+            if sessions.get(session.profile_id) is session:
+                del sessions[session.profile_id]
+        await session.aclose()
+
+# Запуск авторизации и рабочего процесса профиля: в общем цикле сессий, в своём процессе или на узле постинга
+def start_session(profile_data, profile_id):
+    if SESSION_MODE == "process":
+        return workers.start(profile_data, profile_id)
+    if SESSION_MODE == "distributed":
+        return dispatcher.start(profile_data, profile_id)
+    driver_pool.start()
+    return session_loop.submit(run_session(create_session(profile_data, profile_id)))
+
+# --- SESSION_MODE=process: процесс на профиль, связь с процессом Telegram через Pipe ---
+#
+# Процесс профиля -> Telegram: ('status', заголовок, текст), ('progress', ключ, текст, final),
+#   ('waiting', вид, ждёт ли), ('heartbeat', прирост метрик, posting_health())
+# Telegram -> процесс профиля: ('deliver', вид, значение), ('close',)
+
+class WorkerOutbox:
+    """Замена outbox в процессе профиля: статусы уходят в процесс Telegram, а не в API напрямую"""
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def event(self, *message):
+        with self._lock:
+            try:
+                self.conn.send(message)
+            except (OSError, ValueError):
+                pass  # Процесс Telegram уже завершился
+
+    def send(self, text, header=None):
+        self.event('status', header, text)
+
+    def progress(self, key, text, final=False):
+        self.event('progress', key, text, final)
+
+    def flush(self, timeout=5):
+        pass
+
+def worker_commands(conn, session):
+    """Поток процесса профиля: команды из процесса Telegram"""
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            message = ('close',)  # Процесс Telegram пропал - закрываемся
+        if message[0] == 'deliver':
+            session.handoff.deliver(message[1], message[2])
+        elif message[0] == 'close':
             session.close()
+            return
+
+def send_worker_heartbeat():
+    # Метрики и состояние постинга живут в процессе профиля - /metrics и /health их видят только так
+    outbox.event('heartbeat', metrics.delta(), posting_health())
+
+async def worker_heartbeat(interval):
+    while True:
+        send_worker_heartbeat()
+        await asyncio.sleep(interval)
+
+def session_worker_main(profile_data, profile_id, conn, cpu=None):
+    """Точка входа процесса профиля"""
+    global outbox
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    outbox = WorkerOutbox(conn)
+    # Прогретый Chrome из другого процесса не передать - драйвер запускается по требованию
+    driver_pool.size = 0
+    supervisor.start()
+    session = create_session(profile_data, profile_id)
+    session.handoff.on_change = lambda kind, waiting: outbox.event('waiting', kind, waiting)
+    threading.Thread(target=worker_commands, args=(conn, session), name="worker-commands", daemon=True).start()
     
-    # Запускаем асинхронную функцию в новом event loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    async def main():
+        heartbeat = asyncio.create_task(worker_heartbeat(min(WORKER_HEARTBEAT_TIMEOUT / 4, 10)))
+        try:
+            await run_session(session)
+        finally:
+            heartbeat.cancel()
+            send_worker_heartbeat()  # Последний прирост метрик
+    
+    asyncio.run(main())
+    supervisor.shutdown()
+
+class RemoteHandoff:
+    """Зеркало Handoff процесса профиля: кто чего ждёт, и доставка значений по Pipe"""
+    def __init__(self, remote):
+        self.remote = remote
+        self.waiting = set()
+        self._lock = threading.Lock()
+
+    def waiting_for(self, kind):
+        with self._lock:
+            return kind in self.waiting
+
+    def set_waiting(self, kind, waiting):
+        with self._lock:
+            if waiting:
+                self.waiting.add(kind)
+            else:
+                self.waiting.discard(kind)
+
+    def deliver(self, kind, value):
+        with self._lock:
+            if kind not in self.waiting:
+                return False
+            self.waiting.discard(kind)
+        return self.remote.send('deliver', kind, value)
+
+class RemoteSession:
+    """Сессия, работающая в процессе профиля; для обработчиков Telegram выглядит как OKSession"""
+    driver = None
+    driver_posts = 0
+
+    def __init__(self, profile_data, profile_id):
+        self.profile_data = profile_data
+        self.profile_id = profile_id
+        self.person_name = profile_data['person']
+        self.email = profile_data['email']
+        self.handoff = RemoteHandoff(self)
+        self.process = None
+        self.conn = None
+        self.cpu = None
+        self.restarts = 0
+        self.last_seen = time.monotonic()
+        self.stopping = False
+        self.killed = False  # Убит за молчание - ждём, пока sentinel сообщит о выходе
+        self.health = {}  # posting_health() процесса профиля из последнего heartbeat
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def send(self, *message):
+        try:
+            self.conn.send(message)
+            return True
+        except (OSError, ValueError, AttributeError):
+            return False
+
+    def close(self, timeout=10):
+        """Просит процесс завершиться сам (сохранив сессию), иначе убивает"""
+        self.stopping = True
+        process = self.process
+        if not process:
+            return
+        self.send('close')
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning(f"Процесс {self.person_name} не завершился за {timeout} сек, останавливаю")
+            process.terminate()
+            process.join(5)
+        if process.is_alive():
+            process.kill()
+
+class WorkerSupervisor:
+    """Процессы профилей: запуск, пересылка событий в Telegram, перезапуск упавших и зависших"""
+    def __init__(self, max_restarts=3, heartbeat_timeout=120, cpu_affinity=True):
+        self.max_restarts = max_restarts
+        self.heartbeat_timeout = heartbeat_timeout
+        self.cpu_affinity = cpu_affinity and hasattr(os, 'sched_getaffinity')
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = {}  # profile_id -> RemoteSession
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.crashes = 0
+        self.hung = 0
+
+    def start(self, profile_data, profile_id):
+        remote = RemoteSession(profile_data, profile_id)
+        with sessions_lock:
+            sessions[profile_id] = remote
+        with self._lock:
+            self._workers[profile_id] = remote
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="worker-supervisor", daemon=True)
+                self._thread.start()
+        self._spawn(remote)
+        return remote
+
+    def _pick_cpu(self):
+        """Ядро, на котором меньше всего процессов профилей"""
+        cpus = sorted(os.sched_getaffinity(0))
+        with self._lock:
+            load = collections.Counter(w.cpu for w in self._workers.values() if w.process and w.process.is_alive())
+        return min(cpus, key=lambda cpu: load[cpu])
+
+    def _spawn(self, remote):
+        parent_conn, child_conn = self._context.Pipe()
+        remote.cpu = self._pick_cpu() if self.cpu_affinity else None
+        process = self._context.Process(
+            target=session_worker_main,
+            args=(remote.profile_data, remote.profile_id, child_conn, remote.cpu),
+            name=f"okbot-profile-{remote.profile_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        remote.handoff.waiting.clear()
+        remote.process, remote.conn, remote.last_seen = process, parent_conn, time.monotonic()
+        remote.killed = False
+        supervisor.delegated.add(process.pid)
+        cpu = f" на ядре {remote.cpu}" if remote.cpu is not None else ""
+        logger.info(f"🧩 Процесс профиля {remote.person_name} запущен (pid {process.pid}{cpu})")
+
+    def _handle(self, remote, message):
+        remote.last_seen = time.monotonic()
+        kind = message[0]
+        if kind == 'status':
+            outbox.send(message[2], message[1])
+        elif kind == 'progress':
+            outbox.progress(*message[1:])
+        elif kind == 'waiting':
+            # Сессия дошла до ожидания команд - значит, после перезапуска поднялась
+            remote.restarts = 0
+            remote.handoff.set_waiting(message[1], message[2])
+        elif kind == 'heartbeat':
+            metrics.merge(message[1])
+            remote.health = message[2]
+
+    def _exited(self, remote):
+        process = remote.process
+        process.join()
+        supervisor.delegated.discard(process.pid)
+        remote.conn.close()
+        remote.process = None
+        restart = not remote.stopping and process.exitcode != 0 and remote.restarts < self.max_restarts
+        if process.exitcode != 0 and not remote.stopping:
+            self.crashes += 1
+            if not remote.killed:
+                METRIC_WORKER_RESTARTS.inc(reason='crash')
+            if not restart:
+                METRIC_WORKER_RESTARTS.inc(reason='gave_up')
+            logger.error(f"💥 Процесс профиля {remote.person_name} упал (код {process.exitcode})")
+        if restart:
+            remote.restarts += 1
+            outbox.send(f"💥 Процесс сессии упал, перезапуск {remote.restarts}/{self.max_restarts}",
+                        f"👤 {remote.person_name}")
+            self._spawn(remote)
+            return
+        if process.exitcode != 0 and not remote.stopping:
+            outbox.send("🚫 Процесс сессии падает снова и снова, остановлен", f"👤 {remote.person_name}")
+        self._forget(remote)
+
+    def _forget(self, remote):
+        with self._lock:
+            self._workers.pop(remote.profile_id, None)
+        with sessions_lock:
+            if sessions.get(remote.profile_id) is remote:
+                del sessions[remote.profile_id]
+
+    def _check_heartbeats(self, workers):
+        now = time.monotonic()
+        for remote in workers:
+            if remote.process and not remote.killed and now - remote.last_seen > self.heartbeat_timeout:
+                remote.killed = True
+                self.hung += 1
+                METRIC_WORKER_RESTARTS.inc(reason='hung')
+                logger.error(f"⏱ Процесс профиля {remote.person_name} молчит {now - remote.last_seen:.0f} сек, убиваю")
+                remote.process.kill()  # Дальше - как обычное падение
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                workers = [w for w in self._workers.values() if w.process]
+            by_handle = {}
+            for remote in workers:
+                by_handle[remote.conn] = remote
+                by_handle[remote.process.sentinel] = remote
+            if not by_handle:
+                self._stop.wait(1)
+                continue
+            for handle in multiprocessing.connection.wait(list(by_handle), timeout=1):
+                remote = by_handle[handle]
+                if remote.process is None:
+                    continue
+                if handle is remote.conn:
+                    try:
+                        while remote.conn.poll():
+                            self._handle(remote, remote.conn.recv())
+                    except (EOFError, OSError):
+                        pass  # Pipe закрыт - сейчас сработает sentinel
+                else:
+                    self._exited(remote)
+            self._check_heartbeats(workers)
+
+    def stats(self):
+        with self._lock:
+            workers = list(self._workers.values())
+        return {
+            'workers': [
+                {'profile': w.profile_id, 'pid': w.pid, 'cpu': w.cpu, 'restarts': w.restarts,
+                 'silent_for': round(time.monotonic() - w.last_seen, 1),
+                 'pages': w.health.get('pages'), 'selectors': w.health.get('selectors')}
+                for w in workers
+            ],
+            'crashes': self.crashes,
+            'hung': self.hung,
+        }
+
+    def posting_health(self):
+        with self._lock:
+            return [w.health for w in self._workers.values()]
+
+    def shutdown(self):
+        with self._lock:
+            workers = list(self._workers.values())
+        # Закрываем параллельно: каждый процесс сохраняет свою сессию
+        threads = [threading.Thread(target=remote.close) for remote in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+        for remote in workers:
+            supervisor.delegated.discard(remote.pid)
+            self._forget(remote)
+
+workers = WorkerSupervisor(WORKER_MAX_RESTARTS, WORKER_HEARTBEAT_TIMEOUT, WORKER_CPU_AFFINITY)
+
+# --- SESSION_MODE=distributed: диспетчер с Telegram и узлы постинга с OKSession, связь по HTTP ---
+#
+# Узел -> диспетчер (POST /nodes/<action>, заголовок X-Node-Token):
+#   register {capacity, boot_id}, heartbeat {metrics, health} - прирост метрик и posting_health(),
+#   lease {ack, wait} - long-poll команд,
+#   event {events: [{type: status|progress|waiting|ended, ...}]}, store {method, args, kwargs} - вызов CampaignStore
+# Диспетчер -> узел (ответ lease): [[seq, {type: start|deliver|close, profile_id, args}], ...];
+#   команды отдаются повторно, пока узел не подтвердит их номером ack
+# Пароли по сети не ходят: по команде start узел ищет профиль с этим email в своих OK_PERSON_i/OK_EMAIL_i/OK_PASSWORD_i
+
+# Методы CampaignStore, которые узлы вызывают через /nodes/store
+NODE_STORE_METHODS = (
+    'create_campaign', 'active_campaign', 'pending_jobs', 'start_job', 'mark_submitting', 'finish_job',
+    'mark_unknown', 'fail_job', 'defer_job', 'counts', 'problem_jobs', 'post_count', 'campaign_groups',
+    'finish_campaign', 'group_list', 'group_lists',
+)
+
+class WorkerNode:
+    """Узел постинга глазами диспетчера"""
+    def __init__(self, node_id, capacity, boot_id):
+        self.node_id = node_id
+        self.capacity = max(1, capacity)
+        self.boot_id = boot_id
+        self.last_seen = time.monotonic()
+        self.commands = []  # (seq, команда), ещё не подтверждённые узлом
+        self.profiles = set()
+        self.health = {}  # posting_health() узла из последнего heartbeat
+
+class NodeSession(RemoteSession):
+    """Сессия профиля на узле постинга; команды уходят в очередь узла у диспетчера"""
+    def __init__(self, profile_data, profile_id, dispatcher):
+        super().__init__(profile_data, profile_id)
+        self.dispatcher = dispatcher
+        self.node_id = None  # None - ждёт свободный узел
+
+    def send(self, *message):
+        return self.dispatcher.command(self, *message)
+
+    def close(self, timeout=10):
+        """Узел закроет сессию (сохранив куки), когда заберёт команду"""
+        self.stopping = True
+        self.dispatcher.stop(self)
+
+class Dispatcher:
+    """Узлы постинга: регистрация, очереди команд, привязка аккаунтов к узлам и переезд с потерянных узлов"""
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._nodes = {}  # node_id -> WorkerNode
+        self._sessions = {}  # profile_id -> NodeSession
+        self._cond = threading.Condition()
+        self._seq = itertools.count(1)
+        self._thread = None
+        self._stop = threading.Event()
+        self.lost = 0
+        self.moved = 0
+
+    def start(self, profile_data, profile_id):
+        remote = NodeSession(profile_data, profile_id, self)
+        with sessions_lock:
+            sessions[profile_id] = remote
+        with self._cond:
+            self._sessions[profile_id] = remote
+            if not self._place(remote):
+                outbox.send("⏳ Нет свободных узлов постинга, сессия запустится, когда узел появится",
+                            f"👤 {remote.person_name}")
+        return remote
+
+    def _enqueue(self, node, command):
+        node.commands.append((next(self._seq), command))
+        self._cond.notify_all()
+
+    def _place(self, remote):
+        """Под self._cond: прежний узел аккаунта, если он жив и не заполнен, иначе наименее загруженный"""
+        node = self._nodes.get(campaign_store.account_node(remote.email))
+        if node is None or len(node.profiles) >= node.capacity:
+            free = [n for n in self._nodes.values() if len(n.profiles) < n.capacity]
+            node = min(free, key=lambda n: len(n.profiles) / n.capacity, default=None)
+        if node is None:
+            return False
+        remote.node_id = node.node_id
+        remote.handoff.waiting.clear()
+        node.profiles.add(remote.profile_id)
+        campaign_store.set_account_node(remote.email, node.node_id)
+        self._enqueue(node, {'type': 'start', 'profile_id': remote.profile_id, 'args': [remote.email]})
+        logger.info(f"📍 Профиль {remote.person_name} -> узел {node.node_id}")
+        return True
+
+    def _place_waiting(self):
+        for remote in self._sessions.values():
+            if remote.node_id is None and not self._place(remote):
+                break
+
+    def command(self, remote, action, *args):
+        with self._cond:
+            node = self._nodes.get(remote.node_id)
+            if node is None or self._sessions.get(remote.profile_id) is not remote:
+                return False
+            self._enqueue(node, {'type': action, 'profile_id': remote.profile_id, 'args': list(args)})
+        return True
+
+    def stop(self, remote):
+        with self._cond:
+            if self._sessions.get(remote.profile_id) is remote:
+                self.command(remote, 'close')
+                del self._sessions[remote.profile_id]
+                node = self._nodes.get(remote.node_id)
+                if node:
+                    node.profiles.discard(remote.profile_id)
+                self._place_waiting()
+        with sessions_lock:
+            if sessions.get(remote.profile_id) is remote:
+                del sessions[remote.profile_id]
+
+    def register(self, node_id, capacity, boot_id):
+        with self._cond:
+            node = self._nodes.get(node_id)
+            if node and node.boot_id == boot_id:
+                node.last_seen = time.monotonic()
+                return
+            if node:
+                # Узел перезапустился - его прежних сессий больше нет, поднимаем их заново
+                self._lose(node, "перезапущен")
+            self._nodes[node_id] = WorkerNode(node_id, capacity, boot_id)
+            self._place_waiting()
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="node-dispatcher", daemon=True)
+                self._thread.start()
+        logger.info(f"🛰 Узел {node_id} подключён (профилей до {capacity})")
+
+    def heartbeat(self, node_id, metric_delta=None, health=None):
+        with self._cond:
+            node = self._nodes.get(node_id)
+            if node:
+                node.last_seen = time.monotonic()
+                if health is not None:
+                    node.health = health
+        if node and metric_delta:
+            metrics.merge(metric_delta)
+        return node is not None
+
+    def posting_health(self):
+        with self._cond:
+            return [n.health for n in self._nodes.values()]
+
+    def lease(self, node_id, ack, wait):
+        """Команды узлу; ждёт до wait секунд, если новых нет. None - узел неизвестен"""
+        deadline = time.monotonic() + min(wait, self.timeout / 2)
+        with self._cond:
+            node = self._nodes.get(node_id)
+            if node is None:
+                return None
+            node.last_seen = time.monotonic()
+            if node.commands and node.commands[0][0] <= ack:
+                node.commands = [entry for entry in node.commands if entry[0] > ack]
+                self._cond.notify_all()
+            while not node.commands and self._nodes.get(node_id) is node and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._nodes.get(node_id) is not node:
+                return None
+            node.last_seen = time.monotonic()
+            return list(node.commands)
+
+    def event(self, node_id, events):
+        with self._cond:
+            node = self._nodes.get(node_id)
+            if node is None:
+                return False
+            node.last_seen = time.monotonic()
+            for event in events:
+                kind = event.get('type')
+                remote = self._sessions.get(event.get('profile_id'))
+                owned = remote is not None and remote.node_id == node_id
+                if kind == 'status':
+                    outbox.send(event['text'], event.get('header'))
+                elif kind == 'progress':
+                    outbox.progress(event['key'], event['text'], event.get('final', False))
+                elif kind == 'waiting' and owned:
+                    remote.handoff.set_waiting(event['kind'], event['waiting'])
+                elif kind == 'ended' and owned:
+                    del self._sessions[remote.profile_id]
+                    node.profiles.discard(remote.profile_id)
+                    with sessions_lock:
+                        if sessions.get(remote.profile_id) is remote:
+                            del sessions[remote.profile_id]
+                    self._place_waiting()
+        return True
+
+    def known(self, node_id):
+        with self._cond:
+            return node_id in self._nodes
+
+    def _lose(self, node, reason):
+        """Под self._cond: узел снят с учёта, его профили ждут нового места"""
+        del self._nodes[node.node_id]
+        self.lost += 1
+        METRIC_NODE_EVENTS.inc(event='lost')
+        logger.error(f"🛰 Узел {node.node_id} потерян: {reason}")
+        for profile_id in node.profiles:
+            remote = self._sessions.get(profile_id)
+            if remote is None:
+                continue
+            remote.node_id = None
+            remote.handoff.waiting.clear()
+            unknown = campaign_store.release_account(remote.email)
+            self.moved += 1
+            METRIC_NODE_EVENTS.inc(event='moved')
+            note = f", {unknown} постов могли уйти - помечены как unknown" if unknown else ""
+            outbox.send(f"🔀 Узел {node.node_id} потерян ({reason}), сессия будет запущена заново{note}",
+                        f"👤 {remote.person_name}")
+        self._cond.notify_all()  # Будим long-poll потерянного узла
+
+    def _run(self):
+        while not self._stop.wait(1):
+            with self._cond:
+                now = time.monotonic()
+                dead = [n for n in self._nodes.values() if now - n.last_seen > self.timeout]
+                for node in dead:
+                    self._lose(node, f"нет связи {now - node.last_seen:.0f} сек")
+                if dead:
+                    self._place_waiting()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                'nodes': [
+                    {'node': n.node_id, 'capacity': n.capacity, 'profiles': sorted(n.profiles),
+                     'queued': len(n.commands), 'silent_for': round(now - n.last_seen, 1),
+                     'pages': n.health.get('pages'), 'selectors': n.health.get('selectors')}
+                    for n in self._nodes.values()
+                ],
+                'waiting_for_node': sorted(p for p, r in self._sessions.items() if r.node_id is None),
+                'lost': self.lost,
+                'moved': self.moved,
+            }
+
+    def shutdown(self, timeout=5):
+        """Закрывает сессии и ждёт, пока узлы заберут команды close"""
+        with self._cond:
+            running = list(self._sessions.values())
+        for remote in running:
+            remote.close()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while any(n.commands for n in self._nodes.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._stop.set()
+            self._cond.notify_all()
+
+dispatcher = Dispatcher(NODE_TIMEOUT)
+
+def node_api(action, payload, token):
+    """Обработчик /nodes/<action> для Flask и ASGI; возвращает (HTTP-код, тело ответа)"""
+    if SESSION_MODE != "distributed":
+        return 404, {'error': 'distributed mode is off'}
+    if not hmac.compare_digest((token or "").encode(), NODE_TOKEN.encode()):
+        return 403, {'error': 'forbidden'}
+    if not isinstance(payload, dict):
+        return 400, {'error': 'JSON object expected'}
+    node_id = payload.get('node_id')
+    if not node_id or not isinstance(node_id, str):
+        return 400, {'error': 'node_id is required'}
+    try:
+        if action == 'register':
+            capacity = int(payload.get('capacity', 1))
+        elif action == 'lease':
+            ack, wait = int(payload.get('ack', 0)), float(payload.get('wait', 0))
+            if not math.isfinite(wait):
+                raise ValueError(f"wait={wait}")
+    except (TypeError, ValueError) as e:
+        return 400, {'error': f'bad payload: {e}'}
+    body = {}
+    if action == 'register':
+        dispatcher.register(node_id, capacity, payload.get('boot_id'))
+        return 200, {'timeout': dispatcher.timeout}
+    elif action == 'heartbeat':
+        metric_delta, health = payload.get('metrics') or {}, payload.get('health')
+        if not isinstance(metric_delta, dict) or not isinstance(health, (dict, type(None))):
+            return 400, {'error': 'metrics and health must be objects'}
+        try:
+            known = dispatcher.heartbeat(node_id, metric_delta, health)
+        except (TypeError, ValueError) as e:
+            return 400, {'error': f'bad metrics: {e}'}
+    elif action == 'lease':
+        commands = dispatcher.lease(node_id, ack, wait)
+        known, body = commands is not None, {'commands': commands}
+    elif action == 'event':
+        events = payload.get('events', [])
+        if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+            return 400, {'error': 'events must be a list of objects'}
+        known = dispatcher.event(node_id, events)
+    elif action == 'store':
+        method = payload.get('method')
+        if method not in NODE_STORE_METHODS:
+            return 400, {'error': f'unknown store method {method}'}
+        if not isinstance(payload.get('args', []), list) or not isinstance(payload.get('kwargs', {}), dict):
+            return 400, {'error': 'args must be a list and kwargs an object'}
+        known = dispatcher.known(node_id)
+        if known:
+            try:
+                body = {'result': getattr(campaign_store, method)(*payload.get('args', []), **payload.get('kwargs', {}))}
+            except Exception as e:
+                logger.error(f"Ошибка {method} для узла {node_id}: {e}")
+                return 500, {'error': str(e)}
+    else:
+        return 404, {'error': f'unknown action {action}'}
+    return (200, body) if known else (410, {'error': 'unknown node'})
+
+# --- Узел постинга (задан DISPATCHER_URL): без Telegram, сессии по командам диспетчера ---
+
+class NodeLost(Exception):
+    """Диспетчер не знает узел (счёл потерянным или сам перезапустился) - сессии узла надо закрыть"""
+
+class NodeClient:
+    """HTTP-клиент узла к диспетчеру"""
+    def __init__(self, url, node_id, token, timeout=30):
+        import requests
+        self.requests = requests
+        self.url = url
+        self.node_id = node_id
+        self.timeout = timeout
+        self.boot_id = f"{os.getpid()}-{time.time():.0f}"
+        self.http = requests.Session()
+        self.http.headers['X-Node-Token'] = token
+        self.last_contact = time.monotonic()
+
+    def call(self, action, timeout=None, **payload):
+        response = self.http.post(
+            f"{self.url}/nodes/{action}", json={'node_id': self.node_id, **payload}, timeout=timeout or self.timeout
+        )
+        if response.status_code == 410:
+            raise NodeLost(f"диспетчер не знает узел {self.node_id}")
+        response.raise_for_status()
+        self.last_contact = time.monotonic()
+        return response.json()
+
+class RemoteCampaignStore:
+    """Замена campaign_store на узле: кампании живут в базе диспетчера"""
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, method):
+        if method not in NODE_STORE_METHODS:
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            return self.client.call('store', method=method, args=list(args), kwargs=kwargs)['result']
+        return call
+
+class NodeOutbox:
+    """Замена outbox на узле: события копятся и пачками уходят диспетчеру, порядок сохраняется"""
+    def __init__(self, client, batch_window=0.2):
+        self.client = client
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        self._events = []
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        threading.Thread(target=self._run, name="node-outbox", daemon=True).start()
+
+    def event(self, event_type, **fields):
+        with self._lock:
+            self._events.append(dict(fields, type=event_type))
+            self._idle.clear()
+        self._wakeup.set()
+
+    def send(self, text, header=None):
+        self.event('status', header=header, text=text)
+
+    def progress(self, key, text, final=False):
+        self.event('progress', key=key, text=text, final=final)
+
+    def flush(self, timeout=5):
+        return self._idle.wait(timeout)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(self.batch_window)
+            with self._lock:
+                events, self._events = self._events, []
+            while events:
+                try:
+                    self.client.call('event', events=events)
+                    break
+                except NodeLost:
+                    break  # Сессии узла уже переехали - их события не нужны
+                except self.client.requests.RequestException as e:
+                    if time.monotonic() - self.client.last_contact > self.client.timeout:
+                        # Диспетчер уже счёл узел потерянным - события его сессий ему не нужны
+                        logger.warning(f"Диспетчер недоступен ({e}), {len(events)} событий отброшено")
+                        break
+                    logger.warning(f"Не удалось передать события диспетчеру ({e}), повтор через 1 сек")
+                    time.sleep(1)
+            with self._lock:
+                if not self._events:
+                    self._idle.set()
+
+class PostingNode:
+    """Сессии профилей узла: запуск, доставка команд, закрытие при потере связи с диспетчером"""
+    def __init__(self, client, capacity):
+        self.client = client
+        self.capacity = capacity
+        self.local = {}  # profile_id -> OKSession
+        self._lock = threading.Lock()
+        self.ack = 0
+        self.unsent_metrics = {}
+        self._heartbeat_lock = threading.Lock()
+
+    def register(self):
+        while True:
+            try:
+                self.client.call('register', capacity=self.capacity, boot_id=self.client.boot_id)
+                logger.info(f"🛰 Узел {self.client.node_id} подключён к диспетчеру {self.client.url}")
+                return
+            except self.client.requests.RequestException as e:
+                logger.warning(f"Диспетчер {self.client.url} недоступен ({e}), повтор через 2 сек")
+                time.sleep(2)
+
+    def handle(self, command):
+        profile_id, action, args = command['profile_id'], command['type'], command.get('args', [])
+        if action == 'start':
+            return self.start(profile_id, *args)
+        with self._lock:
+            session = self.local.get(profile_id)
+        if session is None:
+            return
+        if action == 'deliver':
+            session.handoff.deliver(*args)
+        elif action == 'close':
+            threading.Thread(target=session.close, name=f"close-{profile_id}", daemon=True).start()
+
+    def start(self, profile_id, email):
+        with self._lock:
+            if profile_id in self.local:
+                return  # Повтор уже выполненной команды
+        profile_data = next((p for p in get_profiles().values() if p['email'] == email), None)
+        if profile_data is None:
+            outbox.send(f"🚫 На узле {self.client.node_id} нет учётных данных {email}")
+            outbox.event('ended', profile_id=profile_id)
+            return
+        session = create_session(profile_data, profile_id)
+        session.handoff.on_change = (
+            lambda kind, waiting: outbox.event('waiting', profile_id=profile_id, kind=kind, waiting=waiting)
+        )
+        with self._lock:
+            self.local[profile_id] = session
+        future = session_loop.submit(run_session(session))
+        future.add_done_callback(lambda _: self._ended(profile_id, session))
+
+    def _ended(self, profile_id, session):
+        with self._lock:
+            if self.local.get(profile_id) is session:
+                del self.local[profile_id]
+        outbox.event('ended', profile_id=profile_id)
+
+    def close_all(self, reason):
+        with self._lock:
+            running = list(self.local.values())
+        if not running:
+            return
+        logger.warning(f"🛑 Закрываю {len(running)} сессий узла: {reason}")
+        threads = [threading.Thread(target=session.close) for session in running]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def send_heartbeat(self, timeout):
+        # Метрики постинга живут на узле: прирост уходит диспетчеру, а не переданный копится до следующего раза
+        with self._heartbeat_lock:
+            self.unsent_metrics = combine_metric_deltas(self.unsent_metrics, metrics.delta())
+            try:
+                self.client.call('heartbeat', timeout=timeout, metrics=self.unsent_metrics, health=posting_health())
+            except self.client.requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 400:
+                    raise
+                # Диспетчер на связи (heartbeat учтён), но прирост не принял - копить его дальше бессмысленно
+                logger.warning(f"Диспетчер отклонил метрики узла: {e.response.text[:200]}")
+                self.client.last_contact = time.monotonic()
+            self.unsent_metrics = {}
+
+    def _heartbeat(self):
+        # Узел сдаётся раньше, чем диспетчер сочтёт его потерянным: одна сессия не постит с двух узлов
+        interval = self.client.timeout / 6
+        while True:
+            time.sleep(interval)
+            try:
+                self.send_heartbeat(interval * 2)
+            except NodeLost as e:
+                self.close_all(str(e))
+            except self.client.requests.RequestException as e:
+                silent = time.monotonic() - self.client.last_contact
+                if silent > self.client.timeout * 2 / 3:
+                    self.close_all(f"нет связи с диспетчером {silent:.0f} сек ({e})")
+
+    def run(self):
+        self.register()
+        threading.Thread(target=self._heartbeat, name="node-heartbeat", daemon=True).start()
+        wait = self.client.timeout / 3
+        while True:
+            try:
+                reply = self.client.call('lease', timeout=wait + 10, ack=self.ack, wait=wait)
+            except NodeLost as e:
+                self.close_all(str(e))
+                self.register()
+                continue
+            except self.client.requests.RequestException as e:
+                logger.warning(f"Не удалось получить команды диспетчера: {e}")
+                time.sleep(1)
+                continue
+            for seq, command in reply['commands']:
+                if seq > self.ack:
+                    self.handle(command)
+                    self.ack = seq
+
+def run_node():
+    """Точка входа узла постинга"""
+    global outbox, campaign_store
+    client = NodeClient(DISPATCHER_URL, NODE_ID, NODE_TOKEN, NODE_TIMEOUT)
+    outbox = NodeOutbox(client)
+    campaign_store = RemoteCampaignStore(client)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    supervisor.start()
+    driver_pool.start()
+    node = PostingNode(client, NODE_CAPACITY)
     try:
-        loop.run_until_complete(auth_process())
+        node.run()
     finally:
-        loop.close()
+        node.close_all("узел остановлен")
+        try:
+            node.send_heartbeat(5)  # Последний прирост метрик
+        except (NodeLost, client.requests.RequestException):
+            pass
+        driver_pool.shutdown()
+        supervisor.shutdown()
+        outbox.flush()
+
+def find_session(ref):
+    """Ищет сессию по номеру профиля или имени"""
+    with sessions_lock:
+        if ref.isdigit() and int(ref) in sessions:
+            return sessions[int(ref)]
+        for session in sessions.values():
+            if session.person_name.lower() == ref.lower():
+                return session
+    return None
+
+def route_session(kind, target=None):
+    """Выбирает сессию для команды: явно указанную, единственную ожидающую или активную"""
+    if target is not None:
+        return target if target.handoff.waiting_for(kind) else None, []
+    with sessions_lock:
+        waiting = [s for s in sessions.values() if s.handoff.waiting_for(kind)]
+    if len(waiting) == 1:
+        return waiting[0], waiting
+    for session in waiting:
+        if session.profile_id == active_profile:
+            return session, waiting
+    return None, waiting
+
+def ambiguous_reply(candidates):
+    names = ", ".join(f"@{s.profile_id} ({s.person_name})" for s in candidates)
+    return f"❓ Команду ждут несколько профилей: {names}\nДобавьте @номер перед командой"
+
+def parse_posts(text):
+    """Посты из сообщения: каждый '#пост <ссылка> <текст>' с новой строки - отдельный пост.
+    
+    Возвращает [(ссылка, текст)] или None, если в каком-то блоке нет ссылки.
+    """
+    posts = []
+    for block in re.split(r"(?:^|\n)\s*#пост\b", text, flags=re.IGNORECASE)[1:]:
+        url_match = re.search(r"https?://\S+", block)
+        if not url_match:
+            return None
+        video_url = url_match.group(0)
+        posts.append((video_url, block.replace(video_url, "").strip()))
+    return posts
+
+# Слева не должно быть части другого домена или пути: notok.ru/group/5 и book.ru/group/5 - не группы OK.ru
+GROUP_URL_RE = re.compile(r"(?<![\w./-])(?:https?://)?(?:www\.|m\.)?ok\.ru/group/(\d+)\b", re.IGNORECASE)
+
+def extract_group_urls(lines):
+    """Ссылки на группы из строк текста или CSV - в порядке появления, без повторов.
+    
+    Ссылки приводятся к виду https://ok.ru/group/<id>. Возвращает (группы, число дублей).
+    """
+    groups, seen, duplicates = [], set(), 0
+    for line in lines:
+        for group_id in GROUP_URL_RE.findall(line):
+            group_id = int(group_id)
+            if group_id in seen:
+                duplicates += 1
+                continue
+            seen.add(group_id)
+            groups.append(f"https://ok.ru/group/{group_id}")
+    return groups, duplicates
+
+def read_group_file(path):
+    """Читает файл построчно, не загружая целиком в память"""
+    with open(path, encoding='utf-8-sig', errors='replace') as f:
+        return extract_group_urls(f)
+
+async def resolve_target(update, text):
+    """Явный выбор профиля: "@2 #пост ..." или "@Имя 123456" -> (сессия или None, остаток текста)"""
+    target_match = re.match(r"^@(\S+)(?:\s+(.*))?$", text, re.DOTALL)
+    if not target_match:
+        return None, text
+    target = find_session(target_match.group(1))
+    if target is None:
+        await update.message.reply_text(f"❌ Нет активной сессии {target_match.group(1)}")
+        return None, None
+    return target, (target_match.group(2) or "").strip()
+
+async def deliver_groups(update, target, groups, saved_as=None):
+    """Передаёт группы ожидающей сессии; сохранённый список без сессии - не ошибка"""
+    session, candidates = route_session('groups', target)
+    if session and session.handoff.deliver('groups', groups):
+        await update.message.reply_text(f"✅ Получен список из {len(groups)} групп для {session.person_name}!")
+    elif len(candidates) > 1:
+        await update.message.reply_text(ambiguous_reply(candidates))
+    elif not saved_as:
+        await update.message.reply_text("❌ Сначала нужно авторизоваться!")
+
+def free_group_list_name(name):
+    """name, а если такой список уже есть - name_2, name_3, ..."""
+    candidate, suffix = name, 1
+    while campaign_store.group_list(candidate) is not None:
+        suffix += 1
+        candidate = f"{name}_{suffix}"
+    return candidate
+
+def replaced_note(name, previous):
+    return f"\n⚠️ Прежний список «{name.lower()}» ({len(previous)} групп) заменён" if previous is not None else ""
+
+def group_lists_reply():
+    lists = campaign_store.group_lists()
+    if not lists:
+        return "📂 Сохранённых списков групп нет. Пришлите файл со ссылками или #группы имя ссылки..."
+    return "📂 Списки групп:\n" + "\n".join(f"• {name}: {count}" for name, count in lists)
 
 # Обработчик текстовых сообщений
 async def handle_message(update, context):
-    global waiting_for_sms, waiting_for_groups, waiting_for_post
-    global sms_code_received, groups_received, post_info_received
-    
     # Проверяем, что сообщение от нужного пользователя
     if str(update.message.chat.id) != TELEGRAM_USER_ID:
         return
     
-    text = update.message.text.strip()
+    target, text = await resolve_target(update, update.message.text.strip())
+    if text is None:
+        return
     
     # Обработка SMS-кода
-    if waiting_for_sms:
-        sms_match = re.match(r"^(?:#код\s*)?(\d{4,6})$", text, re.IGNORECASE)
-        if sms_match:
-            sms_code_received = sms_match.group(1)
-            await update.message.reply_text("✅ SMS-код получен!")
+    sms_match = re.match(r"^(?:#код\s*)?(\d{4,6})$", text, re.IGNORECASE)
+    if sms_match:
+        session, candidates = route_session('sms', target)
+        if session and session.handoff.deliver('sms', sms_match.group(1)):
+            await update.message.reply_text(f"✅ SMS-код получен для {session.person_name}!")
             return
+        if len(candidates) > 1:
+            await update.message.reply_text(ambiguous_reply(candidates))
+            return
+    
+    if text.lower().startswith("#списки"):
+        await update.message.reply_text(await asyncio.to_thread(group_lists_reply))
+        return
     
-    # Обработка команды #группы
+    # Обработка команды #группы: "#группы ссылки...", "#группы имя" (сохранённый список)
+    # или "#группы имя ссылки..." (сохранить под именем и использовать)
     if text.lower().startswith("#группы"):
-        groups_match = re.match(r"#группы\s+(.+)", text, re.IGNORECASE)
+        groups_match = re.match(r"#группы\s+(.+)", text, re.IGNORECASE | re.DOTALL)
         if groups_match:
-            urls = re.findall(r"https?://ok\.ru/group/\d+/?", groups_match.group(1))
+            rest = groups_match.group(1).strip()
+            first = rest.split()[0]
+            name = None if GROUP_URL_RE.search(first) or "://" in first else first
+            urls, duplicates = extract_group_urls(rest.splitlines())
             if urls:
-                if waiting_for_groups:
-                    groups_received = urls
-                    await update.message.reply_text(f"✅ Получен список из {len(urls)} групп!")
+                if name:
+                    previous = await asyncio.to_thread(campaign_store.group_list, name)
+                    await asyncio.to_thread(campaign_store.save_group_list, name, urls)
+                    note = f", повторов убрано: {duplicates}" if duplicates else ""
+                    await update.message.reply_text(
+                        f"💾 Список «{name.lower()}» сохранён: {len(urls)} групп{note}{replaced_note(name, previous)}"
+                    )
+                await deliver_groups(update, target, urls, saved_as=name)
+            elif name:
+                urls = await asyncio.to_thread(campaign_store.group_list, name)
+                if urls:
+                    await deliver_groups(update, target, urls)
                 else:
-                    await update.message.reply_text("❌ Сначала нужно авторизоваться!")
+                    lists = await asyncio.to_thread(group_lists_reply)
+                    await update.message.reply_text(f"❌ Список «{name.lower()}» не найден\n\n{lists}")
             else:
                 await update.message.reply_text("❌ Не найдены корректные ссылки на группы!")
         return
     
-    # Обработка команды #пост
+    # Обработка команды #пост (несколько #пост в одном сообщении - одна кампания)
     if text.lower().startswith("#пост"):
-        post_match = re.match(r"#пост\s+(.+)", text, re.IGNORECASE)
-        if post_match:
-            rest = post_match.group(1).strip()
-            url_match = re.search(r"https?://\S+", rest)
-            if url_match:
-                video_url = url_match.group(0)
-                post_text = rest.replace(video_url, "").strip()
-                if waiting_for_post:
-                    post_info_received = (video_url, post_text)
-                    await update.message.reply_text("✅ Информация для поста получена!")
+        if re.match(r"#пост\s+\S", text, re.IGNORECASE):
+            posts = parse_posts(text)
+            if posts:
+                session, candidates = route_session('post', target)
+                if session and session.handoff.deliver('post', posts):
+                    if len(posts) > 1:
+                        await update.message.reply_text(f"✅ Получено {len(posts)} постов для {session.person_name}!")
+                    else:
+                        await update.message.reply_text(f"✅ Информация для поста получена для {session.person_name}!")
+                elif len(candidates) > 1:
+                    await update.message.reply_text(ambiguous_reply(candidates))
                 else:
                     await update.message.reply_text("❌ Сначала нужно авторизоваться и отправить группы!")
             else:
                 await update.message.reply_text("❌ Не найдена ссылка на видео!")
         return
 
+# Файл со ссылками на группы (txt/csv): подпись "имя" или "#группы имя", по умолчанию - имя файла
+async def handle_document(update, context):
+    if str(update.message.chat.id) != TELEGRAM_USER_ID:
+        return
+    
+    document = update.message.document
+    target, caption = await resolve_target(update, (update.message.caption or "").strip())
+    if caption is None:
+        return
+    caption = re.sub(r"^#группы\b", "", caption, flags=re.IGNORECASE).strip()
+    name = caption.split()[0] if caption else re.sub(r"\s+", "_", os.path.splitext(document.file_name or "")[0])
+    if document.file_size and document.file_size > GROUP_FILE_MAX_MB * 1024 * 1024:
+        await update.message.reply_text(f"❌ Файл больше {GROUP_FILE_MAX_MB:g} МБ")
+        return
+    
+    tg_file = await document.get_file()
+    with tempfile.TemporaryDirectory(prefix="okbot-groups-") as tmp:
+        path = await tg_file.download_to_drive(os.path.join(tmp, "groups.txt"))
+        urls, duplicates = await asyncio.to_thread(read_group_file, path)
+    if not urls:
+        await update.message.reply_text("❌ В файле не найдены ссылки вида https://ok.ru/group/<id>")
+        return
+    
+    note = f", повторов убрано: {duplicates}" if duplicates else ""
+    if name and not caption:
+        # Имя взято из файла - существующий список с таким именем не затираем молча
+        saved_as = await asyncio.to_thread(free_group_list_name, name)
+        await asyncio.to_thread(campaign_store.save_group_list, saved_as, urls)
+        if saved_as != name:
+            await update.message.reply_text(
+                f"💾 Список «{name.lower()}» уже есть, этот сохранён как «{saved_as.lower()}»: {len(urls)} групп{note}\n"
+                f"Чтобы заменить «{name.lower()}», пришлите файл с подписью {name.lower()}"
+            )
+        else:
+            await update.message.reply_text(f"💾 Список «{name.lower()}» сохранён: {len(urls)} групп{note}")
+        name = saved_as
+    elif name:
+        previous = await asyncio.to_thread(campaign_store.group_list, name)
+        await asyncio.to_thread(campaign_store.save_group_list, name, urls)
+        await update.message.reply_text(
+            f"💾 Список «{name.lower()}» сохранён: {len(urls)} групп{note}{replaced_note(name, previous)}"
+        )
+    else:
+        await update.message.reply_text(f"📄 В файле {len(urls)} групп{note}")
+    await deliver_groups(update, target, urls, saved_as=name)
+
 # Telegram бот функции
 async def cmd_start(update, context):
+    # Прогреваем Chrome заранее, пока пользователь выбирает профиль (процессы профилей и узлы запускают свой)
+    if SESSION_MODE == "loop":
+        driver_pool.start()
     inline_keyboard = [
         [InlineKeyboardButton("🌿 Розгалуджувати", callback_data='branch')]
     ]
@@ -502,8 +4204,11 @@ async def show_profiles(update, context):
         return
     
     inline_keyboard = []
+    with sessions_lock:
+        running = set(sessions)
     for profile_id, profile_data in profiles.items():
-        button_text = f"👤 {profile_data['person']}"
+        status_icon = "🟢" if profile_id in running else "👤"
+        button_text = f"{status_icon} {profile_data['person']}"
         callback_data = f"profile_{profile_id}"
         inline_keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
     
@@ -517,12 +4222,20 @@ async def show_profiles(update, context):
         reply_markup=reply_markup
     )
 
-async def show_control_panel(update, context, profile_name):
+async def show_control_panel(update, context, profile_name, profile_id=None, already_running=False):
     """Показывает панель управления после выбора профиля"""
     message = f"✅ Обрано профіль: {profile_name}\n"
-    message += "🔄 Виконується авторизація...\n\n"
+    if already_running:
+        message += "🟢 Сесія вже працює\n\n"
+    else:
+        message += "🔄 Виконується авторизація...\n\n"
     message += "📱 Якщо потрібен SMS-код, надішліть його:\n"
     message += "#код 123456\n\n"
+    with sessions_lock:
+        running_count = len(sessions)
+    if profile_id is not None and running_count > 1:
+        message += f"👥 Активних сесій: {running_count}. Щоб адресувати команду цьому профілю:\n"
+        message += f"@{profile_id} #код 123456\n\n"
     message += "Або використовуйте кнопки нижче:"
     
     inline_keyboard = [
@@ -537,7 +4250,7 @@ async def show_control_panel(update, context, profile_name):
     await update.callback_query.edit_message_text(message, reply_markup=reply_markup)
 
 async def button_callback(update, context):
-    global bot_running, current_session, current_profile
+    global bot_running, active_profile
     query = update.callback_query
     await query.answer()
     
@@ -550,16 +4263,16 @@ async def button_callback(update, context):
         
         if profile_id in profiles:
             selected_profile = profiles[profile_id]
+            active_profile = profile_id
             
-            await show_control_panel(update, context, selected_profile['person'])
+            with sessions_lock:
+                already_running = profile_id in sessions
+            await show_control_panel(update, context, selected_profile['person'], profile_id, already_running)
+            if already_running:
+                return
             
-            # Запускаем авторизацию в отдельном потоке
-            auth_thread = threading.Thread(
-                target=start_auth_thread, 
-                args=(selected_profile, profile_id)
-            )
-            auth_thread.daemon = True
-            auth_thread.start()
+            # Авторизация идёт в общем цикле сессий, бот сразу отвечает на другие команды
+            start_session(selected_profile, profile_id)
             
             logger.info(f"Запущена авторизация для профиля: {selected_profile['person']}")
         else:
@@ -574,7 +4287,9 @@ async def button_callback(update, context):
         await query.edit_message_text(
             "📋 Скопіюйте та відправте:\n\n"
             "`#группы https://ok.ru/group/123456789 https://ok.ru/group/987654321`\n\n"
-            "Замініть посилання на ваші групи",
+            "Замініть посилання на ваші групи.\n\n"
+            "Багато груп - надішліть файл .txt або .csv з посиланнями, у підписі назва списку. "
+            "Збережений список: `#группы назва`, усі списки: `#списки`",
             parse_mode='Markdown',
             reply_markup=reply_markup
         )
@@ -588,16 +4303,20 @@ async def button_callback(update, context):
         await query.edit_message_text(
             "📝 Скопіюйте та відправте:\n\n"
             "`#пост https://www.youtube.com/watch?v=example Ваш текст поста тут`\n\n"
-            "Замініть посилання та текст на ваші",
+            "Замініть посилання та текст на ваші. Кілька постів - кожен `#пост` з нового рядка "
+            "в одному повідомленні, вони підуть у ті самі групи",
             parse_mode='Markdown',
             reply_markup=reply_markup
         )
     
     elif query.data == 'stop_bot':
         bot_running = False
-        if current_session:
-            current_session.close()
-            current_session = None
+        with sessions_lock:
+            running = list(sessions.values())
+            sessions.clear()
+        await asyncio.to_thread(workers.shutdown)
+        await asyncio.to_thread(dispatcher.shutdown)
+        await close_sessions(running)
         
         await query.edit_message_text(
             "🛑 Бот зупинено\n"
@@ -606,6 +4325,9 @@ async def button_callback(update, context):
         )
         
         # Завершаем работу приложения
+        outbox.flush()
+        driver_pool.shutdown()
+        supervisor.shutdown()
         os._exit(0)
     
     elif query.data == 'back_to_start':
@@ -613,11 +4335,13 @@ async def button_callback(update, context):
     
     elif query.data == 'back_to_control_panel':
         # Возвращаемся к панели управления текущего профиля
-        if current_profile is not None:
+        if active_profile is not None:
             profiles = get_profiles()
-            if current_profile in profiles:
-                profile_name = profiles[current_profile]['person']
-                await show_control_panel(update, context, profile_name)
+            if active_profile in profiles:
+                profile_name = profiles[active_profile]['person']
+                with sessions_lock:
+                    already_running = active_profile in sessions
+                await show_control_panel(update, context, profile_name, active_profile, already_running)
             else:
                 await cmd_start_callback(update, context)
         else:
@@ -635,46 +4359,102 @@ async def cmd_start_callback(update, context):
     )
 
 # Создание Telegram приложения
-application = Application.builder().token(TELEGRAM_TOKEN).build()
+def build_application():
+    global application
+    load_telegram()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(TELEGRAM_API_BASE_URL)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .build()
+    )
+    
+    # Регистрация обработчиков
+    application.add_handler(CommandHandler("start", cmd_start))
+    application.add_handler(CallbackQueryHandler(button_callback))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
+    return application
 
-# Регистрация обработчиков
-application.add_handler(CommandHandler("start", cmd_start))
-application.add_handler(CallbackQueryHandler(button_callback))
-application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+def initialize_bot(mark_ready=True):
+    """Всё, без чего /health обходится: Telegram, восстановление кампаний, фоновые службы.
+    mark_ready=False - готовность объявит вызывающий, когда Application начнёт принимать апдейты"""
+    build_application()
+    supervisor.start()
+    campaign_store.recover()
+    if CAMPAIGN_AUTO_RESUME:
+        resume_campaigns()
+    if mark_ready:
+        bot_ready.set()
+    logger.info(f"✅ Бот инициализирован за {time.monotonic() - BOOT_STARTED:.2f} сек после старта")
+
+def resume_campaigns():
+    """Поднимает сессии профилей с незавершёнными кампаниями"""
+    accounts = set(campaign_store.active_accounts())
+    for profile_id, profile_data in get_profiles().items():
+        if profile_data['email'] not in accounts:
+            continue
+        logger.info(f"♻️ Возобновляю кампанию для {profile_data['person']}")
+        with sessions_lock:
+            if profile_id in sessions:
+                continue
+        start_session(profile_data, profile_id)
+
+async def close_sessions(running):
+    """Закрывает сессии, не блокируя цикл Telegram: свои - в цикле сессий, процессы и узлы - в потоках"""
+    waits = []
+    for session in running:
+        if isinstance(session, RemoteSession):
+            waits.append(asyncio.to_thread(session.close))
+        else:
+            waits.append(asyncio.wrap_future(session_loop.submit(session.aclose())))
+    await asyncio.gather(*waits, return_exceptions=True)
+
+def shutdown_sessions():
+    """Закрываем активные сессии при завершении"""
+    with sessions_lock:
+        running = list(sessions.values())
+    for session in running:
+        logger.info(f"🔄 Закрываю сессию {session.person_name}...")
+        if not isinstance(session, RemoteSession):
+            session.close()
+    workers.shutdown()
+    dispatcher.shutdown()
+    driver_pool.shutdown()
+    supervisor.shutdown()
+    outbox.flush()
+    logger.info("👋 Бот остановлен")
 
 # Запуск бота
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5000))
     
-    if USE_WEBHOOK and WEBHOOK_URL:
-        logger.info("🌐 Запуск в режиме Webhook")
-        
-        # Настройка webhook
-        async def set_webhook():
-            await application.bot.set_webhook(url=f"{WEBHOOK_URL}/webhook")
-            logger.info(f"Webhook установлен: {WEBHOOK_URL}/webhook")
-        
-        # Запускаем установку webhook
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(set_webhook())
-        
-        # Запускаем Flask
-        logger.info(f"🚀 Запуск Flask сервера на порту {port}")
-        app.run(host='0.0.0.0', port=port, debug=False)
+    if DISPATCHER_URL:
+        logger.info(f"🛰 Запуск узла постинга {NODE_ID}, диспетчер {DISPATCHER_URL}")
+        run_node()
+    
+    elif USE_WEBHOOK and WEBHOOK_URL and WEBHOOK_SERVER == "asgi":
+        logger.info("🌐 Запуск в режиме Webhook (ASGI)")
+        try:
+            asyncio.run(run_asgi_webhook(port))
+        finally:
+            shutdown_sessions()
+    
+    elif USE_WEBHOOK and WEBHOOK_URL:
+        logger.info("🌐 Запуск в режиме Webhook (Flask)")
+        try:
+            run_flask_webhook(port)
+        finally:
+            shutdown_sessions()
         
     else:
         logger.info("🤖 Запуск в режиме Polling")
         
-        # Запускаем Flask в отдельном потоке для health check
-        def run_flask():
-            app.run(host='0.0.0.0', port=port, debug=False)
-        
-        flask_thread = threading.Thread(target=run_flask)
-        flask_thread.daemon = True
-        flask_thread.start()
-        
+        # Flask для health check поднимается до инициализации бота
+        start_flask_thread(port)
         logger.info("🌐 Flask health check запущен")
+        initialize_bot()
         
         try:
             # Сначала удаляем webhook если он был установлен
@@ -689,8 +4469,4 @@ if __name__ == "__main__":
             # Запускаем polling
             application.run_polling()
         finally:
-            # Закрываем активную сессию при завершении
-            if current_session:
-                logger.info("🔄 Закрываю активную сессию...")
-                current_session.close()
-            logger.info("👋 Бот остановлен")
+            shutdown_sessions()
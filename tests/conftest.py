@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# Модулю бота нужны переменные Telegram; база кампаний открывается только при первом обращении
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("TELEGRAM_USER_ID", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import okru_post_bot as bot  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Отдельная база кампаний на тест, подставленная вместо общей"""
+    campaign_store = bot.CampaignStore(str(tmp_path / "campaigns.db"))
+    monkeypatch.setattr(bot, "campaign_store", campaign_store)
+    return campaign_store
@@ -0,0 +1,236 @@
+import asyncio
+import time
+
+import pytest
+
+import okru_post_bot as bot
+
+GROUPS = ["https://ok.ru/group/1", "https://ok.ru/group/2"]
+POST = ("https://youtu.be/video", "Текст поста")
+
+
+def create(store, groups=GROUPS, posts=(POST,), account="user@example.com"):
+    campaign_id = store.create_campaign(account, 1, list(posts), list(groups))
+    return campaign_id, store.pending_jobs(campaign_id)
+
+
+def job_row(store, job_id):
+    return dict(store._execute("SELECT state, attempts, not_before, last_error, finished_at FROM jobs WHERE id = ?",
+                               (job_id,))[0])
+
+
+# --- CampaignStore ---
+
+def test_database_is_opened_on_first_use(tmp_path):
+    path = tmp_path / "campaigns.db"
+    store = bot.CampaignStore(str(path))
+    assert not path.exists()
+    assert store.counts(1) == {}
+    assert path.exists()
+
+
+def test_campaign_has_one_pending_job_per_post_and_group(store):
+    second = ("https://youtu.be/other", "Второй")
+    campaign_id, jobs = create(store, groups=GROUPS + [GROUPS[0]], posts=(POST, second))
+    assert store.counts(campaign_id) == {"pending": 4}
+    assert store.post_count(campaign_id) == 2
+    assert store.campaign_groups(campaign_id) == GROUPS
+    assert [(job["group_url"], job["video_url"]) for job in jobs] == [
+        (GROUPS[0], POST[0]), (GROUPS[0], second[0]), (GROUPS[1], POST[0]), (GROUPS[1], second[0]),
+    ]
+    assert store.active_campaign("user@example.com") == campaign_id
+    assert store.active_accounts() == ["user@example.com"]
+
+
+def test_job_goes_through_running_and_submitting_to_done(store):
+    campaign_id, jobs = create(store, groups=GROUPS[:1])
+    job_id = jobs[0]["id"]
+    store.start_job(job_id)
+    assert job_row(store, job_id)["state"] == "running"
+    assert job_row(store, job_id)["attempts"] == 1
+    store.mark_submitting(job_id)
+    assert job_row(store, job_id)["state"] == "submitting"
+    store.finish_job(job_id)
+    row = job_row(store, job_id)
+    assert row["state"] == "done"
+    assert row["finished_at"] is not None
+    assert store.pending_jobs(campaign_id) == []
+
+
+def test_unknown_jobs_are_reported_as_problems(store):
+    campaign_id, jobs = create(store)
+    store.start_job(jobs[0]["id"])
+    store.mark_unknown(jobs[0]["id"], "обрыв после нажатия")
+    assert store.counts(campaign_id) == {"pending": 1, "unknown": 1}
+    problems = store.problem_jobs(campaign_id)
+    assert [(p["group_url"], p["state"], p["last_error"]) for p in problems] == [
+        (GROUPS[0], "unknown", "обрыв после нажатия"),
+    ]
+
+
+def test_failed_attempts_are_retried_until_the_limit(store):
+    campaign_id, jobs = create(store, groups=GROUPS[:1])
+    job_id = jobs[0]["id"]
+    for attempt in range(2):
+        store.start_job(job_id)
+        assert store.fail_job(job_id, f"ошибка {attempt}", max_attempts=3) is True
+        assert job_row(store, job_id)["state"] == "pending"
+    store.start_job(job_id)
+    assert store.fail_job(job_id, "ошибка 2", max_attempts=3) is False
+    row = job_row(store, job_id)
+    assert (row["state"], row["attempts"], row["last_error"]) == ("failed", 3, "ошибка 2")
+
+
+def test_deferred_job_waits_and_gets_its_attempt_back(store):
+    campaign_id, jobs = create(store)
+    job_id = jobs[0]["id"]
+    store.start_job(job_id)
+    resume_at = time.time() + 600
+    store.defer_job(job_id, resume_at, "too often")
+    row = job_row(store, job_id)
+    assert (row["state"], row["attempts"], row["not_before"]) == ("pending", 0, resume_at)
+    # Отложенная задача уходит в конец очереди
+    assert [job["id"] for job in store.pending_jobs(campaign_id)] == [jobs[1]["id"], job_id]
+
+
+def test_deferred_captcha_keeps_the_attempt(store):
+    _, jobs = create(store, groups=GROUPS[:1])
+    job_id = jobs[0]["id"]
+    store.start_job(job_id)
+    store.defer_job(job_id, time.time() + 60, "captcha", refund_attempt=False)
+    assert job_row(store, job_id)["attempts"] == 1
+
+
+def test_refund_never_makes_attempts_negative(store):
+    _, jobs = create(store, groups=GROUPS[:1])
+    store.defer_job(jobs[0]["id"], time.time(), "too often")
+    assert job_row(store, jobs[0]["id"])["attempts"] == 0
+
+
+def test_recover_requeues_running_and_flags_submitting(store):
+    campaign_id, jobs = create(store)
+    store.start_job(jobs[0]["id"])
+    store.start_job(jobs[1]["id"])
+    store.mark_submitting(jobs[1]["id"])
+    store.recover()
+    assert store.counts(campaign_id) == {"pending": 1, "unknown": 1}
+    assert job_row(store, jobs[1]["id"])["last_error"] == "бот перезапущен во время отправки"
+
+
+def test_release_account_touches_only_that_account(store):
+    mine, my_jobs = create(store, account="a@example.com")
+    other, other_jobs = create(store, account="b@example.com")
+    for job in my_jobs + other_jobs:
+        store.start_job(job["id"])
+    store.mark_submitting(my_jobs[1]["id"])
+    assert store.release_account("a@example.com") == 1
+    assert store.counts(mine) == {"pending": 1, "unknown": 1}
+    assert store.counts(other) == {"running": 2}
+
+
+def test_account_node_is_remembered(store):
+    assert store.account_node("a@example.com") is None
+    store.set_account_node("a@example.com", "node-1")
+    store.set_account_node("a@example.com", "node-2")
+    assert store.account_node("a@example.com") == "node-2"
+
+
+def test_group_lists_are_case_insensitive_and_replaced(store):
+    assert store.group_list("Моя") is None
+    store.save_group_list("Моя", GROUPS)
+    assert store.group_list("моя") == GROUPS
+    store.save_group_list("МОЯ", GROUPS[:1])
+    assert store.group_list("Моя") == GROUPS[:1]
+    store.save_group_list("пустой", [])
+    assert store.group_list("пустой") == []
+    assert store.group_lists() == [("моя", 1), ("пустой", 0)]
+
+
+def test_free_group_list_name_skips_taken_names(store):
+    assert bot.free_group_list_name("список") == "список"
+    store.save_group_list("список", GROUPS)
+    store.save_group_list("список_2", GROUPS)
+    assert bot.free_group_list_name("список") == "список_3"
+
+
+# --- OKSession.run_job ---
+
+@pytest.fixture
+def session(store, monkeypatch):
+    monkeypatch.setattr(bot, "pacers", {})
+    session = bot.OKSession("user@example.com", "secret", "Тест", profile_id=1)
+
+    async def send_status(message):
+        session.statuses.append(message)
+
+    session.statuses = []
+    monkeypatch.setattr(session, "send_status", send_status)
+    yield session
+    session.browser._executor.shutdown(wait=False)
+
+
+def fake_post(session, monkeypatch, error=None, submit=False):
+    """Подменяет постинг через браузер: нажимает "кнопку" (submit) и/или падает с error"""
+    async def post_to_group(group_url, video_url, text, on_submit=None):
+        if submit and on_submit:
+            on_submit()
+        if error is not None:
+            raise error
+
+    monkeypatch.setattr(session, "post_to_group", post_to_group)
+
+
+def run_first_job(store, session):
+    campaign_id, jobs = create(store, groups=GROUPS[:1])
+    result = asyncio.run(session.run_job(jobs[0]))
+    return result, job_row(store, jobs[0]["id"])
+
+
+def test_run_job_marks_success_done(store, session, monkeypatch):
+    fake_post(session, monkeypatch, submit=True)
+    result, row = run_first_job(store, session)
+    assert result["status"] == "ok"
+    assert (row["state"], row["attempts"]) == ("done", 1)
+    assert session.driver_posts == 1
+
+
+def test_run_job_retries_failure_before_submit(store, session, monkeypatch):
+    fake_post(session, monkeypatch, error=bot.TimeoutException("нет поля ввода"))
+    result, row = run_first_job(store, session)
+    assert (result["status"], result["retry"]) == ("error", True)
+    assert (row["state"], row["attempts"]) == ("pending", 1)
+
+
+def test_run_job_does_not_retry_failure_after_submit(store, session, monkeypatch):
+    fake_post(session, monkeypatch, error=RuntimeError("драйвер упал"), submit=True)
+    result, row = run_first_job(store, session)
+    assert result["status"] == "error"
+    assert "retry" not in result
+    assert row["state"] == "unknown"
+
+
+def test_run_job_marks_unconfirmed_submit_unknown(store, session, monkeypatch):
+    fake_post(session, monkeypatch, error=bot.SubmitUnconfirmed("форма не закрылась"), submit=True)
+    _, row = run_first_job(store, session)
+    assert row["state"] == "unknown"
+
+
+def test_run_job_defers_throttled_post_and_refunds_attempt(store, session, monkeypatch):
+    fake_post(session, monkeypatch, error=bot.PostThrottled("throttled"), submit=True)
+    before = time.time()
+    result, row = run_first_job(store, session)
+    assert result["status"] == "throttled"
+    assert (row["state"], row["attempts"]) == ("pending", 0)
+    assert row["not_before"] >= before + bot.THROTTLE_BACKOFF - 1
+    assert session.pacer.throttles == 1
+    assert len(session.statuses) == 1
+
+
+def test_run_job_fails_captcha_on_last_attempt(store, session, monkeypatch):
+    fake_post(session, monkeypatch, error=bot.PostThrottled("captcha"), submit=True)
+    campaign_id, jobs = create(store, groups=GROUPS[:1])
+    job = dict(jobs[0], attempts=bot.JOB_MAX_ATTEMPTS - 1)
+    store._execute("UPDATE jobs SET attempts = ? WHERE id = ?", (job["attempts"], job["id"]))
+    asyncio.run(session.run_job(job))
+    assert job_row(store, job["id"])["state"] == "failed"
+
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import pytest
+
+import okru_post_bot as bot
+
+
+def test_deliver_without_waiter_returns_false():
+    assert bot.Handoff().deliver('sms', '123456') is False
+
+
+def test_value_delivered_from_another_thread_reaches_the_waiter():
+    changes = []
+    handoff = bot.Handoff(on_change=lambda kind, waiting: changes.append((kind, waiting)))
+
+    async def run():
+        waiter = asyncio.create_task(handoff.wait('sms', timeout=5))
+        await asyncio.sleep(0)
+        assert handoff.waiting_for('sms')
+        delivered = []
+        thread = threading.Thread(target=lambda: delivered.append(handoff.deliver('sms', '123456')))
+        thread.start()
+        thread.join()
+        assert delivered == [True]
+        return await waiter
+
+    assert asyncio.run(run()) == '123456'
+    assert not handoff.waiting_for('sms')
+    assert changes[0] == ('sms', True)
+    assert changes[-1] == ('sms', False)
+
+
+def test_waits_of_different_kinds_are_independent():
+    handoff = bot.Handoff()
+
+    async def run():
+        groups = asyncio.create_task(handoff.wait('groups', timeout=5))
+        post = asyncio.create_task(handoff.wait('post', timeout=5))
+        await asyncio.sleep(0)
+        handoff.deliver('post', ('url', 'text'))
+        handoff.deliver('groups', ['https://ok.ru/group/1'])
+        return await groups, await post
+
+    assert asyncio.run(run()) == (['https://ok.ru/group/1'], ('url', 'text'))
+
+
+def test_new_wait_cancels_the_previous_one():
+    handoff = bot.Handoff()
+
+    async def run():
+        first = asyncio.create_task(handoff.wait('sms', timeout=5))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(handoff.wait('sms', timeout=5))
+        await asyncio.sleep(0)
+        with pytest.raises(bot.HandoffCancelled):
+            await first
+        handoff.deliver('sms', '654321')
+        return await second
+
+    assert asyncio.run(run()) == '654321'
+
+
+def test_cancel_all_wakes_waiters_with_cancelled():
+    handoff = bot.Handoff()
+
+    async def run():
+        waiter = asyncio.create_task(handoff.wait('sms', timeout=5))
+        await asyncio.sleep(0)
+        handoff.cancel_all()
+        with pytest.raises(bot.HandoffCancelled):
+            await waiter
+
+    asyncio.run(run())
+    assert not handoff.waiting_for('sms')
+
+
+def test_timeout_clears_the_waiter():
+    handoff = bot.Handoff()
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await handoff.wait('sms', timeout=0.01)
+
+    asyncio.run(run())
+    assert not handoff.waiting_for('sms')
+    assert handoff.deliver('sms', '123456') is False
@@ -0,0 +1,78 @@
+import json
+import pickle
+
+import pytest
+
+import okru_post_bot as bot
+
+
+def registry():
+    metrics = bot.MetricsRegistry()
+    posts = metrics.register(bot.Counter("test_posts_total", "Посты", ["result"]))
+    latency = metrics.register(bot.Histogram("test_post_seconds", "Публикация", ["status"], buckets=(1, 5)))
+    metrics.register(bot.Gauge("test_sessions", "Сессии", lambda: 2))
+    return metrics, posts, latency
+
+
+def test_counter_delta_reports_only_new_increments():
+    _, posts, _ = registry()
+    posts.inc(result='ok')
+    posts.inc(2, result='failed')
+    assert sorted(posts.delta()) == [[['failed'], 2], [['ok'], 1]]
+    assert posts.delta() == []
+    posts.inc(result='ok')
+    assert posts.delta() == [[['ok'], 1]]
+
+
+def test_histogram_delta_reports_buckets_sum_and_count():
+    _, _, latency = registry()
+    latency.observe(0.5, status='ok')
+    latency.observe(3, status='ok')
+    assert latency.delta() == [[['ok'], [1, 2], 3.5, 2]]
+    latency.observe(10, status='ok')
+    assert latency.delta() == [[['ok'], [0, 0], 10.0, 1]]
+    assert latency.delta() == []
+
+
+def test_registry_delta_survives_ipc_and_merges_into_another_registry():
+    worker, posts, latency = registry()
+    posts.inc(result='ok')
+    latency.observe(0.5, status='ok')
+    front, _, _ = registry()
+    # Процессы профилей шлют прирост через Pipe (pickle), узлы - в JSON
+    front.merge(pickle.loads(pickle.dumps(worker.delta())))
+    posts.inc(result='ok')
+    front.merge(json.loads(json.dumps(worker.delta())))
+    assert worker.delta() == {}
+
+    rendered = front.render()
+    assert 'test_posts_total{result="ok"} 2' in rendered
+    assert 'test_post_seconds_bucket{status="ok",le="1"} 1' in rendered
+    assert 'test_post_seconds_count{status="ok"} 1' in rendered
+    assert 'test_sessions 2' in rendered
+
+
+def test_merge_ignores_unknown_metrics():
+    front, posts, _ = registry()
+    front.merge({"other_total": [[[], 5]]})
+    assert posts.delta() == []
+
+
+def test_histogram_merge_rejects_other_buckets():
+    _, _, latency = registry()
+    with pytest.raises(ValueError):
+        latency.merge([[['ok'], [1, 0, 0], 0.5, 1]])
+
+
+def test_combined_deltas_merge_like_separate_ones():
+    worker, posts, latency = registry()
+    posts.inc(result='ok')
+    first = worker.delta()
+    posts.inc(result='ok')
+    latency.observe(2, status='ok')
+    second = worker.delta()
+
+    front, front_posts, front_latency = registry()
+    front.merge(bot.combine_metric_deltas(first, second))
+    assert front_posts.delta() == [[['ok'], 2]]
+    assert front_latency.delta() == [[['ok'], [0, 1], 2.0, 1]]
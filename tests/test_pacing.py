@@ -0,0 +1,113 @@
+import asyncio
+import types
+
+import pytest
+
+import okru_post_bot as bot
+
+
+class FakeClock:
+    """Подменяет time и asyncio.sleep в модуле бота: паузы не ждут, а сдвигают часы"""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1_700_000_000 + self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(round(delay, 6))
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(bot, "time", types.SimpleNamespace(monotonic=clock.monotonic, time=clock.time))
+    monkeypatch.setattr(bot, "asyncio", types.SimpleNamespace(sleep=clock.sleep))
+    return clock
+
+
+def acquire(pacer, times=1, not_before=0.0):
+    async def run():
+        for _ in range(times):
+            await pacer.acquire(not_before)
+    asyncio.run(run())
+
+
+def test_burst_goes_out_at_once_then_posts_are_spaced(clock):
+    pacer = bot.PostPacer(per_hour=3600, burst=2, jitter=0)
+    acquire(pacer, times=2)
+    assert clock.sleeps == []
+    acquire(pacer)
+    assert clock.sleeps == [1.0]
+
+
+def test_not_before_is_waited_out_first(clock):
+    pacer = bot.PostPacer(per_hour=0)
+    acquire(pacer, not_before=clock.time() + 30)
+    assert clock.sleeps == [30.0]
+
+
+def test_without_target_rate_only_the_throttle_pause_applies(clock):
+    pacer = bot.PostPacer(per_hour=0, backoff=120)
+    acquire(pacer, times=5)
+    assert clock.sleeps == []
+    resume_at = pacer.throttled('throttled')
+    assert resume_at == clock.time() + 120
+    acquire(pacer)
+    assert clock.sleeps == [120.0]
+
+
+def test_throttle_halves_rate_and_doubles_backoff_up_to_limits(clock):
+    pacer = bot.PostPacer(per_hour=60, backoff=100, max_backoff=300)
+    pauses = []
+    for _ in range(6):
+        pauses.append(pacer.throttled('throttled') - clock.time())
+    assert pauses == [100, 200, 300, 300, 300, 300]
+    # Скорость падает вдвое, но не ниже 1/20 цели
+    assert pacer.rate == pytest.approx(pacer.target / 20)
+    assert pacer.tokens == 0
+    assert pacer.stats()['throttles'] == 6
+
+
+def test_throttled_pacer_blocks_until_the_pause_ends(clock):
+    pacer = bot.PostPacer(per_hour=3600, burst=3, jitter=0, backoff=50)
+    pacer.throttled('captcha')
+    acquire(pacer)
+    # За паузу токены набираются заново - после неё пост уходит сразу
+    assert clock.sleeps == [50.0]
+    acquire(pacer, times=2)
+    assert clock.sleeps == [50.0]
+    # Дальше интервал по сниженной вдвое скорости
+    acquire(pacer)
+    assert clock.sleeps == [50.0, 2.0]
+    assert pacer.stats()['captchas'] == 1
+
+
+def test_success_restores_rate_additively_and_resets_backoff(clock):
+    pacer = bot.PostPacer(per_hour=3600, backoff=100)
+    pacer.throttled('throttled')
+    pacer.throttled('throttled')
+    assert pacer.rate == pytest.approx(pacer.target / 4)
+    pacer.success()
+    assert pacer.rate == pytest.approx(pacer.target / 4 + pacer.target / 10)
+    assert pacer.backoff == 100
+    for _ in range(20):
+        pacer.success()
+    assert pacer.rate == pytest.approx(pacer.target)
+
+
+def test_stats_report_rates_per_hour(clock):
+    pacer = bot.PostPacer(per_hour=120)
+    pacer.success()
+    pacer.success()
+    stats = pacer.stats()
+    assert stats['target_per_hour'] == 120
+    assert stats['current_per_hour'] == 120
+    # Меньше минуты работы считается как минута
+    assert stats['achieved_per_hour'] == 120
+    assert stats['blocked_for'] == 0
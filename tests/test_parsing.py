@@ -0,0 +1,33 @@
+import okru_post_bot as bot
+
+
+def test_parse_posts_splits_blocks():
+    text = "#пост https://youtu.be/a Первый текст\n#ПОСТ https://youtu.be/b\nВторой\nмногострочный"
+    assert bot.parse_posts(text) == [
+        ("https://youtu.be/a", "Первый текст"),
+        ("https://youtu.be/b", "Второй\nмногострочный"),
+    ]
+
+
+def test_parse_posts_needs_a_link_in_every_block():
+    assert bot.parse_posts("#пост https://youtu.be/a текст\n#пост без ссылки") is None
+
+
+def test_parse_posts_ignores_text_without_marker():
+    assert bot.parse_posts("просто текст https://youtu.be/a") == []
+    assert bot.parse_posts("текст #постер https://youtu.be/a") == []
+
+
+def test_extract_group_urls_normalizes_and_dedupes():
+    lines = [
+        "https://ok.ru/group/123, http://www.OK.ru/group/456/topics",
+        "m.ok.ru/group/123;ok.ru/group/789",
+    ]
+    assert bot.extract_group_urls(lines) == (
+        ["https://ok.ru/group/123", "https://ok.ru/group/456", "https://ok.ru/group/789"], 1,
+    )
+
+
+def test_extract_group_urls_ignores_other_domains():
+    lines = ["book.ru/group/5 notok.ru/group/6 https://notok.ru/group/7 example.com/ok.ru/group/8"]
+    assert bot.extract_group_urls(lines) == ([], 0)
@@ -0,0 +1,260 @@
+"""Офлайн-бенчмарк браузерного пути бота на локальной подмене OK.ru.
+
+    # полный прогон: запуск Chrome, вход (с SMS), восстановление сессии, постинг, кампании
+    python tools/bench_okru.py --groups 10 --runs 5 --concurrency 1,2,4 --sms --json bench.json
+
+    # ввод длинного текста поста: клавишами (send_keys) против вставки (Input.insertText)
+    python tools/bench_okru.py --text-length 3000 --runs 5
+
+    # сравнить с сохранённым прогоном; код выхода 1 при регрессии
+    python tools/bench_okru.py --baseline bench.json --threshold 0.2
+
+Бот импортируется как модуль и работает как обычно, только OK_BASE_URL и
+TELEGRAM_API_BASE_URL направлены на mock_okru и fake_telegram. Нужен Chrome.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+from mock_okru import MockOkSite  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMAIL = "bench@example.com"
+TEXT_SAMPLE = "Дивіться нове відео: як ми провели вихідні на Дніпрі. Подписывайтесь на группу! "
+EMOJI_SAMPLE = "🔥 Нове відео 🎬 смотрите до конца 👍 "
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+def load_bot(site, telegram_api, workdir):
+    """Импортирует бота с окружением, направленным на локальные заглушки"""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": os.environ.get("TELEGRAM_BOT_TOKEN", "123456:BENCH"),
+        "TELEGRAM_USER_ID": os.environ.get("TELEGRAM_USER_ID", "1"),
+        "TELEGRAM_API_BASE_URL": telegram_api.base_url,
+        "TELEGRAM_MIN_INTERVAL": "0",
+        "OK_BASE_URL": site.base_url,
+        "DRIVER_POOL_SIZE": "0",
+        "SESSION_STORE_DIR": os.path.join(workdir, "sessions"),
+        "CAMPAIGN_DB": os.path.join(workdir, "campaigns.db"),
+        "POST_RATE_PER_HOUR": "0",  # Меряем сам постинг, а не паузы темпа
+    })
+    sys.path.insert(0, ROOT)
+    import okru_post_bot
+    return okru_post_bot
+
+
+async def deliver_sms(session, code):
+    """Отвечает на запрос SMS-кода так же, как это сделал бы handle_message"""
+    while not session.handoff.waiting_for('sms'):
+        await asyncio.sleep(0.05)
+    session.handoff.deliver('sms', code)
+
+
+async def timed_auth(bot, site, sms):
+    session = bot.OKSession(EMAIL, "secret", "Bench", profile_id="bench")
+    helper = asyncio.create_task(deliver_sms(session, site.sms_code)) if sms else None
+    started = time.perf_counter()
+    try:
+        ok = await session.authenticate()
+        elapsed = time.perf_counter() - started
+    finally:
+        if helper:
+            helper.cancel()
+    if not ok:
+        await session.aclose()
+        raise RuntimeError("Авторизация на mock OK.ru не прошла")
+    return session, elapsed
+
+
+async def bench(bot, site, args):
+    results = {}
+    groups = [f"{site.base_url}/group/{50000 + i}" for i in range(args.groups)]
+    video_url = "https://ok.ru/video/1234567890"
+
+    samples = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        driver = bot.launch_chrome()
+        samples.append(time.perf_counter() - started)
+        bot.supervisor.quit_driver(driver)  # Как в боте: снимается с учёта и добивается дерево процессов
+    results["driver_init"] = summarize(samples)
+
+    samples = []
+    for _ in range(args.runs):
+        bot.session_store.clear(EMAIL)
+        session, elapsed = await timed_auth(bot, site, args.sms)
+        samples.append(elapsed)
+        await session.aclose()
+    results["auth_fresh"] = summarize(samples)
+
+    samples = []
+    for _ in range(args.runs):
+        session, elapsed = await timed_auth(bot, site, args.sms)
+        samples.append(elapsed)
+        await session.aclose()
+    results["auth_restore"] = summarize(samples)
+
+    session, _ = await timed_auth(bot, site, args.sms)
+    try:
+        if args.text_length:
+            results.update(await bench_text_input(bot, session, site, args))
+
+        samples = []
+        commands = webdriver_commands(bot)
+        for group_url in groups:
+            started = time.perf_counter()
+            await session.post_to_group(group_url, video_url, "Бенчмарк")
+            samples.append(time.perf_counter() - started)
+        results["post_to_group"] = summarize(samples)
+        results["post_to_group"]["commands_per_post"] = round((webdriver_commands(bot) - commands) / len(groups), 1)
+
+        for parallelism in args.concurrency:
+            bot.POST_PARALLELISM = parallelism
+            samples, done = [], []
+            for _ in range(args.runs):
+                campaign_id = bot.campaign_store.create_campaign(EMAIL, "bench", [(video_url, "Бенчмарк")], groups)
+                started = time.perf_counter()
+                await session.run_campaign(campaign_id)
+                samples.append(time.perf_counter() - started)
+                done.append(bot.campaign_store.counts(campaign_id).get('done', 0))
+            entry = summarize(samples)
+            entry.update({
+                "groups": len(groups),
+                "done_min": min(done),
+                "groups_per_min": round(min(done) / percentile(samples, 50) * 60, 1),  # по медиане прогона
+            })
+            results[f"campaign_c{parallelism}"] = entry
+    finally:
+        await session.aclose()
+    return results
+
+
+def long_text(sample, length):
+    return (sample * (length // len(sample) + 1))[:length]
+
+
+async def bench_text_input(bot, session, site, args):
+    """Ввод длинного текста в поле поста обоими способами; intact - доля вводов, где текст дошёл без потерь"""
+    results = {}
+    texts = {
+        "cyrillic": long_text(TEXT_SAMPLE, args.text_length),
+        "emoji": long_text(EMOJI_SAMPLE, args.text_length),
+    }
+    browser = session.browser
+    await browser.get(f"{site.base_url}/group/49999/post")
+    box = await browser.find_element(bot.By.CSS_SELECTOR, bot.POST_BOX_SELECTOR)
+    configured = bot.TEXT_INPUT_MODE
+    try:
+        for mode in ("keys", "insert"):
+            bot.TEXT_INPUT_MODE = mode
+            for kind, text in texts.items():
+                samples, intact, errors, method = [], 0, 0, None
+                for _ in range(args.runs):
+                    await browser.execute_script("arguments[0].innerHTML = '';", box)
+                    started = time.perf_counter()
+                    try:
+                        method = await browser.insert_text(box, text)
+                    except bot.WebDriverException:
+                        errors += 1  # chromedriver отказывается вводить символы вне BMP
+                        continue
+                    samples.append(time.perf_counter() - started)
+                    typed = await browser.execute_script("return arguments[0].innerText;", box)
+                    intact += typed.replace("\xa0", " ").strip() == text.strip()
+                entry = summarize(samples) if samples else {"runs": 0}
+                entry.update({"chars": len(text), "method": method, "intact": round(intact / args.runs, 2), "errors": errors})
+                results[f"text_{mode}_{kind}"] = entry
+    finally:
+        bot.TEXT_INPUT_MODE = configured
+    return results
+
+
+def webdriver_commands(bot):
+    """Сколько команд WebDriver (запросов к chromedriver) бот отправил с начала работы"""
+    return sum(value for _, _, _, value in bot.METRIC_WEBDRIVER_COMMANDS.samples())
+
+
+def compare(results, baseline, threshold):
+    """Сравнивает задержки с базовым прогоном; возвращает список регрессий"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for key in ("p50_ms", "p95_ms", "seconds", "commands_per_post"):
+            if key in current and previous.get(key):
+                change = current[key] / previous[key] - 1
+                marker = "  <-- регрессия" if change > threshold else ""
+                print(f"{name:>16} {key:>8}: {previous[key]:>9} -> {current[key]:>9} ({change:+.0%}){marker}")
+                if marker:
+                    regressions.append(f"{name}.{key}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк постинга на mock OK.ru")
+    parser.add_argument("--groups", type=int, default=10, help="Групп в кампании")
+    parser.add_argument("--runs", type=int, default=5, help="Повторов каждого замера (запуск Chrome, вход, кампания)")
+    parser.add_argument("--concurrency", default="1,2,4", help="Значения POST_PARALLELISM через запятую")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответов mock OK.ru, сек")
+    parser.add_argument("--preview-delay", type=float, default=0.3, help="Задержка появления превью, сек")
+    parser.add_argument("--sms", action="store_true", help="Вход с подтверждением личности и SMS")
+    parser.add_argument("--text-length", type=int, default=2000, help="Длина текста для сравнения ввода, 0 - не сравнивать")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в файл")
+    parser.add_argument("--baseline", help="Файл прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимое ухудшение, доля")
+    args = parser.parse_args()
+    args.concurrency = [int(value) for value in args.concurrency.split(",") if value]
+
+    site = MockOkSite(
+        latency=args.latency,
+        preview_delay=args.preview_delay,
+        login_flow=("confirm", "sms") if args.sms else (),
+    ).start()
+    telegram_api = FakeTelegramAPI().start()
+    workdir = tempfile.mkdtemp(prefix="okbench-")
+    try:
+        bot = load_bot(site, telegram_api, workdir)
+        results = asyncio.run(bench(bot, site, args))
+        bot.outbox.flush()
+    finally:
+        site.stop()
+        telegram_api.stop()
+
+    for name, values in results.items():
+        print(f"{name:>16}: " + "  ".join(f"{key}={value}" for key, value in values.items()))
+    print(f"{'posts':>16}: {len(site.posts)}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Регрессии: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Бенчмарк холодного старта: импорт модуля и время до первого ответа /health.
+
+    python tools/bench_startup.py --runs 5 --mode polling --mode asgi
+
+Для каждого режима бот запускается заново (с заглушкой Telegram API) и замеряется:
+  import  - время импорта okru_post_bot в чистом интерпретаторе
+  healthy - от запуска процесса до первого 200 на /health
+  ready   - до "bot": "ready" в /health (Telegram и кампании инициализированы)
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+from loadtest_webhook import free_port, percentile  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import okru_post_bot; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def bot_env(telegram_api, workdir, port=None, mode="polling"):
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": env.get("TELEGRAM_BOT_TOKEN", "123456:STARTUP"),
+        "TELEGRAM_USER_ID": env.get("TELEGRAM_USER_ID", "1"),
+        "TELEGRAM_API_BASE_URL": telegram_api.base_url,
+        "CAMPAIGN_DB": os.path.join(workdir, "campaigns.db"),
+        "SESSION_STORE_DIR": os.path.join(workdir, "sessions"),
+        "DRIVER_POOL_SIZE": "0",
+        "PYTHONPATH": ROOT,
+    })
+    if port:
+        env["PORT"] = str(port)
+    if mode in ("asgi", "flask"):
+        env.update({"USE_WEBHOOK": "true", "WEBHOOK_URL": f"http://127.0.0.1:{port}", "WEBHOOK_SERVER": mode})
+    else:
+        env["USE_WEBHOOK"] = "false"
+    return env
+
+
+def measure_import(env):
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], env=env, cwd=ROOT,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_start(env, port, timeout=60):
+    """Возвращает (секунды до healthy, секунды до ready)"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "okru_post_bot.py")],
+        env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    healthy = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Бот завершился с кодом {process.returncode}")
+            try:
+                response = httpx.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            except httpx.HTTPError:
+                response = None
+            if response is not None and response.status_code == 200:
+                elapsed = time.perf_counter() - started
+                healthy = healthy or elapsed
+                if response.json().get("bot", "ready") == "ready":
+                    ready = elapsed
+                    return healthy, ready
+            time.sleep(0.01)
+        raise RuntimeError(f"Бот не поднялся за {timeout} секунд")
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def summary(values):
+    return f"p50={percentile(values, 50) * 1000:7.0f} ms  max={max(values) * 1000:7.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта бота")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mode", action="append", choices=["polling", "asgi", "flask"],
+                        help="Режим запуска (можно несколько раз), по умолчанию polling и asgi")
+    args = parser.parse_args()
+
+    telegram_api = FakeTelegramAPI().start()
+    workdir = tempfile.mkdtemp(prefix="okstartup-")
+    try:
+        imports = [measure_import(bot_env(telegram_api, workdir)) for _ in range(args.runs)]
+        print(f"{'import':>16}: {summary(imports)}")
+        for mode in args.mode or ["polling", "asgi"]:
+            healthy, ready = [], []
+            for _ in range(args.runs):
+                port = free_port()
+                h, r = measure_start(bot_env(telegram_api, workdir, port, mode), port)
+                healthy.append(h)
+                ready.append(r)
+            print(f"{mode + ' healthy':>16}: {summary(healthy)}")
+            print(f"{mode + ' ready':>16}: {summary(ready)}")
+    finally:
+        telegram_api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Локальная заглушка Telegram Bot API для бенчмарков и нагрузочных тестов.
+
+Бот направляется сюда через TELEGRAM_API_BASE_URL=http://127.0.0.1:<port>/bot
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeTelegramAPI:
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                api._handle(self)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, method=None):
+        with self._lock:
+            return sum(1 for m, _ in self.calls if method is None or m == method)
+
+    def _params(self, handler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        content_type = handler.headers.get("Content-Type", "")
+        if "json" in content_type:
+            return json.loads(body or b"{}")
+        if "multipart" in content_type:
+            return {}
+        return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "OK Bot", "username": "ok_test_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            message_id = int(params.get("message_id") or next(self._message_ids))
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        if method == "getUpdates":
+            return []
+        return True
+
+    def _handle(self, handler):
+        method = handler.path.rstrip("/").rsplit("/", 1)[-1]
+        params = self._params(handler)
+        with self._lock:
+            self.calls.append((method, params))
+        if self.delay:
+            time.sleep(self.delay)
+        if method == "getUpdates":
+            # Long polling: не отвечаем мгновенно, чтобы не крутить цикл впустую
+            time.sleep(min(float(params.get("timeout") or 0), 1.0))
+        payload = json.dumps({"ok": True, "result": self._result(method, params)}).encode()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.0, help="Задержка ответа, сек")
+    args = parser.parse_args()
+    api = FakeTelegramAPI(port=args.port, delay=args.delay).start()
+    print(f"TELEGRAM_API_BASE_URL={api.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        api.stop()
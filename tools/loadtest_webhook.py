@@ -0,0 +1,164 @@
+"""Нагрузочный тест webhook: шлёт синтетические апдейты и меряет пропускную способность.
+
+    # против уже запущенного бота
+    python tools/loadtest_webhook.py --url http://127.0.0.1:5000/webhook -n 2000 -c 50
+
+    # поднять бота локально (с заглушкой Telegram API) и прогнать тест
+    python tools/loadtest_webhook.py --spawn -n 2000 -c 50
+
+Апдейты приходят из чужого чата, поэтому handle_message их сразу отбрасывает -
+меряется именно приём и разбор запросов, а не работа с OK.ru.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": f"load test {update_id}",
+        },
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_load(url, total, concurrency, secret=None, chat_id=1):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    latencies = []
+    statuses = {}
+    counter = iter(range(1, total + 1))
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency), timeout=30) as client:
+        async def worker():
+            for update_id in counter:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=synthetic_update(update_id, chat_id), headers=headers)
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "statuses": statuses,
+    }
+
+
+def spawn_bot(port, telegram_api, server, secret, workdir):
+    # Учётные данные OK.ru не передаются, база и сессии временные: тест не должен возобновить настоящие кампании
+    env = {key: value for key, value in os.environ.items() if not key.startswith("OK_")}
+    env.update({
+        "TELEGRAM_BOT_TOKEN": env.get("TELEGRAM_BOT_TOKEN", "123456:LOADTEST"),
+        "TELEGRAM_USER_ID": env.get("TELEGRAM_USER_ID", "1"),
+        "TELEGRAM_API_BASE_URL": telegram_api.base_url,
+        "USE_WEBHOOK": "true",
+        "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+        "WEBHOOK_SERVER": server,
+        "WEBHOOK_SECRET": secret or "",
+        "DRIVER_POOL_SIZE": "0",
+        "PORT": str(port),
+        "CAMPAIGN_DB": os.path.join(workdir, "campaigns.db"),
+        "SESSION_STORE_DIR": os.path.join(workdir, "sessions"),
+        "CAMPAIGN_AUTO_RESUME": "false",
+    })
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "okru_post_bot.py")],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Бот завершился с кодом {process.returncode}")
+        try:
+            # /health отвечает раньше, чем /webhook: до "bot": "ready" апдейты получают 503
+            response = httpx.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            if response.status_code == 200 and response.json().get("bot", "ready") == "ready":
+                return process
+        except (httpx.HTTPError, ValueError):
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Бот не поднялся за 60 секунд")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/webhook")
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--chat-id", type=int, default=987654321, help="Чат, от имени которого идут апдейты")
+    parser.add_argument("--spawn", action="store_true", help="Запустить бота локально")
+    parser.add_argument("--server", default="asgi", choices=["asgi", "flask"], help="Режим сервера для --spawn")
+    args = parser.parse_args()
+
+    process = telegram_api = workdir = None
+    url = args.url
+    if args.spawn:
+        telegram_api = FakeTelegramAPI().start()
+        workdir = tempfile.mkdtemp(prefix="okloadtest-")
+        port = free_port()
+        process = spawn_bot(port, telegram_api, args.server, args.secret, workdir)
+        url = f"http://127.0.0.1:{port}/webhook"
+
+    try:
+        result = asyncio.run(run_load(url, args.requests, args.concurrency, args.secret, args.chat_id))
+    finally:
+        if process:
+            process.terminate()
+            process.wait(10)
+        if telegram_api:
+            telegram_api.stop()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for key, value in result.items():
+        print(f"{key:>12}: {value}")
+
+
+if __name__ == "__main__":
+    main()
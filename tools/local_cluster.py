@@ -0,0 +1,137 @@
+"""Локальный кластер: диспетчер (SESSION_MODE=distributed) и несколько узлов постинга отдельными процессами.
+
+    # диспетчер на порту 5000 и три узла по 2 профиля; TELEGRAM_* и OK_* берутся из окружения
+    python tools/local_cluster.py --nodes 3 --capacity 2
+
+    # офлайн: OK.ru и Telegram подменены mock_okru и fake_telegram, узел n1 убивается через 30 сек
+    python tools/local_cluster.py --mock --nodes 2 --kill-after 30
+
+Узлы получают NODE_ID n1..nN и свои SESSION_STORE_DIR, база кампаний одна - у диспетчера.
+Логи процессов пишутся в рабочий каталог, раз в несколько секунд печатается раздел nodes из /health.
+Для --mock нужен Chrome: узлы входят на mock OK.ru так же, как на настоящий.
+"""
+import argparse
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+from mock_okru import MockOkSite  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_process(name, env, workdir):
+    log = open(os.path.join(workdir, f"{name}.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "okru_post_bot.py")],
+        env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def stop_process(process, sig=signal.SIGTERM, timeout=15):
+    if process.poll() is not None:
+        return
+    process.send_signal(sig)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def describe(port):
+    try:
+        nodes = httpx.get(f"http://127.0.0.1:{port}/health", timeout=2).json().get("nodes")
+    except (httpx.HTTPError, ValueError) as e:
+        return f"диспетчер недоступен: {e}"
+    if not nodes:
+        return "SESSION_MODE диспетчера не distributed"
+    parts = [f"{n['node']}: {n['profiles']} (молчит {n['silent_for']} сек)" for n in nodes["nodes"]]
+    parts.append(f"ждут узла: {nodes['waiting_for_node']}")
+    parts.append(f"потеряно узлов {nodes['lost']}, переездов {nodes['moved']}")
+    return "  |  ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Диспетчер и узлы постинга локальными процессами")
+    parser.add_argument("--nodes", type=int, default=2, help="Сколько узлов запустить")
+    parser.add_argument("--capacity", type=int, default=2, help="NODE_CAPACITY каждого узла")
+    parser.add_argument("--port", type=int, default=5000, help="Порт диспетчера")
+    parser.add_argument("--timeout", type=float, default=15, help="NODE_TIMEOUT, сек")
+    parser.add_argument("--mock", action="store_true", help="Подменить OK.ru и Telegram локальными заглушками")
+    parser.add_argument("--kill-after", type=float, default=0, help="Убить узел n1 через столько секунд (0 - нет)")
+    parser.add_argument("--interval", type=float, default=5, help="Период вывода состояния, сек")
+    parser.add_argument("--workdir", help="Каталог для базы, сессий и логов (по умолчанию - временный)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="okcluster-")
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ)
+    stubs = []
+    if args.mock:
+        site = MockOkSite().start()
+        telegram_api = FakeTelegramAPI().start()
+        stubs = [site, telegram_api]
+        env.update({
+            "OK_BASE_URL": site.base_url,
+            "TELEGRAM_API_BASE_URL": telegram_api.base_url,
+            "TELEGRAM_BOT_TOKEN": env.get("TELEGRAM_BOT_TOKEN", "123456:CLUSTER"),
+            "TELEGRAM_USER_ID": env.get("TELEGRAM_USER_ID", "1"),
+            "TELEGRAM_MIN_INTERVAL": "0",
+        })
+        for i in range(1, args.nodes * args.capacity + 1):
+            env.setdefault(f"OK_PERSON_{i}", f"Профиль {i}")
+            env.setdefault(f"OK_EMAIL_{i}", f"profile{i}@example.com")
+            env.setdefault(f"OK_PASSWORD_{i}", "secret")
+    env.setdefault("NODE_TOKEN", secrets.token_hex(16))
+    env.setdefault("CAMPAIGN_DB", os.path.join(workdir, "campaigns.db"))
+    env["NODE_TIMEOUT"] = str(args.timeout)
+
+    dispatcher = start_process("dispatcher", dict(
+        env, SESSION_MODE="distributed", PORT=str(args.port), USE_WEBHOOK="false",
+        SESSION_STORE_DIR=os.path.join(workdir, "dispatcher"),
+    ), workdir)
+    nodes = {}
+    for i in range(1, args.nodes + 1):
+        node_id = f"n{i}"
+        nodes[node_id] = start_process(node_id, dict(
+            env, DISPATCHER_URL=f"http://127.0.0.1:{args.port}", NODE_ID=node_id,
+            NODE_CAPACITY=str(args.capacity), SESSION_STORE_DIR=os.path.join(workdir, node_id),
+        ), workdir)
+    print(f"Диспетчер :{args.port} и узлы {', '.join(nodes)} запущены, логи в {workdir}")
+
+    started = time.monotonic()
+    exited = set()
+    try:
+        while dispatcher.poll() is None:
+            time.sleep(args.interval)
+            elapsed = time.monotonic() - started
+            if args.kill_after and elapsed >= args.kill_after and nodes["n1"].poll() is None:
+                nodes["n1"].kill()
+                print(f"{elapsed:6.0f}s  узел n1 убит")
+            for node_id, process in nodes.items():
+                if process.poll() is not None and node_id not in exited:
+                    exited.add(node_id)
+                    print(f"{elapsed:6.0f}s  узел {node_id} завершился с кодом {process.returncode}")
+            print(f"{elapsed:6.0f}s  {describe(args.port)}")
+        print(f"Диспетчер завершился с кодом {dispatcher.returncode}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Сначала диспетчер: он раздаёт узлам команды close, и сессии сохраняются
+        stop_process(dispatcher, signal.SIGINT)
+        for process in nodes.values():
+            stop_process(process)
+        for stub in stubs:
+            stub.stop()
+
+
+if __name__ == "__main__":
+    main()
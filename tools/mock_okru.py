@@ -0,0 +1,302 @@
+"""Локальная подмена OK.ru для бенчмарков и проверки постинга без настоящего сайта.
+
+    python tools/mock_okru.py --port 8090 --login-flow confirm,sms
+
+Страницы повторяют то, на что опирается бот:
+  /              - форма входа (st.email, st.password) или главная с body[data-l=userMain]
+  /confirm       - подтверждение личности ("Yes, confirm")
+  /sms           - SMS-верификация ("Get code" -> поле smsCode -> "Next")
+  /group/<id>/post - contenteditable-поле, карточка превью после ссылки с пробелом,
+                   кнопка js-pf-submit-btn; публикация идёт запросом из скрипта страницы
+Авторизованной считается кука SESSION_COOKIE.
+"""
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SESSION_COOKIE = "mock_okru_session"
+TOKEN = "mock-tkn-1f2e3d"
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body data-l="{data_l}">
+{content}
+</body></html>
+"""
+
+LOGIN_FORM = """<form method="post" action="/login">
+  <input type="text" name="st.email">
+  <input type="password" name="st.password">
+  <input type="submit" value="Log in">
+</form>"""
+
+CONFIRM_FORM = """<form method="post" action="/confirm">
+  <p>Is this you?</p>
+  <input type="submit" value="Yes, confirm">
+</form>"""
+
+GET_CODE_FORM = """<form method="post" action="/sms/get">
+  <input type="submit" value="Get code">
+</form>"""
+
+SMS_CODE_FORM = """<form method="post" action="/sms/check">
+  <input type="text" id="smsCode" name="st.smsCode">
+  <input type="submit" value="Next">
+</form>"""
+
+TOO_OFTEN = "<p>You are requesting codes too often. Try again later.</p>"
+
+# Поля подставляются через replace: в JS слишком много фигурных скобок для format
+POST_CONTENT = """<div class="posting-box">
+  <div contenteditable="true" class="posting_itx" id="editor"></div>
+  <div id="attach"></div>
+  <button type="button" class="button-pro js-pf-submit-btn" data-action="submit">Share</button>
+</div>
+<script>
+const editor = document.getElementById('editor');
+let previewTimer = null;
+editor.addEventListener('input', () => {
+  if (previewTimer || document.querySelector('.vid-card')) return;
+  const match = editor.innerText.match(/https?:\/\/\S+\s/);
+  if (!match) return;
+  previewTimer = setTimeout(() => {
+    const card = document.createElement('div');
+    card.className = 'vid-card vid-card__xl';
+    card.textContent = match[0].trim();
+    document.getElementById('attach').appendChild(card);
+  }, __PREVIEW_DELAY__);
+});
+document.querySelector('.js-pf-submit-btn').addEventListener('click', async () => {
+  const body = new URLSearchParams({'st.posting.text': editor.innerText});
+  const response = await fetch('/group/__GROUP__/post/submit', {
+    method: 'POST',
+    headers: {'TKN': '__TOKEN__', 'Content-Type': 'application/x-www-form-urlencoded'},
+    body: body,
+  });
+  const data = response.ok ? await response.json() : {status: 'error', error: 'HTTP ' + response.status};
+  if (data.status === 'ok') {
+    document.querySelector('.posting-box').remove();
+  } else {
+    const notice = document.createElement('div');
+    notice.className = 'notifications_error';
+    notice.textContent = data.error;
+    document.body.appendChild(notice);
+  }
+});
+</script>"""
+
+
+class MockOkSite:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, preview_delay=0.3,
+                 login_flow=(), too_often=False, sms_code="123456", max_posts_per_minute=0):
+        self.latency = latency
+        self.preview_delay = preview_delay
+        self.login_flow = [step for step in login_flow if step]  # шаги после пароля: confirm, sms
+        self.too_often = too_often
+        self.sms_code = sms_code
+        self.max_posts_per_minute = max_posts_per_minute  # 0 - без ограничения частоты
+        self.rejected = 0
+        self.logins = 0
+        self.posts = []
+        self.sessions = set()
+        self._lock = threading.Lock()
+        self._post_ids = itertools.count(1)
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site._dispatch(self, "GET")
+
+            def do_POST(self):
+                site._dispatch(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="mock-okru", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def new_session(self):
+        """Выдаёт значение куки авторизованной сессии"""
+        value = f"s{next(self._post_ids)}-{int(time.time() * 1000)}"
+        with self._lock:
+            self.sessions.add(value)
+        return value
+
+    # --- обработка запросов ---
+
+    def _session(self, handler):
+        cookie = SimpleCookie(handler.headers.get("Cookie", ""))
+        morsel = cookie.get(SESSION_COOKIE)
+        return morsel.value if morsel and morsel.value in self.sessions else None
+
+    def _form(self, handler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length).decode() if length else ""
+        return {k: v[0] for k, v in parse_qs(body, keep_blank_values=True).items()}
+
+    def _send(self, handler, status, body, content_type="text/html; charset=utf-8", headers=None):
+        payload = body.encode() if isinstance(body, str) else body
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _json(self, handler, status, data):
+        self._send(handler, status, json.dumps(data, ensure_ascii=False), "application/json")
+
+    def _dispatch(self, handler, method):
+        if self.latency:
+            time.sleep(self.latency)
+        path = urlparse(handler.path).path
+        for route_method, pattern, func in self._routes():
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                return func(handler, *match.groups())
+        self._send(handler, 404, "<html><body>Not found</body></html>")
+
+    def _page(self, handler, title, content, logged_in=False, headers=None):
+        data_l = "userMain" if logged_in else "anonymMain"
+        self._send(handler, 200, PAGE.format(title=title, data_l=data_l, content=content), headers=headers)
+
+    def _redirect(self, handler, location, headers=None):
+        handler.send_response(302)
+        handler.send_header("Location", location)
+        handler.send_header("Content-Length", "0")
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+
+    def _next_step(self, handler, done_step=None):
+        """Ведёт по шагам входа; после последнего выдаёт куку сессии"""
+        steps = self.login_flow
+        index = steps.index(done_step) + 1 if done_step in steps else 0
+        if index < len(steps):
+            return self._redirect(handler, f"/{steps[index]}")
+        with self._lock:
+            self.logins += 1
+        cookie = f"{SESSION_COOKIE}={self.new_session()}; Path=/"
+        self._redirect(handler, "/", headers={"Set-Cookie": cookie})
+
+    def _routes(self):
+        return [
+            ("GET", r"/", self._home),
+            ("POST", r"/login", self._login),
+            ("GET", r"/confirm", self._confirm_page),
+            ("POST", r"/confirm", self._confirm),
+            ("GET", r"/sms", self._sms_page),
+            ("POST", r"/sms/get", self._sms_get),
+            ("POST", r"/sms/check", self._sms_check),
+            ("GET", r"/group/(\d+)/post/?", self._post_page),
+            ("POST", r"/group/(\d+)/post/submit", self._post_submit),
+        ]
+
+    def _home(self, handler):
+        if self._session(handler):
+            return self._page(handler, "Лента", "<div id='hook_Block_MainFeed'>Лента</div>", logged_in=True)
+        self._page(handler, "Вход", LOGIN_FORM)
+
+    def _login(self, handler):
+        form = self._form(handler)
+        if not form.get("st.email") or not form.get("st.password"):
+            return self._page(handler, "Вход", "<p class='input-e'>Неверный логин или пароль</p>" + LOGIN_FORM)
+        self._next_step(handler)
+
+    def _confirm_page(self, handler):
+        self._page(handler, "Подтверждение", CONFIRM_FORM)
+
+    def _confirm(self, handler):
+        self._next_step(handler, "confirm")
+
+    def _sms_page(self, handler):
+        self._page(handler, "SMS", GET_CODE_FORM)
+
+    def _sms_get(self, handler):
+        if self.too_often:
+            return self._page(handler, "SMS", TOO_OFTEN + GET_CODE_FORM)
+        self._page(handler, "SMS", SMS_CODE_FORM)
+
+    def _sms_check(self, handler):
+        if self._form(handler).get("st.smsCode") != self.sms_code:
+            return self._page(handler, "SMS", "<p>Wrong code</p>" + SMS_CODE_FORM)
+        self._next_step(handler, "sms")
+
+    def _post_page(self, handler, group_id):
+        content = (
+            POST_CONTENT
+            .replace("__TOKEN__", TOKEN)
+            .replace("__GROUP__", group_id)
+            .replace("__PREVIEW_DELAY__", str(int(self.preview_delay * 1000)))
+        )
+        self._page(handler, f"Группа {group_id}", content, logged_in=bool(self._session(handler)))
+
+    def _post_submit(self, handler, group_id):
+        if not self._session(handler):
+            return self._json(handler, 401, {"status": "error", "error": "not authorized"})
+        if handler.headers.get("TKN") != TOKEN:
+            return self._json(handler, 403, {"status": "error", "error": "bad token"})
+        form = self._form(handler)
+        text = form.get("st.posting.text", "")
+        if not text.strip():
+            return self._json(handler, 400, {"status": "error", "error": "empty post"})
+        if self.max_posts_per_minute:
+            with self._lock:
+                recent = sum(1 for post in self.posts if post["at"] > time.time() - 60)
+                if recent >= self.max_posts_per_minute:
+                    self.rejected += 1
+                    return self._json(handler, 200, {"status": "error", "error": "You are posting too often"})
+        post = {
+            "id": next(self._post_ids),
+            "group": group_id,
+            "text": text,
+            "at": time.time(),
+        }
+        with self._lock:
+            self.posts.append(post)
+        self._json(handler, 200, {"status": "ok", "postId": post["id"]})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная подмена OK.ru")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка каждого ответа, сек")
+    parser.add_argument("--preview-delay", type=float, default=0.3, help="Через сколько появляется превью, сек")
+    parser.add_argument("--login-flow", default="", help="Шаги после пароля через запятую: confirm,sms")
+    parser.add_argument("--too-often", action="store_true", help="Отвечать 'too often' на запрос SMS")
+    parser.add_argument("--max-posts-per-minute", type=int, default=0, help="Лимит постов, сверх него 'too often'")
+    args = parser.parse_args()
+    site = MockOkSite(
+        port=args.port,
+        latency=args.latency,
+        preview_delay=args.preview_delay,
+        login_flow=args.login_flow.split(","),
+        too_often=args.too_often,
+        max_posts_per_minute=args.max_posts_per_minute,
+    ).start()
+    print(f"Mock OK.ru: {site.base_url}  (кука {SESSION_COOKIE}={site.new_session()})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        site.stop()
@@ -0,0 +1,44 @@
+"""Скачивает и патчит chromedriver под установленный Chrome и кладёт его в CHROMEDRIVER_CACHE_DIR.
+
+Запускается при сборке образа, чтобы в рантайме драйвер брался из кэша:
+
+    RUN python tools/prepare_chromedriver.py
+
+    # проверить, что кэш актуален (код выхода 1, если драйвера нет)
+    python tools/prepare_chromedriver.py --check
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модулю бота нужны переменные Telegram, а при сборке их нет
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:prepare")
+os.environ.setdefault("TELEGRAM_USER_ID", "0")
+sys.path.insert(0, ROOT)
+import okru_post_bot  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Кэш пропатченного chromedriver")
+    parser.add_argument("--version", type=int, default=None, help="Основная версия Chrome (по умолчанию - установленная)")
+    parser.add_argument("--check", action="store_true", help="Только проверить наличие в кэше")
+    args = parser.parse_args()
+
+    if not okru_post_bot.CHROMEDRIVER_CACHE_DIR:
+        sys.exit("CHROMEDRIVER_CACHE_DIR пуст - кэш отключён")
+    major = args.version or okru_post_bot.chrome_major_version()
+    path = okru_post_bot.cached_chromedriver_path(major)
+
+    if args.check:
+        okru_post_bot.load_selenium()
+        patched = okru_post_bot.uc.Patcher(executable_path=path, version_main=major).is_binary_patched(path)
+        print(f"chromedriver {major}: {path} ({'есть' if patched else 'нет'})")
+        sys.exit(0 if patched else 1)
+
+    print(okru_post_bot.ensure_patched_chromedriver(major))
+
+
+if __name__ == "__main__":
+    main()